@@ -25,6 +25,10 @@ class SourceParseError(InstaseisError):
     pass
 
 
+class InstaseisCancelledError(InstaseisError):
+    pass
+
+
 def open_db(path, *args, **kwargs):
     """
     Central function to open a local or remote Instaseis database. Any
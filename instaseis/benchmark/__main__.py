@@ -13,6 +13,7 @@ from abc import ABCMeta, abstractmethod, abstractproperty
 import argparse
 import colorama
 import fnmatch
+import json
 import numpy as np
 import obspy
 import os
@@ -24,6 +25,14 @@ import timeit
 
 from instaseis import open_db, Source, Receiver
 
+from .util import (
+    PERCENTILES,
+    compare_to_baseline,
+    get_buffer_efficiency,
+    get_environment,
+    get_stages,
+)
+
 # Write interval.
 WRITE_INTERVAL = 0.05
 
@@ -46,6 +55,24 @@ def plot_gnuplot(times):
         print("Could not plot graph. No gnuplot installed?")
 
 
+def print_stages(stages, total_time, count):
+    print(
+        "\n\t{0:<20} {1:>9} {2:>11} {3:>13} {4:>7}".format(
+            "stage", "calls", "total [s]", "per sm [ms]", "%"
+        )
+    )
+    for stage, s in stages.items():
+        print(
+            "\t{0:<20} {1:>9d} {2:>11.4f} {3:>13.4f} {4:>7.1f}".format(
+                stage,
+                s["calls"],
+                s["total_time"],
+                s["total_time"] / count * 1e3,
+                s["total_time"] / total_time * 100.0,
+            )
+        )
+
+
 class InstaseisBenchmark(metaclass=ABCMeta):
     def __init__(
         self,
@@ -54,12 +81,31 @@ class InstaseisBenchmark(metaclass=ABCMeta):
         save_output=False,
         seed=None,
         count=None,
+        access_log=None,
+        profile=False,
     ):
         self.path = path
         self.time_per_benchmark = time_per_benchmark
         self.save_output = save_output
         self.seed = seed
         self.count = count
+        self.access_log = access_log
+        self.profile = profile
+
+    def record_accesses(self):
+        """
+        Record the mesh coordinates of all element lookups of self.db.
+
+        Only works for local databases.
+        """
+        self.accesses = []
+        get_element_info = self.db._get_element_info
+
+        def _get_element_info(coordinates):
+            self.accesses.append((coordinates.s, coordinates.z))
+            return get_element_info(coordinates=coordinates)
+
+        self.db._get_element_info = _get_element_info
 
     @abstractmethod
     def setup(self):
@@ -83,6 +129,11 @@ class InstaseisBenchmark(metaclass=ABCMeta):
         self.setup()
         b = timeit.default_timer()
         print("\tTime for initialization: %s sec" % (b - a))
+        if self.access_log is not None:
+            self.record_accesses()
+        if self.profile:
+            self.db.stats.reset()
+            self.db.stats.enable()
 
         starttime = timeit.default_timer()
         endtime = starttime + self.time_per_benchmark
@@ -125,6 +176,8 @@ class InstaseisBenchmark(metaclass=ABCMeta):
                 latest_times = []
                 last_write_time = t
         print(79 * " ", end="\r")
+        if self.profile:
+            self.db.stats.disable()
 
         all_times = np.array(all_times, dtype="float64")
         cumtime = sum(all_times)
@@ -138,9 +191,18 @@ class InstaseisBenchmark(metaclass=ABCMeta):
                     p, np.percentile(all_times, p)
                 )
             )
+        if self.profile:
+            stages = get_stages(
+                self.db.stats.as_dict(), total_time=cumtime, count=count
+            )
+            print_stages(stages, total_time=cumtime, count=count)
         sys.stdout.flush()
         plot_gnuplot(all_times)
         time.sleep(0.1)
+        if self.access_log is not None:
+            # Append so all benchmarks end up in the same log.
+            with open(self.access_log, "ab") as fh:
+                np.savetxt(fh, np.array(self.accesses).reshape(-1, 2))
         if self.save_output:
             folder = "benchmark_results"
             if not os.path.exists(folder):
@@ -160,6 +222,19 @@ class InstaseisBenchmark(metaclass=ABCMeta):
                 % (obspy.UTCDateTime()),
             )
 
+        results = {
+            "description": self.description,
+            "count": count,
+            "total_time": float(cumtime),
+            "throughput": count / cumtime,
+            "buffer_efficiency": get_buffer_efficiency(self.db),
+        }
+        for p in PERCENTILES:
+            results["latency_p%i" % p] = float(np.percentile(all_times, p))
+        if self.profile:
+            results["stages"] = stages
+        return results
+
 
 class BufferedFixedSrcRecRoDOffSeismogramGeneration(InstaseisBenchmark):
     def setup(self):
@@ -414,6 +489,36 @@ parser.add_argument(
 parser.add_argument(
     "--save", action="store_true", help="save output to txt file"
 )
+parser.add_argument(
+    "--access_log",
+    type=str,
+    help="append the accessed mesh coordinates to this file - it can be "
+    "used to order the elements when repacking a database",
+)
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="attribute the time to the stages of the extraction recorded by the "
+    "database statistics - they add some overhead",
+)
+parser.add_argument(
+    "--json",
+    type=str,
+    help="write the results and environment metadata to this JSON file",
+)
+parser.add_argument(
+    "--compare",
+    type=str,
+    help="JSON file of an earlier run - the exit status is non-zero if any "
+    "benchmark regressed beyond the threshold",
+)
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="relative change of throughput or latency percentiles that is "
+    "considered a regression (default: 0.1)",
+)
 args = parser.parse_args()
 path = (
     os.path.abspath(args.folder) if "://" not in args.folder else args.folder
@@ -448,7 +553,15 @@ def get_subclasses(cls):
 
 
 benchmarks = [
-    i(path, args.time, args.save, args.seed, args.count)
+    i(
+        path,
+        args.time,
+        args.save,
+        args.seed,
+        args.count,
+        args.access_log,
+        args.profile,
+    )
     for i in get_subclasses(InstaseisBenchmark)
 ]
 benchmarks.sort(key=lambda x: x.description)
@@ -467,6 +580,11 @@ if args.pattern is not None:
 
 print(79 * "=")
 
+if args.compare is not None:
+    with open(args.compare, "r") as fh:
+        baseline = json.load(fh)
+
+results = {}
 for benchmark in benchmarks:
     print("\n")
     print(colorama.Fore.YELLOW + 79 * "=")
@@ -480,4 +598,44 @@ for benchmark in benchmarks:
         + colorama.Fore.RESET,
         end="\n\n",
     )
-    benchmark.run()
+    results[benchmark.__class__.__name__] = benchmark.run()
+
+if args.json is not None:
+    with open(args.json, "w") as fh:
+        json.dump(
+            {"environment": get_environment(db), "benchmarks": results},
+            fh,
+            indent=2,
+            sort_keys=True,
+        )
+    print("\nWrote results to '%s'." % args.json)
+
+if args.compare is not None:
+    regressions = compare_to_baseline(
+        results, baseline["benchmarks"], args.threshold
+    )
+    print("\n" + 79 * "=")
+    print(
+        "Comparison to '%s' (Instaseis %s, %s)"
+        % (
+            args.compare,
+            baseline["environment"]["versions"]["instaseis"],
+            baseline["environment"]["time"],
+        )
+    )
+    print(79 * "=")
+    if not regressions:
+        print(
+            colorama.Fore.GREEN
+            + "No regressions beyond %g %%." % (args.threshold * 100)
+            + colorama.Fore.RESET
+        )
+        sys.exit(0)
+    for name, metric, old, new, change in regressions:
+        print(
+            colorama.Fore.RED
+            + "REGRESSION %s %s: %g -> %g (%+.1f %%)"
+            % (name, metric, old, new, change * 100)
+            + colorama.Fore.RESET
+        )
+    sys.exit(1)
@@ -0,0 +1,584 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load generation benchmark for the Instaseis server.
+
+Starts the server in a separate process on a free port, just like
+``python -m instaseis.server`` with the given executor, process, cache, and
+admission options, and drives its routes with a configurable number of
+concurrent clients and mix of requests.
+
+Usage:
+
+.. code-block:: bash
+
+    $ python -m instaseis.benchmark.server --concurrency 8 \\
+        --mix seismograms:4,seismograms_raw:2,greens_function:1 DB
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import argparse
+import collections
+import concurrent.futures
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import urllib.parse
+
+import colorama
+import numpy as np
+import requests
+
+from instaseis import FiniteSource, open_db
+
+from .util import PERCENTILES, compare_to_baseline, get_environment
+
+ROUTES = ("seismograms", "seismograms_raw", "greens_function", "finite_source")
+
+DEFAULT_MIX = "seismograms:4,seismograms_raw:2,greens_function:2"
+
+
+def parse_mix(mix):
+    """
+    Parse a request mix like ``"seismograms:4,greens_function:1"``.
+
+    :returns: A dictionary mapping routes to their relative weights.
+    """
+    weights = collections.OrderedDict()
+    for item in mix.split(","):
+        route, _, weight = item.strip().partition(":")
+        if route not in ROUTES:
+            raise ValueError(
+                "Unknown route '%s'. Available routes: %s"
+                % (route, ", ".join(ROUTES))
+            )
+        weights[route] = float(weight) if weight else 1.0
+        if weights[route] < 0:
+            raise ValueError("Weights must not be negative.")
+    if not sum(weights.values()):
+        raise ValueError("At least one route needs a positive weight.")
+    return weights
+
+
+class RequestGenerator(object):
+    """
+    Generates random requests for a database.
+
+    Sources and receivers are placed at distances within the range of the
+    database. Thread-safe so all clients can draw from the same generator.
+
+    :param info: The info dictionary of the database.
+    :param weights: Relative weights of the routes.
+    :param seed: Optional seed for reproducible requests.
+    :param format: The requested output format.
+    :param finite_source: The content of a finite source file sent to the
+        ``/finite_source`` route. The receivers are placed relative to its
+        hypocenter.
+    """
+
+    def __init__(
+        self, info, weights, seed=None, format="saczip", finite_source=None
+    ):
+        self.info = info
+        self.format = format
+        self.finite_source = finite_source
+        self.routes = list(weights.keys())
+        p = np.array(list(weights.values()), dtype=np.float64)
+        self.p = p / p.sum()
+        self._rng = np.random.RandomState(seed)
+        self._lock = threading.Lock()
+
+        # Stay clear of the boundaries to not trip the sanity checks of the
+        # server which works with geocentric latitudes.
+        margin = min(0.5, (info.max_d - info.min_d) / 4.0)
+        self.min_d = info.min_d + margin
+        self.max_d = info.max_d - margin
+
+        self._hypocenter = None
+        if finite_source is not None:
+            with io.BytesIO(finite_source) as buf:
+                source = FiniteSource.from_usgs_param_file(buf)
+            source.find_hypocenter()
+            self._hypocenter = (
+                source.hypocenter_latitude,
+                source.hypocenter_longitude,
+            )
+
+    def _random_point(self):
+        lat = np.rad2deg(np.arcsin(2 * self._rng.rand() - 1))
+        lng = self._rng.rand() * 360.0 - 180.0
+        return lat, lng
+
+    def _distance(self):
+        return self.min_d + self._rng.rand() * (self.max_d - self.min_d)
+
+    def _point_at_distance(self, lat, lng, distance):
+        """
+        Point at the given distance in degree and a random azimuth.
+        """
+        lat1, lng1 = np.radians(lat), np.radians(lng)
+        delta = np.radians(distance)
+        azimuth = self._rng.rand() * 2 * np.pi
+        lat2 = np.arcsin(
+            np.sin(lat1) * np.cos(delta)
+            + np.cos(lat1) * np.sin(delta) * np.cos(azimuth)
+        )
+        lng2 = lng1 + np.arctan2(
+            np.sin(azimuth) * np.sin(delta) * np.cos(lat1),
+            np.cos(delta) - np.sin(lat1) * np.sin(lat2),
+        )
+        lng2 = (lng2 + np.pi) % (2 * np.pi) - np.pi
+        return float(np.degrees(lat2)), float(np.degrees(lng2))
+
+    def _depth_in_m(self):
+        if not self.info.is_reciprocal:
+            return self.info.source_depth * 1e3
+        max_depth = self.info.max_radius - self.info.min_radius
+        return self._rng.rand() * max_depth * 0.99
+
+    def __call__(self):
+        """
+        Returns a ``(route, method, url, body)`` tuple.
+        """
+        with self._lock:
+            route = self.routes[self._rng.choice(len(self.routes), p=self.p)]
+            if route == "finite_source":
+                src_lat, src_lng = self._hypocenter
+            else:
+                src_lat, src_lng = self._random_point()
+            distance = self._distance()
+            rec_lat, rec_lng = self._point_at_distance(
+                src_lat, src_lng, distance
+            )
+            depth_in_m = self._depth_in_m()
+
+        source = {
+            "sourcelatitude": src_lat,
+            "sourcelongitude": src_lng,
+            "sourcedepthinmeters": depth_in_m,
+        }
+        receiver = {"receiverlatitude": rec_lat, "receiverlongitude": rec_lng}
+        if route == "seismograms":
+            params = dict(
+                source,
+                sourcemomenttensor="1E19,1E19,1E19,0,0,0",
+                format=self.format,
+                **receiver,
+            )
+        elif route == "seismograms_raw":
+            params = dict(
+                source,
+                mrr=1e19,
+                mtt=1e19,
+                mpp=1e19,
+                mrt=0,
+                mrp=0,
+                mtp=0,
+                **receiver,
+            )
+        elif route == "greens_function":
+            params = {
+                "sourcedistanceindegrees": distance,
+                "sourcedepthinmeters": depth_in_m,
+                "format": self.format,
+            }
+        else:
+            params = dict(format=self.format, **receiver)
+
+        url = "/%s?%s" % (route, urllib.parse.urlencode(params))
+        if route == "finite_source":
+            return route, "POST", url, self.finite_source
+        return route, "GET", url, None
+
+
+def _start_server(db_path, port, server_options):  # pragma: no cover
+    """
+    Run ``python -m instaseis.server`` in a separate process.
+    """
+    cmd = [
+        sys.executable,
+        # Do not flood the output with the same warnings for every request.
+        "-W",
+        "ignore::UserWarning",
+        "-m",
+        "instaseis.server",
+        "--port=%i" % port,
+        "--quiet",
+    ]
+    for key, value in server_options.items():
+        if value is not None:
+            cmd.append("--%s=%s" % (key, value))
+    cmd.append(db_path)
+    return subprocess.Popen(cmd)
+
+
+def _wait_for_server(base_url, server, timeout=60.0):  # pragma: no cover
+    """
+    Wait until the server accepts requests.
+    """
+    starttime = timeit.default_timer()
+    while timeit.default_timer() - starttime < timeout:
+        if server.poll() is not None:
+            return False
+        try:
+            requests.get(base_url + "/", timeout=1.0)
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+            continue
+        return True
+    return False
+
+
+def get_buffer_hit_ratios(base_url):
+    """
+    Hit ratios of the buffers of a running server by buffer name from its
+    ``/metrics`` route.
+    """
+    ratios = {}
+    for line in requests.get(base_url + "/metrics").text.splitlines():
+        if line.startswith("instaseis_buffer_hit_ratio{"):
+            name, value = line.rsplit(" ", 1)
+            ratios[name.split('"')[1]] = float(value)
+    return ratios
+
+
+def _get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _summarize(records, total_time):
+    latencies = np.array([_i[1] for _i in records], dtype=np.float64)
+    nbytes = sum(_i[2] for _i in records)
+    results = {
+        "count": len(records),
+        "errors": sum(1 for _i in records if _i[3] != 200),
+        "throughput": len(records) / total_time,
+        "bytes_per_second": nbytes / total_time,
+    }
+    for p in PERCENTILES:
+        results["latency_p%i" % p] = float(np.percentile(latencies, p))
+    return results
+
+
+def run_load(base_url, generator, concurrency, duration=None, count=None):
+    """
+    Drive the server with concurrent clients.
+
+    :param base_url: The URL of the server.
+    :param generator: A :class:`RequestGenerator`.
+    :param concurrency: The number of concurrent clients.
+    :param duration: Run for this many seconds.
+    :param count: Send this many requests. Overwrites ``duration``.
+    :returns: A dictionary of results per route plus the ``"total"``.
+    """
+    lock = threading.Lock()
+    state = {"sent": 0}
+    records = []
+    starttime = timeit.default_timer()
+
+    def _continue():
+        with lock:
+            if count is not None:
+                if state["sent"] >= count:
+                    return False
+            elif timeit.default_timer() - starttime >= duration:
+                return False
+            state["sent"] += 1
+            return True
+
+    def _client():
+        session = requests.Session()
+        while _continue():
+            route, method, url, body = generator()
+            a = timeit.default_timer()
+            r = session.request(method, base_url + url, data=body)
+            elapsed = timeit.default_timer() - a
+            with lock:
+                records.append((route, elapsed, len(r.content), r.status_code))
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        futures = [executor.submit(_client) for _ in range(concurrency)]
+        for future in futures:
+            future.result()
+    total_time = timeit.default_timer() - starttime
+
+    results = {"total": _summarize(records, total_time)}
+    for route in generator.routes:
+        r = [_i for _i in records if _i[0] == route]
+        if r:
+            results[route] = _summarize(r, total_time)
+    return results
+
+
+def print_results(results):
+    print(
+        "\n{0:<16} {1:>7} {2:>6} {3:>9} {4:>9} {5:>9} {6:>9} {7:>10}".format(
+            "route",
+            "count",
+            "errors",
+            "req/s",
+            "p50 [ms]",
+            "p90 [ms]",
+            "p99 [ms]",
+            "MB/s",
+        )
+    )
+    for route, r in results.items():
+        print(
+            "{0:<16} {1:>7d} {2:>6d} {3:>9.2f} {4:>9.2f} {5:>9.2f} "
+            "{6:>9.2f} {7:>10.3f}".format(
+                route,
+                r["count"],
+                r["errors"],
+                r["throughput"],
+                r["latency_p50"] * 1e3,
+                r["latency_p90"] * 1e3,
+                r["latency_p99"] * 1e3,
+                r["bytes_per_second"] / 1024 ** 2,
+            )
+        )
+
+
+def main(argv=None):  # pragma: no cover
+    parser = argparse.ArgumentParser(
+        prog="python -m instaseis.benchmark.server",
+        description="Benchmark the Instaseis server.",
+    )
+    parser.add_argument(
+        "folder", type=str, help="path to AxiSEM Green's function database"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="number of concurrent clients (default: 4)",
+    )
+    parser.add_argument(
+        "--mix",
+        type=str,
+        default=DEFAULT_MIX,
+        help="comma separated routes with relative weights, one of %s "
+        "(default: %s)" % (", ".join(ROUTES), DEFAULT_MIX),
+    )
+    parser.add_argument(
+        "--time",
+        type=float,
+        default=10.0,
+        help="duration of the benchmark in seconds",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        help="number of requests. Overwrites any time limitations if given.",
+    )
+    parser.add_argument(
+        "--seed", type=int, help="Seed used for the random number generation"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="saczip",
+        choices=["saczip", "miniseed"],
+        help="output format of the requests (default: saczip)",
+    )
+    parser.add_argument(
+        "--finite_source",
+        type=str,
+        help="USGS param file posted to the /finite_source route",
+    )
+    parser.add_argument(
+        "--buffer_size_in_mb",
+        type=int,
+        default=100,
+        help="buffer size of the server (default: 100)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=12,
+        help="number of extraction threads or processes of the server "
+        "(default: 12)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["thread", "process"],
+        default="thread",
+        help="extract in threads or in worker processes (default: thread)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of server processes, 0 for one per core (default: 1)",
+    )
+    parser.add_argument(
+        "--response_cache_size_in_mb",
+        type=int,
+        default=0,
+        help="size of the response cache of the server (default: 0)",
+    )
+    parser.add_argument(
+        "--max_requests",
+        type=int,
+        help="maximum number of time series requests processed at the same "
+        "time by the server",
+    )
+    parser.add_argument(
+        "--max_cost",
+        type=int,
+        help="maximum summed estimated cost of the time series requests "
+        "processed at the same time by the server",
+    )
+    parser.add_argument(
+        "--max_queue_size",
+        type=int,
+        help="maximum number of requests waiting in the queue of the server",
+    )
+    parser.add_argument(
+        "--json",
+        type=str,
+        help="write the results and environment metadata to this JSON file",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        help="JSON file of an earlier run - the exit status is non-zero if "
+        "any route regressed beyond the threshold",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change of throughput or latency percentiles that is "
+        "considered a regression (default: 0.1)",
+    )
+    args = parser.parse_args(argv)
+    path = os.path.abspath(args.folder)
+
+    try:
+        weights = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    db = open_db(path, read_on_demand=True, buffer_size_in_mb=0)
+    if "greens_function" in weights and not (
+        db.info.is_reciprocal
+        and db.info.components == "vertical and horizontal"
+    ):
+        print(
+            "Green's functions require a reciprocal database with vertical "
+            "and horizontal components - skipping."
+        )
+        del weights["greens_function"]
+    finite_source = None
+    if "finite_source" in weights:
+        if args.finite_source is None:
+            parser.error("The finite_source route requires --finite_source.")
+        with open(args.finite_source, "rb") as fh:
+            finite_source = fh.read()
+    if not weights:
+        parser.error("No routes left to benchmark.")
+
+    print(colorama.Fore.GREEN + 79 * "=" + "\nInstaseis Server Benchmark\n")
+    print("Routes: %s" % ", ".join("%s:%g" % _i for _i in weights.items()))
+    print("Concurrent clients: %i" % args.concurrency)
+    print(79 * "=" + colorama.Fore.RESET)
+
+    server_options = {
+        key: getattr(args, key)
+        for key in (
+            "buffer_size_in_mb",
+            "workers",
+            "executor",
+            "processes",
+            "response_cache_size_in_mb",
+            "max_requests",
+            "max_cost",
+            "max_queue_size",
+        )
+    }
+    port = _get_free_port()
+    base_url = "http://127.0.0.1:%i" % port
+    server = _start_server(path, port, server_options)
+    try:
+        if not _wait_for_server(base_url, server):
+            print("Server did not start.")
+            sys.exit(1)
+        generator = RequestGenerator(
+            info=db.info,
+            weights=weights,
+            seed=args.seed,
+            format=args.format,
+            finite_source=finite_source,
+        )
+        results = run_load(
+            base_url,
+            generator,
+            concurrency=args.concurrency,
+            duration=args.time,
+            count=args.count,
+        )
+        buffer_hit_ratios = get_buffer_hit_ratios(base_url)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_results(results)
+    print("\nServer side buffer hit ratios:")
+    for name, ratio in sorted(buffer_hit_ratios.items()):
+        print("\t%s: %.1f %%" % (name, ratio * 100))
+
+    if args.json is not None:
+        environment = get_environment(db)
+        environment["concurrency"] = args.concurrency
+        environment["mix"] = dict(weights)
+        environment["server"] = server_options
+        with open(args.json, "w") as fh:
+            json.dump(
+                {
+                    "environment": environment,
+                    "benchmarks": results,
+                    "buffer_hit_ratios": buffer_hit_ratios,
+                },
+                fh,
+                indent=2,
+                sort_keys=True,
+            )
+        print("\nWrote results to '%s'." % args.json)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as fh:
+            baseline = json.load(fh)
+        regressions = compare_to_baseline(
+            results, baseline["benchmarks"], args.threshold
+        )
+        if not regressions:
+            print(
+                colorama.Fore.GREEN
+                + "\nNo regressions beyond %g %%." % (args.threshold * 100)
+                + colorama.Fore.RESET
+            )
+            return
+        for name, metric, old, new, change in regressions:
+            print(
+                colorama.Fore.RED
+                + "REGRESSION %s %s: %g -> %g (%+.1f %%)"
+                % (name, metric, old, new, change * 100)
+                + colorama.Fore.RESET
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
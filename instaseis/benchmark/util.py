@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Utilities shared by the Instaseis benchmarks.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import multiprocessing
+import platform
+import socket
+
+import h5py
+import numpy as np
+import obspy
+import scipy
+
+import instaseis
+
+# Latency percentiles stored in the JSON output.
+PERCENTILES = (50, 90, 99)
+
+# Stages of the extraction statistics in the order they are reported.
+STAGES = (
+    "extraction",
+    "rotation",
+    "element_location",
+    "kd_tree",
+    "inside_element",
+    "read",
+    "reorder",
+    "derivative",
+    "interpolation",
+    "post_processing",
+    "stf_convolution",
+    "resampling",
+    "obspy_conversion",
+)
+
+
+def get_buffer_efficiency(db):
+    """
+    Buffer efficiency and size of all meshes of a database.
+
+    Remote databases have no buffers and result in an empty dictionary.
+    """
+    meshes = getattr(db, "meshes", None)
+    if meshes is None:
+        return {}
+    efficiency = {}
+    for name, mesh in meshes._asdict().items():
+        if mesh is None:
+            continue
+        efficiency[name] = {
+            "strain_buffer": mesh.strain_buffer.efficiency,
+            "strain_buffer_size_in_mb": mesh.strain_buffer.get_size_mb(),
+            "displ_buffer": mesh.displ_buffer.efficiency,
+            "displ_buffer_size_in_mb": mesh.displ_buffer.get_size_mb(),
+        }
+    return efficiency
+
+
+def get_stages(stats, total_time, count):
+    """
+    Time per stage of the extraction statistics of a database.
+
+    The stages are nested just like the statistics, e.g. ``"read"`` is
+    part of ``"extraction"``. Everything outside of the extraction and the
+    post-processing is reported as ``"other"``.
+
+    :param stats: The statistics as returned by
+        :meth:`~instaseis.database_interfaces.statistics.Statistics.as_dict`.
+    :param total_time: The total time of all extractions.
+    :param count: The number of extracted seismograms.
+    """
+    recorded = stats["stages"]
+    names = [_i for _i in STAGES if _i in recorded]
+    names += sorted(set(recorded) - set(STAGES))
+    stages = {
+        name: {
+            "calls": recorded[name]["count"],
+            "total_time": recorded[name]["time"],
+        }
+        for name in names
+    }
+    outer = sum(
+        recorded[_i]["time"]
+        for _i in ("extraction", "post_processing")
+        if _i in recorded
+    )
+    stages["other"] = {
+        "calls": count,
+        "total_time": max(total_time - outer, 0.0),
+    }
+    return stages
+
+
+def get_environment(db):
+    """
+    Metadata describing the software, the machine, and the database.
+    """
+    return {
+        "time": str(obspy.UTCDateTime()),
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "python": platform.python_version(),
+        "versions": {
+            "instaseis": instaseis.__version__,
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "obspy": obspy.__version__,
+            "h5py": h5py.__version__,
+            "hdf5": h5py.version.hdf5_version,
+        },
+        "database": {
+            "path": str(db.info.directory),
+            "format_version": str(db.info.format_version),
+            "dump_type": str(db.info.dump_type),
+            "period": float(db.info.period),
+            "velocity_model": str(db.info.velocity_model),
+            "components": str(db.info.components),
+            "filesize": int(db.info.filesize),
+        },
+    }
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Find all regressions compared to a baseline.
+
+    The throughput must not drop and the latency percentiles must not rise
+    by more than the given relative threshold. Benchmarks missing in either
+    of the results are ignored.
+
+    :param results: The benchmark results.
+    :param baseline: The baseline benchmark results.
+    :param threshold: The relative threshold, e.g. ``0.1`` for 10 percent.
+    :returns: A list of ``(benchmark, metric, baseline, current, change)``
+        tuples.
+    """
+    regressions = []
+    for name in sorted(set(results) & set(baseline)):
+        current = results[name]
+        reference = baseline[name]
+        # Higher is better for the throughput, lower for the latencies.
+        metrics = [("throughput", -1.0)] + [
+            ("latency_p%i" % p, 1.0) for p in PERCENTILES
+        ]
+        for metric, sign in metrics:
+            if metric not in current or metric not in reference:
+                continue
+            if not reference[metric]:
+                continue
+            change = (current[metric] - reference[metric]) / reference[metric]
+            if sign * change > threshold:
+                regressions.append(
+                    (name, metric, reference[metric], current[metric], change)
+                )
+    return regressions
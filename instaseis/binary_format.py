@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact binary format of the time series routes of the Instaseis server.
+
+A response is a sequence of records, one per receiver, so it can be written
+and read one receiver at a time. Each record consists of
+
+1. the four bytes ``ISBF``,
+2. the length of the header in bytes as a little endian unsigned 32 bit
+   integer,
+3. the UTF-8 encoded JSON header, padded with spaces so the data starts at
+   a multiple of four bytes from the start of the record,
+4. the data of all channels in the order of the header as little endian 32
+   bit floats.
+
+The header is a JSON object with the keys ``version`` (currently ``1``),
+``network``, ``station``, ``location``, ``channels`` (list of channel
+codes), ``starttime`` (ISO 8601 string), ``delta`` (sample spacing in
+seconds), ``npts`` (the number of samples of each channel), and ``mu``
+(the shear modulus at the source in Pa or null for finite sources).
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import json
+import struct
+
+import numpy as np
+import obspy
+
+from . import InstaseisError
+
+MAGIC = b"ISBF"
+VERSION = 1
+
+_PREFIX = struct.Struct("<4sI")
+
+
+def write_record(st, mu):
+    """
+    Binary record of all traces of a single receiver.
+
+    :param st: The traces. They must have the same start time, sample
+        spacing, and number of samples.
+    :type st: :class:`obspy.core.stream.Stream`
+    :param mu: The shear modulus at the source or None.
+    """
+    stats = st[0].stats
+    for tr in st[1:]:
+        if (
+            tr.stats.starttime != stats.starttime
+            or tr.stats.delta != stats.delta
+            or tr.stats.npts != stats.npts
+        ):
+            raise ValueError("All traces must share the same time axis.")
+
+    header = json.dumps(
+        {
+            "version": VERSION,
+            "network": stats.network,
+            "station": stats.station,
+            "location": stats.location,
+            "channels": [tr.stats.channel for tr in st],
+            "starttime": str(stats.starttime),
+            "delta": float(stats.delta),
+            "npts": int(stats.npts),
+            "mu": None if mu is None else float(mu),
+        },
+        sort_keys=True,
+    ).encode()
+    # Align the data to ease reading it without copies.
+    header += b" " * (-(_PREFIX.size + len(header)) % 4)
+
+    parts = [_PREFIX.pack(MAGIC, len(header)), header]
+    for tr in st:
+        parts.append(
+            memoryview(np.require(tr.data, dtype="<f4", requirements="C"))
+        )
+    return b"".join(parts)
+
+
+def iter_records(data):
+    """
+    Iterate over the records of a response. Yields ``(header, arrays)``
+    tuples with the header as a dictionary and a list of arrays, one per
+    channel. The arrays are read-only views into ``data``.
+
+    :param data: The complete response.
+    :type data: bytes
+    """
+    data = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < _PREFIX.size:
+            raise InstaseisError("Truncated Instaseis binary record.")
+        magic, length = _PREFIX.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise InstaseisError("Not an Instaseis binary record.")
+        start = offset + _PREFIX.size
+        offset = start + length
+        header = json.loads(bytes(data[start:offset]).decode())
+        if header["version"] != VERSION:
+            raise InstaseisError(
+                "Unsupported version %s of the Instaseis binary format."
+                % header["version"]
+            )
+
+        npts = header["npts"]
+        size = len(header["channels"]) * npts * 4
+        if len(data) - offset < size:
+            raise InstaseisError("Truncated Instaseis binary record.")
+        arrays = np.frombuffer(
+            data, dtype="<f4", count=size // 4, offset=offset
+        ).reshape(len(header["channels"]), npts)
+        offset += size
+        yield header, list(arrays)
+
+
+def read(data):
+    """
+    Read a response in the binary format to an ObsPy Stream.
+
+    :param data: The complete response.
+    :type data: bytes
+    """
+    st = obspy.Stream()
+    for header, arrays in iter_records(data):
+        for channel, array in zip(header["channels"], arrays):
+            tr = obspy.Trace(
+                data=array.copy(),
+                header={
+                    "network": header["network"],
+                    "station": header["station"],
+                    "location": header["location"],
+                    "channel": channel,
+                    "starttime": obspy.UTCDateTime(header["starttime"]),
+                    "delta": header["delta"],
+                },
+            )
+            st.append(tr)
+    return st
@@ -13,6 +13,7 @@ Abstract base class for all Instaseis database classes.
 from abc import ABCMeta, abstractmethod
 from distutils.version import LooseVersion
 import math
+import threading
 import warnings
 
 import numpy as np
@@ -24,6 +25,7 @@ import scipy.signal
 
 from ..source import Source, ForceSource, Receiver, FiniteSource
 from ..helpers import get_band_code, sizeof_fmt, rfftfreq
+from .statistics import Statistics
 
 
 DEFAULT_MU = 32e9
@@ -60,6 +62,10 @@ def _diff_and_integrate(n_derivative, data, comp, dt_out):
         data[comp] = cumtrapz(data[comp], dx=dt_out, initial=0.0)
 
 
+# Guards the lazy creation of the statistics of all databases.
+_STATS_LOCK = threading.Lock()
+
+
 class BaseInstaseisDB(metaclass=ABCMeta):
     """
     Base class for all Instaseis database classes defining the user interface.
@@ -75,6 +81,7 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         dt=None,
         kernelwidth=12,
         definition="seiscomp",
+        cancellation_token=None,
     ):
         """
         Extract Green's function from the Green's function database.
@@ -109,6 +116,9 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         :type kernelwidth: int
         :param definition: The desired Green's function definition.
         :type definition: str
+        :param cancellation_token: Cancel the extraction from another
+            thread.
+        :type cancellation_token: :class:`~.CancellationToken`
 
         :returns: Multi component seismograms.
         :rtype: A :class:`obspy.core.stream.Stream` object or a dictionary
@@ -198,6 +208,7 @@ class BaseInstaseisDB(metaclass=ABCMeta):
             "kind": kind,
             "kernelwidth": kernelwidth,
             "return_obspy_stream": return_obspy_stream,
+            "cancellation_token": cancellation_token,
         }
 
         items = [
@@ -241,6 +252,7 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         return_obspy_stream=True,
         dt=None,
         kernelwidth=12,
+        cancellation_token=None,
     ):
         """
         Extract seismograms from the Green's function database.
@@ -278,6 +290,9 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         :param kernelwidth: The width of the sinc kernel used for resampling in
             terms of the original sampling interval. Best choose something
             between 10 and 20.
+        :type cancellation_token: :class:`~.CancellationToken`, optional
+        :param cancellation_token: Cancel the extraction from another
+            thread.
 
         :returns: Multi component seismograms.
         :rtype: A :class:`obspy.core.stream.Stream` object or a dictionary
@@ -286,6 +301,9 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         if components is None:
             components = self.default_components
 
+        if cancellation_token is not None:
+            cancellation_token.raise_if_cancelled()
+
         source, receiver = self._get_seismograms_sanity_checks(
             source=source,
             receiver=receiver,
@@ -295,129 +313,150 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         )
 
         # Call the _get_seismograms() method of the respective implementation.
-        data = self._get_seismograms(
-            source=source, receiver=receiver, components=components
-        )
-
-        if dt is None:
-            dt_out = self.info.dt
-        else:
-            dt_out = dt
-
-        stf_deconv_map = {0: self.info.sliprate, 1: self.info.slip}
-
-        # Can never be negative with the current logic.
-        n_derivative = KIND_MAP[kind] - STF_MAP[self.info.stf]
+        with self.stats.timer("extraction"):
+            data = self._get_seismograms(
+                source=source, receiver=receiver, components=components
+            )
 
-        if isinstance(source, ForceSource):
-            n_derivative += 1
+        with self.stats.timer("post_processing"):
+            if dt is None:
+                dt_out = self.info.dt
+            else:
+                dt_out = dt
 
-        if reconvolve_stf and remove_source_shift:
-            raise ValueError(
-                "'remove_source_shift' argument not "
-                "compatible with 'reconvolve_stf'."
-            )
+            stf_deconv_map = {0: self.info.sliprate, 1: self.info.slip}
 
-        # Calculate the final time information about the seismograms.
-        time_information = _get_seismogram_times(
-            info=self.info,
-            origin_time=source.origin_time,
-            dt=dt,
-            kernelwidth=kernelwidth,
-            remove_source_shift=remove_source_shift,
-            reconvolve_stf=reconvolve_stf,
-        )
+            # Can never be negative with the current logic.
+            n_derivative = KIND_MAP[kind] - STF_MAP[self.info.stf]
 
-        for comp in components:
-            if reconvolve_stf:
-                # We assume here that the sliprate is well-behaved,
-                # e.g. zeros at the boundaries and no energy above the mesh
-                # resolution.
-                if source.dt is None or source.sliprate is None:
-                    raise ValueError("source has no source time function")
-
-                if STF_MAP[self.info.stf] not in [0, 1]:
-                    raise NotImplementedError(
-                        "deconvolution not implemented for stf %s"
-                        % (self.info.stf)
-                    )
+            if isinstance(source, ForceSource):
+                n_derivative += 1
 
-                stf_deconv_f = np.fft.rfft(
-                    stf_deconv_map[STF_MAP[self.info.stf]], n=self.info.nfft
+            if reconvolve_stf and remove_source_shift:
+                raise ValueError(
+                    "'remove_source_shift' argument not "
+                    "compatible with 'reconvolve_stf'."
                 )
 
-                if abs((source.dt - self.info.dt) / self.info.dt) > 1e-7:
-                    raise ValueError("dt of the source not compatible")
-
-                stf_conv_f = np.fft.rfft(source.sliprate, n=self.info.nfft)
+            # Calculate the final time information about the seismograms.
+            time_information = _get_seismogram_times(
+                info=self.info,
+                origin_time=source.origin_time,
+                dt=dt,
+                kernelwidth=kernelwidth,
+                remove_source_shift=remove_source_shift,
+                reconvolve_stf=reconvolve_stf,
+            )
 
-                if source.time_shift is not None:
-                    stf_conv_f *= np.exp(
-                        -1j
-                        * rfftfreq(self.info.nfft)
-                        * 2.0
-                        * np.pi
-                        * source.time_shift
-                        / self.info.dt
+            for comp in components:
+                if reconvolve_stf:
+                    with self.stats.timer("stf_convolution"):
+                        # We assume here that the sliprate is well-behaved,
+                        # e.g. zeros at the boundaries and no energy above the
+                        # mesh resolution.
+                        if source.dt is None or source.sliprate is None:
+                            raise ValueError(
+                                "source has no source time function"
+                            )
+
+                        if STF_MAP[self.info.stf] not in [0, 1]:
+                            raise NotImplementedError(
+                                "deconvolution not implemented for stf %s"
+                                % (self.info.stf)
+                            )
+
+                        stf_deconv_f = np.fft.rfft(
+                            stf_deconv_map[STF_MAP[self.info.stf]],
+                            n=self.info.nfft,
+                        )
+
+                        if (
+                            abs((source.dt - self.info.dt) / self.info.dt)
+                            > 1e-7
+                        ):
+                            raise ValueError("dt of the source not compatible")
+
+                        stf_conv_f = np.fft.rfft(
+                            source.sliprate, n=self.info.nfft
+                        )
+
+                        if source.time_shift is not None:
+                            stf_conv_f *= np.exp(
+                                -1j
+                                * rfftfreq(self.info.nfft)
+                                * 2.0
+                                * np.pi
+                                * source.time_shift
+                                / self.info.dt
+                            )
+
+                        # Apply a 5 percent, at least 5 samples taper at the
+                        # end. The first sample is guaranteed to be zero in any
+                        # case.
+                        tlen = max(int(math.ceil(0.05 * len(data[comp]))), 5)
+                        taper = np.ones_like(data[comp])
+                        taper[-tlen:] = scipy.signal.hann(tlen * 2)[tlen:]
+                        dataf = np.fft.rfft(
+                            taper * data[comp], n=self.info.nfft
+                        )
+
+                        # Ensure numerical stability by not dividing with zero.
+                        f = stf_conv_f
+                        _l = np.abs(stf_deconv_f)
+                        _idx = np.where(_l > 0.0)
+                        f[_idx] /= stf_deconv_f[_idx]
+                        f[_l == 0] = 0 + 0j
+
+                        data[comp] = np.fft.irfft(dataf * f)[: self.info.npts]
+
+                if dt is not None:
+                    with self.stats.timer("resampling"):
+                        data[comp] = lanczos_interpolation(
+                            data=np.require(data[comp], requirements=["C"]),
+                            old_start=0,
+                            old_dt=self.info.dt,
+                            new_start=time_information[
+                                "time_shift_at_beginning"
+                            ],
+                            new_dt=dt,
+                            new_npts=time_information[
+                                "npts_before_shift_removal"
+                            ],
+                            a=kernelwidth,
+                            window="blackman",
+                        )
+
+                # Integrate/differentiate before removing the source shift in
+                # order to reduce boundary effects at the start of the signal.
+                #
+                # NEVER to this before the resampling! The error can be really
+                # big.
+                if n_derivative:
+                    _diff_and_integrate(
+                        n_derivative=n_derivative,
+                        data=data,
+                        comp=comp,
+                        dt_out=dt_out,
                     )
 
-                # Apply a 5 percent, at least 5 samples taper at the end.
-                # The first sample is guaranteed to be zero in any case.
-                tlen = max(int(math.ceil(0.05 * len(data[comp]))), 5)
-                taper = np.ones_like(data[comp])
-                taper[-tlen:] = scipy.signal.hann(tlen * 2)[tlen:]
-                dataf = np.fft.rfft(taper * data[comp], n=self.info.nfft)
-
-                # Ensure numerical stability by not dividing with zero.
-                f = stf_conv_f
-                _l = np.abs(stf_deconv_f)
-                _idx = np.where(_l > 0.0)
-                f[_idx] /= stf_deconv_f[_idx]
-                f[_l == 0] = 0 + 0j
-
-                data[comp] = np.fft.irfft(dataf * f)[: self.info.npts]
-
-            if dt is not None:
-                data[comp] = lanczos_interpolation(
-                    data=np.require(data[comp], requirements=["C"]),
-                    old_start=0,
-                    old_dt=self.info.dt,
-                    new_start=time_information["time_shift_at_beginning"],
-                    new_dt=dt,
-                    new_npts=time_information["npts_before_shift_removal"],
-                    a=kernelwidth,
-                    window="blackman",
-                )
-
-            # Integrate/differentiate before removing the source shift in
-            # order to reduce boundary effects at the start of the signal.
-            #
-            # NEVER to this before the resampling! The error can be really big.
-            if n_derivative:
-                _diff_and_integrate(
-                    n_derivative=n_derivative,
-                    data=data,
-                    comp=comp,
-                    dt_out=dt_out,
-                )
+                # If desired, remove the samples before the peak of the source
+                # time function.
+                if remove_source_shift:
+                    data[comp] = data[comp][
+                        time_information["ref_sample"] :  # NOQA
+                    ]
 
-            # If desired, remove the samples before the peak of the source
-            # time function.
-            if remove_source_shift:
-                data[comp] = data[comp][
-                    time_information["ref_sample"] :  # NOQA
-                ]
+            if return_obspy_stream:
+                with self.stats.timer("obspy_conversion"):
+                    data = self._convert_to_stream(
+                        receiver=receiver,
+                        components=components,
+                        data=data,
+                        dt_out=dt_out,
+                        starttime=time_information["starttime"],
+                    )
 
-        if return_obspy_stream:
-            return self._convert_to_stream(
-                receiver=receiver,
-                components=components,
-                data=data,
-                dt_out=dt_out,
-                starttime=time_information["starttime"],
-            )
-        else:
-            return data
+        return data
 
     @staticmethod
     def _convert_to_stream(
@@ -475,6 +514,7 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         kernelwidth=12,
         correct_mu=False,
         progress_callback=None,
+        cancellation_token=None,
     ):
         """
         Extract seismograms for a finite source from an Instaseis database.
@@ -509,6 +549,9 @@ class BaseInstaseisDB(metaclass=ABCMeta):
             sources for each calculated source. Useful for integration into
             user interfaces to provide some kind of progress information. If
             the callback returns ``True``, the calculation will be cancelled.
+        :type cancellation_token: :class:`~.CancellationToken`, optional
+        :param cancellation_token: Cancel the extraction from another
+            thread. Checked before each point source.
 
         :returns: Multi component finite source seismogram.
         :rtype: :class:`obspy.core.stream.Stream`
@@ -522,6 +565,8 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         data_summed = {}
         count = len(sources)
         for _i, source in enumerate(sources):
+            if cancellation_token is not None:
+                cancellation_token.raise_if_cancelled()
             # Don't perform the diff/integration here, but after the
             # resampling later on.
             data = self.get_seismograms(
@@ -824,6 +869,34 @@ class BaseInstaseisDB(metaclass=ABCMeta):
         self.__cached_info = AttribDict(self._get_info())
         return self.__cached_info
 
+    @property
+    def stats(self):
+        """
+        Timings and counters of the seismogram extraction.
+
+        Disabled by default, see
+        :class:`~instaseis.database_interfaces.statistics.Statistics`.
+        """
+        try:
+            return self.__stats
+        except AttributeError:
+            pass
+        # Several threads of the server might ask for it at the same time.
+        with _STATS_LOCK:
+            try:
+                return self.__stats
+            except AttributeError:
+                pass
+            self.__stats = Statistics(buffers=self._get_buffers)
+        return self.__stats
+
+    def _get_buffers(self):
+        """
+        All buffers of the database by name. To be overwritten by
+        databases with buffers.
+        """
+        return {}
+
     def _repr_pretty_(self, p, cycle):  # pragma: no cover
         p.text(str(self))
 
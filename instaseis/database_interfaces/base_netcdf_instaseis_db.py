@@ -55,6 +55,7 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
         db_path,
         buffer_size_in_mb=100,
         read_on_demand=False,
+        chunk_cache=None,
         *args,
         **kwargs,
     ):
@@ -74,10 +75,18 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
             initialization, faster in individual seismogram extraction,
             useful e.g. for finite sources, default).
         :type read_on_demand: bool, optional
+        :param chunk_cache: Parameters of the HDF5 raw data chunk cache.
+            Either ``None`` for the HDF5 defaults, ``"auto"`` to size it
+            from the chunk shape of the database and the buffer size, or a
+            dictionary with any of the ``rdcc_nbytes``, ``rdcc_nslots``, and
+            ``rdcc_w0`` keys as accepted by :class:`h5py.File`. Mostly
+            useful for compressed databases.
+        :type chunk_cache: str or dict, optional
         """
         self.db_path = db_path
         self.buffer_size_in_mb = buffer_size_in_mb
         self.read_on_demand = read_on_demand
+        self.chunk_cache = chunk_cache
 
     def _get_element_info(self, coordinates):
         """
@@ -86,13 +95,17 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
         """
         k_map = {"displ_only": 10, "strain_only": 1, "fullfields": 1}
 
-        nextpoints = self.parsed_mesh.kdtree.query(
-            [coordinates.s, coordinates.z], k=k_map[self.info.dump_type]
-        )
+        with self.stats.timer("kd_tree"):
+            nextpoints = self.parsed_mesh.kdtree.query(
+                [coordinates.s, coordinates.z], k=k_map[self.info.dump_type]
+            )
 
         # Find the element containing the point of interest.
-        mesh = self.parsed_mesh.f["Mesh"]
         if self.info.dump_type == "displ_only":
+            # Get the geometry of all candidate elements at once - this
+            # batches the I/O in read on demand mode.
+            candidates = self.parsed_mesh.get_element_geometry(nextpoints[1])
+
             # Loop over multiple tolerances - this is mainly needed for
             # legacy regional databases that have small elements far from the
             # core.
@@ -101,58 +114,28 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
             # For good databases this should only always choose the first
             # tolerance thus there is not runtime cost.
             id_elem = None
-            for tolerance in [1e-3, 1e-2, 5e-2, 8e-2]:
-                for idx in nextpoints[1]:
-                    corner_points = np.empty((4, 2), dtype="float64")
-
-                    if not self.read_on_demand:
-                        corner_point_ids = self.parsed_mesh.fem_mesh[idx][:4]
-                        eltype = self.parsed_mesh.eltypes[idx]
-                        corner_points[:, 0] = self.parsed_mesh.mesh_S[
-                            corner_point_ids
-                        ]
-                        corner_points[:, 1] = self.parsed_mesh.mesh_Z[
-                            corner_point_ids
-                        ]
-                    else:
-                        corner_point_ids = mesh["fem_mesh"][idx][:4]
-
-                        # When reading from a netcdf file, the indices must be
-                        # sorted for newer netcdf versions. The double
-                        # argsort() gives the indices in the sorted array to
-                        # restore the original order.
-                        eltype = mesh["eltype"][idx]
-
-                        m_s = mesh["mesh_S"]
-                        m_z = mesh["mesh_Z"]
-                        corner_points[:, 0] = [
-                            m_s[_i] for _i in corner_point_ids
-                        ]
-                        corner_points[:, 1] = [
-                            m_z[_i] for _i in corner_point_ids
-                        ]
-
-                    isin, xi, eta = finite_elem_mapping.inside_element(
-                        coordinates.s,
-                        coordinates.z,
-                        corner_points,
-                        eltype,
-                        tolerance=tolerance,
-                    )
-                    if isin:
-                        id_elem = idx
+            with self.stats.timer("inside_element"):
+                for tolerance in [1e-3, 1e-2, 5e-2, 8e-2]:
+                    for idx, geometry in zip(nextpoints[1], candidates):
+                        isin, xi, eta = finite_elem_mapping.inside_element(
+                            coordinates.s,
+                            coordinates.z,
+                            geometry.corner_points,
+                            geometry.eltype,
+                            tolerance=tolerance,
+                        )
+                        if isin:
+                            id_elem = idx
+                            break
+                    if id_elem is not None:
                         break
-                if id_elem is not None:
-                    break
-            else:  # pragma: no cover
-                raise ValueError("Element not found")
-
-            if not self.read_on_demand:
-                gll_point_ids = self.parsed_mesh.sem_mesh[id_elem]
-                axis = bool(self.parsed_mesh.axis[id_elem])
-            else:
-                gll_point_ids = mesh["sem_mesh"][id_elem]
-                axis = bool(mesh["axis"][id_elem])
+                else:  # pragma: no cover
+                    raise ValueError("Element not found")
+
+            corner_points = geometry.corner_points
+            eltype = geometry.eltype
+            gll_point_ids = geometry.gll_point_ids
+            axis = bool(geometry.axis)
 
             if axis:
                 col_points_xi = self.parsed_mesh.glj_points
@@ -220,17 +203,19 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
         else:
             a, b = receiver, source
 
-        rotmesh_s, rotmesh_phi, rotmesh_z = rotations.rotate_frame_rd(
-            a.x(planet_radius=self.info.planet_radius),
-            a.y(planet_radius=self.info.planet_radius),
-            a.z(planet_radius=self.info.planet_radius),
-            b.longitude,
-            b.colatitude,
-        )
+        with self.stats.timer("rotation"):
+            rotmesh_s, rotmesh_phi, rotmesh_z = rotations.rotate_frame_rd(
+                a.x(planet_radius=self.info.planet_radius),
+                a.y(planet_radius=self.info.planet_radius),
+                a.z(planet_radius=self.info.planet_radius),
+                b.longitude,
+                b.colatitude,
+            )
 
         coordinates = Coordinates(s=rotmesh_s, phi=rotmesh_phi, z=rotmesh_z)
 
-        element_info = self._get_element_info(coordinates=coordinates)
+        with self.stats.timer("element_location"):
+            element_info = self._get_element_info(coordinates=coordinates)
 
         return self._get_data(
             source=source,
@@ -285,40 +270,46 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
                 chunks = helpers.io_chunker(s_ids)
                 _temp = []
                 m = mesh_dict[var]
-                if time_axis == 0:
-                    for _c in chunks:
-                        if isinstance(_c, list):
-                            _temp.append(m[:, _c[0] : _c[1]])  # NOQA
-                        else:
-                            _temp.append(m[:, _c])
-                else:
-                    for _c in chunks:
-                        if isinstance(_c, list):
-                            _temp.append(m[_c[0] : _c[1], :].T)  # NOQA
-                        else:
-                            _temp.append(m[_c, :].T)
-
-                _t = np.empty((_temp[0].shape[0], 25), dtype=_temp[0].dtype)
-
-                k = 0
-                for _i in _temp:
-                    if len(_i.shape) == 1:
-                        _t[:, k] = _i
-                        k += 1
+                with self.stats.timer("read"):
+                    if time_axis == 0:
+                        for _c in chunks:
+                            if isinstance(_c, list):
+                                _temp.append(m[:, _c[0] : _c[1]])  # NOQA
+                            else:
+                                _temp.append(m[:, _c])
                     else:
-                        for _j in range(_i.shape[1]):
-                            _t[:, k + _j] = _i[:, _j]
+                        for _c in chunks:
+                            if isinstance(_c, list):
+                                _temp.append(m[_c[0] : _c[1], :].T)  # NOQA
+                            else:
+                                _temp.append(m[_c, :].T)
+
+                # Bring the chunks back into the order of the GLL points.
+                with self.stats.timer("reorder"):
+                    _t = np.empty(
+                        (_temp[0].shape[0], 25), dtype=_temp[0].dtype
+                    )
 
-                        k += _j + 1
+                    k = 0
+                    for _i in _temp:
+                        if len(_i.shape) == 1:
+                            _t[:, k] = _i
+                            k += 1
+                        else:
+                            for _j in range(_i.shape[1]):
+                                _t[:, k + _j] = _i[:, _j]
 
-                _temp = _t
+                            k += _j + 1
 
-                for ipol in range(mesh.npol + 1):
-                    for jpol in range(mesh.npol + 1):
-                        idx = ipol * 5 + jpol
-                        utemp[:, jpol, ipol, i] = _temp[
-                            :, np.argwhere(s_ids == ids[idx])[0][0]
-                        ]
+                    _temp = _t
+
+                    for ipol in range(mesh.npol + 1):
+                        for jpol in range(mesh.npol + 1):
+                            idx = ipol * 5 + jpol
+                            utemp[:, jpol, ipol, i] = _temp[
+                                :, np.argwhere(s_ids == ids[idx])[0][0]
+                            ]
+                self.stats.add_bytes_read(_temp)
 
             strain_fct_map = {
                 "monopole": sem_derivatives.strain_monopole_td,
@@ -326,18 +317,19 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
                 "quadpole": sem_derivatives.strain_quadpole_td,
             }
 
-            strain = strain_fct_map[mesh.excitation_type](
-                utemp,
-                G,
-                GT,
-                col_points_xi,
-                col_points_eta,
-                mesh.npol,
-                mesh.ndumps,
-                corner_points,
-                eltype,
-                axis,
-            )
+            with self.stats.timer("derivative"):
+                strain = strain_fct_map[mesh.excitation_type](
+                    utemp,
+                    G,
+                    GT,
+                    col_points_xi,
+                    col_points_eta,
+                    mesh.npol,
+                    mesh.ndumps,
+                    corner_points,
+                    eltype,
+                    axis,
+                )
 
             mesh.strain_buffer.add(id_elem, strain)
         else:
@@ -345,10 +337,11 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
 
         final_strain = np.empty((strain.shape[0], 6), order="F")
 
-        for i in range(6):
-            final_strain[:, i] = spectral_basis.lagrange_interpol_2D_td(
-                col_points_xi, col_points_eta, strain[:, :, :, i], xi, eta
-            )
+        with self.stats.timer("interpolation"):
+            for i in range(6):
+                final_strain[:, i] = spectral_basis.lagrange_interpol_2D_td(
+                    col_points_xi, col_points_eta, strain[:, :, :, i], xi, eta
+                )
 
         if not mesh.excitation_type == "monopole":
             final_strain[:, 3] *= -1.0
@@ -380,7 +373,9 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
                 time_axis = mesh.time_axis[var]
 
                 if time_axis == 0:
-                    strain_temp[:, i] = mesh_dict[var][:, id_elem]
+                    with self.stats.timer("read"):
+                        strain_temp[:, i] = mesh_dict[var][:, id_elem]
+                    self.stats.add_bytes_read(strain_temp[:, i])
                 else:  # pragma: no cover
                     # We don't have an example for this yet so we just raise
                     # here for now - implementing it should just be a matter
@@ -441,22 +436,21 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
                 ids = gll_point_ids.flatten()
                 s_ids = np.sort(ids)
 
-                if time_axis == 0:
-                    temp = mesh_dict[var][:, s_ids]
+                with self.stats.timer("read"):
+                    if time_axis == 0:
+                        temp = mesh_dict[var][:, s_ids]
+                    else:
+                        temp = mesh_dict[var][s_ids, :].T
+                self.stats.add_bytes_read(temp)
+
+                # Bring the data back into the order of the GLL points.
+                with self.stats.timer("reorder"):
                     for ipol in range(mesh.npol + 1):
                         for jpol in range(mesh.npol + 1):
                             idx = ipol * 5 + jpol
                             utemp[:, jpol, ipol, i] = temp[
                                 :, np.argwhere(s_ids == ids[idx])[0][0]
                             ]
-                else:
-                    temp = mesh_dict[var][s_ids, :]
-                    for ipol in range(mesh.npol + 1):
-                        for jpol in range(mesh.npol + 1):
-                            idx = ipol * 5 + jpol
-                            utemp[:, jpol, ipol, i] = temp[
-                                np.argwhere(s_ids == ids[idx])[0][0], :
-                            ]
 
             mesh.displ_buffer.add(id_elem, utemp)
         else:
@@ -464,13 +458,26 @@ class BaseNetCDFInstaseisDB(BaseInstaseisDB, metaclass=ABCMeta):
 
         final_displacement = np.empty((utemp.shape[0], 3), order="F")
 
-        for i in range(3):
-            final_displacement[:, i] = spectral_basis.lagrange_interpol_2D_td(
-                col_points_xi, col_points_eta, utemp[:, :, :, i], xi, eta
-            )
+        with self.stats.timer("interpolation"):
+            for i in range(3):
+                final_displacement[
+                    :, i
+                ] = spectral_basis.lagrange_interpol_2D_td(
+                    col_points_xi, col_points_eta, utemp[:, :, :, i], xi, eta
+                )
 
         return final_displacement
 
+    def _get_buffers(self):
+        buffers = {}
+        for name, mesh in self.meshes._asdict().items():
+            if mesh is None:
+                continue
+            buffers["%s_strain" % name] = mesh.strain_buffer
+            buffers["%s_displ" % name] = mesh.displ_buffer
+            buffers["%s_geometry" % name] = mesh.geometry_buffer
+        return buffers
+
     def _get_info(self):
         """
         Returns a dictionary with information about the currently loaded
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cooperative cancellation of running extractions.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import threading
+
+from .. import InstaseisCancelledError
+
+
+class CancellationToken(object):
+    """
+    Cancel extractions running in another thread.
+
+    Pass it to the ``get_seismograms()``,
+    ``get_seismograms_finite_source()``, or ``get_greens_function()``
+    methods of a database. Once :meth:`cancel` has been called they raise
+    an :class:`~instaseis.InstaseisCancelledError` before extracting the
+    next seismogram or point source.
+
+    >>> token = CancellationToken()  # doctest: +SKIP
+    >>> # In another thread.
+    >>> db.get_seismograms_finite_source(
+    ...     sources=finite_source, receiver=rec,
+    ...     cancellation_token=token)  # doctest: +SKIP
+    >>> token.cancel()  # doctest: +SKIP
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise InstaseisCancelledError("The extraction has been cancelled.")
@@ -50,6 +50,13 @@ class ForwardInstaseisDB(BaseNetCDFInstaseisDB):
             initialization, faster in individual seismogram extraction,
             useful e.g. for finite sources, default).
         :type read_on_demand: bool, optional
+        :param chunk_cache: Parameters of the HDF5 raw data chunk cache.
+            Either ``None`` for the HDF5 defaults, ``"auto"`` to size it
+            from the chunk shape of the database and the buffer size, or a
+            dictionary with any of the ``rdcc_nbytes``, ``rdcc_nslots``, and
+            ``rdcc_w0`` keys as accepted by :class:`h5py.File`. Mostly
+            useful for compressed databases.
+        :type chunk_cache: str or dict, optional
         """
         BaseNetCDFInstaseisDB.__init__(
             self,
@@ -68,6 +75,7 @@ class ForwardInstaseisDB(BaseNetCDFInstaseisDB):
             strain_buffer_size_in_mb=0,
             displ_buffer_size_in_mb=self.buffer_size_in_mb,
             read_on_demand=self.read_on_demand,
+            chunk_cache=self.chunk_cache,
         )
         m2_m = mesh.Mesh(
             files["MXX_P_MYY"],
@@ -75,6 +83,7 @@ class ForwardInstaseisDB(BaseNetCDFInstaseisDB):
             strain_buffer_size_in_mb=0,
             displ_buffer_size_in_mb=self.buffer_size_in_mb,
             read_on_demand=self.read_on_demand,
+            chunk_cache=self.chunk_cache,
         )
         m3_m = mesh.Mesh(
             files["MXZ_MYZ"],
@@ -82,6 +91,7 @@ class ForwardInstaseisDB(BaseNetCDFInstaseisDB):
             strain_buffer_size_in_mb=0,
             displ_buffer_size_in_mb=self.buffer_size_in_mb,
             read_on_demand=self.read_on_demand,
+            chunk_cache=self.chunk_cache,
         )
         m4_m = mesh.Mesh(
             files["MXY_MXX_M_MYY"],
@@ -89,6 +99,7 @@ class ForwardInstaseisDB(BaseNetCDFInstaseisDB):
             strain_buffer_size_in_mb=0,
             displ_buffer_size_in_mb=self.buffer_size_in_mb,
             read_on_demand=self.read_on_demand,
+            chunk_cache=self.chunk_cache,
         )
         self.parsed_mesh = m1_m
 
@@ -50,6 +50,13 @@ class ForwardMergedInstaseisDB(BaseNetCDFInstaseisDB):
             initialization, faster in individual seismogram extraction,
             useful e.g. for finite sources, default).
         :type read_on_demand: bool, optional
+        :param chunk_cache: Parameters of the HDF5 raw data chunk cache.
+            Either ``None`` for the HDF5 defaults, ``"auto"`` to size it
+            from the chunk shape of the database and the buffer size, or a
+            dictionary with any of the ``rdcc_nbytes``, ``rdcc_nslots``, and
+            ``rdcc_w0`` keys as accepted by :class:`h5py.File`. Mostly
+            useful for compressed databases.
+        :type chunk_cache: str or dict, optional
         """
         BaseNetCDFInstaseisDB.__init__(
             self,
@@ -74,6 +81,7 @@ class ForwardMergedInstaseisDB(BaseNetCDFInstaseisDB):
                 strain_buffer_size_in_mb=self.buffer_size_in_mb,
                 displ_buffer_size_in_mb=self.buffer_size_in_mb,
                 read_on_demand=self.read_on_demand,
+                chunk_cache=self.chunk_cache,
             )
         )
         self.parsed_mesh = self.meshes.merged
@@ -105,104 +113,108 @@ class ForwardMergedInstaseisDB(BaseNetCDFInstaseisDB):
 
         # Get from netcdf file or buffer.
         if ei.id_elem not in self.parsed_mesh.displ_buffer:
-            utemp = self.meshes.merged.f["MergedSnapshots"][ei.id_elem]
-
-            # utemp is currently (nvars, jpol, ipol, npts)
-            # 1. Roll to (npts, nvar, jpol, ipol)
-            utemp = np.rollaxis(utemp, 3, 0)
-            # 2. Roll to (npts, jpol, nvar, ipol)
-            utemp = np.rollaxis(utemp, 2, 1)
-            # 3. Roll to (npts, jpol, ipol, nvar)
-            utemp = np.rollaxis(utemp, 3, 2)
+            with self.stats.timer("read"):
+                utemp = self.meshes.merged.read_merged_element(ei.id_elem)
+            self.stats.add_bytes_read(utemp)
+
+            with self.stats.timer("reorder"):
+                # utemp is currently (nvars, jpol, ipol, npts)
+                # 1. Roll to (npts, nvar, jpol, ipol)
+                utemp = np.rollaxis(utemp, 3, 0)
+                # 2. Roll to (npts, jpol, nvar, ipol)
+                utemp = np.rollaxis(utemp, 2, 1)
+                # 3. Roll to (npts, jpol, ipol, nvar)
+                utemp = np.rollaxis(utemp, 3, 2)
 
             self.parsed_mesh.displ_buffer.add(ei.id_elem, utemp)
         else:
             utemp = self.parsed_mesh.displ_buffer.get(ei.id_elem)
 
-        displ_1 = np.zeros((utemp.shape[0], 3), order="F")
-        displ_2 = np.zeros((utemp.shape[0], 3), order="F")
-        displ_3 = np.zeros((utemp.shape[0], 3), order="F")
-        displ_4 = np.zeros((utemp.shape[0], 3), order="F")
-
-        # Now just fill them all.
-        # displ_1 is generated from MZZ which has only two displacement
-        # components.
-        displ_1[:, 0] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 0],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        displ_1[:, 2] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 1],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        # displ_2 is generated from MXX+MYY which has only two displacement
-        # components.
-        displ_2[:, 0] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 2],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        displ_2[:, 2] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 3],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        # displ_3 is generated from MXZ/MYZ which has three displacement
-        # components.
-        displ_3[:, 0] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 4],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        displ_3[:, 1] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 5],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        displ_3[:, 2] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 6],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        # displ_3 is generated from MXY/MXX-MYY which has three displacement
-        # components.
-        displ_4[:, 0] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 7],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        displ_4[:, 1] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 8],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
-        displ_4[:, 2] = spectral_basis.lagrange_interpol_2D_td(
-            points1=ei.col_points_xi,
-            points2=ei.col_points_eta,
-            coefficients=utemp[:, :, :, 9],
-            x1=ei.xi,
-            x2=ei.eta,
-        )
+        with self.stats.timer("interpolation"):
+            displ_1 = np.zeros((utemp.shape[0], 3), order="F")
+            displ_2 = np.zeros((utemp.shape[0], 3), order="F")
+            displ_3 = np.zeros((utemp.shape[0], 3), order="F")
+            displ_4 = np.zeros((utemp.shape[0], 3), order="F")
+
+            # Now just fill them all.
+            # displ_1 is generated from MZZ which has only two displacement
+            # components.
+            displ_1[:, 0] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 0],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            displ_1[:, 2] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 1],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            # displ_2 is generated from MXX+MYY which has only two displacement
+            # components.
+            displ_2[:, 0] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 2],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            displ_2[:, 2] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 3],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            # displ_3 is generated from MXZ/MYZ which has three displacement
+            # components.
+            displ_3[:, 0] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 4],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            displ_3[:, 1] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 5],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            displ_3[:, 2] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 6],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            # displ_3 is generated from MXY/MXX-MYY which has three
+            # displacement components.
+            displ_4[:, 0] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 7],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            displ_4[:, 1] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 8],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
+            displ_4[:, 2] = spectral_basis.lagrange_interpol_2D_td(
+                points1=ei.col_points_xi,
+                points2=ei.col_points_eta,
+                coefficients=utemp[:, :, :, 9],
+                x1=ei.xi,
+                x2=ei.eta,
+            )
 
         mij = source.tensor / self.parsed_mesh.amplitude
         # mij is [m_rr, m_tt, m_pp, m_rt, m_rp, m_tp]
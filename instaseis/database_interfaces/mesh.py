@@ -21,7 +21,7 @@ instead of
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 import h5py
 import numpy as np
@@ -85,6 +85,20 @@ class Buffer(object):
     def get_size_mb(self):
         return float(self._total_size) / 1024 ** 2
 
+    @property
+    def hits(self):
+        """
+        Number of calls to the __contains__() routine that returned True.
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """
+        Number of calls to the __contains__() routine that returned False.
+        """
+        return self._fails
+
     @property
     def efficiency(self):
         """
@@ -97,6 +111,20 @@ class Buffer(object):
             return float(self._hits) / float(self._hits + self._fails)
 
 
+# Parameters of the HDF5 raw data chunk cache that can be set per file.
+CHUNK_CACHE_KEYS = ("rdcc_nbytes", "rdcc_nslots", "rdcc_w0")
+
+# The automatically sized chunk cache holds at least this many chunks and
+# otherwise uses this fraction of the buffer budget.
+AUTO_CHUNK_CACHE_MIN_CHUNKS = 16
+AUTO_CHUNK_CACHE_BUFFER_FRACTION = 0.25
+
+
+ElementGeometry = namedtuple(
+    "ElementGeometry", ["corner_points", "eltype", "gll_point_ids", "axis"]
+)
+
+
 def get_time_axis(ds, ndumps):
     """
     Helper function to determine the time axis of the mesh.
@@ -118,6 +146,69 @@ def get_time_axis(ds, ndumps):
         )
 
 
+def _next_prime(n):
+    """
+    Smallest prime number larger or equal to n.
+    """
+    n = max(int(n), 2)
+    while True:
+        if all(n % _i for _i in range(2, int(n ** 0.5) + 1)):
+            return n
+        n += 1
+
+
+def get_auto_chunk_cache(f, buffer_size_in_mb):
+    """
+    Determine the HDF5 chunk cache parameters for an open file.
+
+    The cache is sized from the largest chunk of the wavefield datasets so
+    that it holds at least ``AUTO_CHUNK_CACHE_MIN_CHUNKS`` chunks and
+    otherwise ``AUTO_CHUNK_CACHE_BUFFER_FRACTION`` of the buffer budget.
+    Without this, a single decompressed chunk of a large database might not
+    even fit into the default 1 MB cache and would be decompressed for
+    every read.
+
+    :param f: The open h5py file.
+    :param buffer_size_in_mb: The buffer budget in MB.
+    :returns: A dictionary with the chunk cache parameters. Empty if the
+        wavefield is not stored in chunked datasets.
+    """
+    datasets = []
+    if "MergedSnapshots" in f:
+        datasets.append(f["MergedSnapshots"])
+    if "Snapshots" in f:
+        datasets.extend(
+            value for key, value in f["Snapshots"].items() if "stf" not in key
+        )
+
+    chunk_nbytes = [
+        int(np.prod(_d.chunks)) * _d.dtype.itemsize
+        for _d in datasets
+        if _d.chunks is not None
+    ]
+    if not chunk_nbytes:
+        return {}
+    chunk_nbytes = max(chunk_nbytes)
+
+    n_chunks = max(
+        AUTO_CHUNK_CACHE_MIN_CHUNKS,
+        int(
+            AUTO_CHUNK_CACHE_BUFFER_FRACTION
+            * buffer_size_in_mb
+            * 1024 ** 2
+            // chunk_nbytes
+        ),
+    )
+
+    # HDF5 recommends a prime number of slots of about 100 times the number
+    # of chunks that fit into the cache.
+    return {
+        "rdcc_nbytes": n_chunks * chunk_nbytes,
+        "rdcc_nslots": _next_prime(100 * n_chunks),
+        "rdcc_w0": 0.75,
+    }
+
+
 class Mesh(object):
     """
     A class to handle the actual netCDF files written by AxiSEM.
@@ -133,14 +224,39 @@ class Mesh(object):
         strain_buffer_size_in_mb=0,
         displ_buffer_size_in_mb=0,
         read_on_demand=True,
+        geometry_buffer_size_in_mb=5,
+        chunk_cache=None,
     ):
-        self.f = h5py.File(filename, "r")
+        if chunk_cache == "auto":
+            with h5py.File(filename, "r") as f:
+                chunk_cache = get_auto_chunk_cache(
+                    f, max(strain_buffer_size_in_mb, displ_buffer_size_in_mb)
+                )
+        elif chunk_cache is None:
+            chunk_cache = {}
+        else:
+            unknown = set(chunk_cache).difference(CHUNK_CACHE_KEYS)
+            if unknown:
+                raise ValueError(
+                    "Unknown chunk cache parameter(s): %s. Valid: %s."
+                    % (
+                        ", ".join(sorted(unknown)),
+                        ", ".join(CHUNK_CACHE_KEYS),
+                    )
+                )
+            chunk_cache = dict(chunk_cache)
+        self.chunk_cache = chunk_cache
+
+        self.f = h5py.File(filename, "r", **chunk_cache)
         self.filename = filename
         self.read_on_demand = read_on_demand
         self._parse(full_parse=full_parse)
         self._find_time_axis()
         self.strain_buffer = Buffer(strain_buffer_size_in_mb)
         self.displ_buffer = Buffer(displ_buffer_size_in_mb)
+        # Only used with read_on_demand=True - otherwise all geometry
+        # information is already in memory.
+        self.geometry_buffer = Buffer(geometry_buffer_size_in_mb)
 
     def _get_str_attr(self, name):
         attr = self.f.attrs[name]
@@ -196,6 +312,13 @@ class Mesh(object):
         self.ndumps = self.f.attrs["number of strain dumps"][0]
         self.excitation_type = self._get_str_attr("excitation type")
 
+        # Quantized merged databases store integers and a scale factor per
+        # element and variable.
+        if "MergedSnapshotsScale" in self.f:
+            self.merged_scale = self.f["MergedSnapshotsScale"][:]
+        else:
+            self.merged_scale = None
+
         # The rest is not needed for every mesh.
 
         if full_parse is False:
@@ -337,3 +460,85 @@ class Mesh(object):
 
             if not self.read_on_demand:
                 self.mesh_mu = self.f["Mesh"]["mesh_mu"][:]
+
+    def get_element_geometry(self, element_ids):
+        """
+        Get the corner points, element types, GLL point ids, and axis flags
+        of a number of elements.
+
+        In read on demand mode all elements that are not yet buffered are
+        read with a single sorted fancy index read per dataset instead of
+        one read per value.
+
+        :param element_ids: The ids of the elements.
+        :returns: A list of :class:`ElementGeometry` objects in the order of
+            ``element_ids``.
+        """
+        element_ids = np.atleast_1d(element_ids)
+
+        if not self.read_on_demand:
+            corner_point_ids = self.fem_mesh[element_ids, :4]
+            corner_points = np.empty(
+                (len(element_ids), 4, 2), dtype=np.float64
+            )
+            corner_points[:, :, 0] = self.mesh_S[corner_point_ids]
+            corner_points[:, :, 1] = self.mesh_Z[corner_point_ids]
+            return [
+                ElementGeometry(
+                    corner_points=corner_points[_i],
+                    eltype=self.eltypes[_e],
+                    gll_point_ids=self.sem_mesh[_e],
+                    axis=self.axis[_e],
+                )
+                for _i, _e in enumerate(element_ids)
+            ]
+
+        geometry = {}
+        missing = []
+        for _e in element_ids:
+            if _e in self.geometry_buffer:
+                geometry[_e] = self.geometry_buffer.get(_e)
+            else:
+                missing.append(_e)
+
+        if missing:
+            # The HDF5 fancy indexing requires sorted and unique indices.
+            missing = np.unique(missing)
+            mesh = self.f["Mesh"]
+            corner_point_ids = mesh["fem_mesh"][missing, :4]
+            eltypes = mesh["eltype"][missing]
+            sem_mesh = mesh["sem_mesh"][missing]
+            axis = mesh["axis"][missing]
+
+            # Read all corner points in one go and map them back.
+            u_ids, inverse = np.unique(corner_point_ids, return_inverse=True)
+            inverse = inverse.reshape(corner_point_ids.shape)
+            corner_points = np.empty((len(missing), 4, 2), dtype=np.float64)
+            corner_points[:, :, 0] = mesh["mesh_S"][u_ids][inverse]
+            corner_points[:, :, 1] = mesh["mesh_Z"][u_ids][inverse]
+
+            for _i, _e in enumerate(missing):
+                geometry[_e] = ElementGeometry(
+                    corner_points=corner_points[_i].copy(),
+                    eltype=eltypes[_i],
+                    gll_point_ids=sem_mesh[_i].copy(),
+                    axis=axis[_i],
+                )
+                self.geometry_buffer.add(_e, geometry[_e])
+
+        return [geometry[_e] for _e in element_ids]
+
+    def read_merged_element(self, id_elem):
+        """
+        Read the data of a single element from a merged database.
+
+        Quantized data is transparently converted back to floating point
+        values.
+
+        :param id_elem: The id of the element.
+        :returns: Array of shape ``(nvars, jpol, ipol, npts)``.
+        """
+        utemp = self.f["MergedSnapshots"][id_elem]
+        if self.merged_scale is not None:
+            utemp = utemp * self.merged_scale[id_elem][:, None, None, None]
+        return utemp
@@ -50,6 +50,13 @@ class ReciprocalInstaseisDB(BaseNetCDFInstaseisDB):
             initialization, faster in individual seismogram extraction,
             useful e.g. for finite sources, default).
         :type read_on_demand: bool, optional
+        :param chunk_cache: Parameters of the HDF5 raw data chunk cache.
+            Either ``None`` for the HDF5 defaults, ``"auto"`` to size it
+            from the chunk shape of the database and the buffer size, or a
+            dictionary with any of the ``rdcc_nbytes``, ``rdcc_nslots``, and
+            ``rdcc_w0`` keys as accepted by :class:`h5py.File`. Mostly
+            useful for compressed databases.
+        :type chunk_cache: str or dict, optional
         """
         BaseNetCDFInstaseisDB.__init__(
             self,
@@ -81,6 +88,7 @@ class ReciprocalInstaseisDB(BaseNetCDFInstaseisDB):
                 strain_buffer_size_in_mb=self.buffer_size_in_mb,
                 displ_buffer_size_in_mb=self.buffer_size_in_mb,
                 read_on_demand=self.read_on_demand,
+                chunk_cache=self.chunk_cache,
             )
             pz_m = mesh.Mesh(
                 pz_file,
@@ -88,6 +96,7 @@ class ReciprocalInstaseisDB(BaseNetCDFInstaseisDB):
                 strain_buffer_size_in_mb=self.buffer_size_in_mb,
                 displ_buffer_size_in_mb=self.buffer_size_in_mb,
                 read_on_demand=self.read_on_demand,
+                chunk_cache=self.chunk_cache,
             )
             self.parsed_mesh = px_m
         elif x_exists:
@@ -97,6 +106,7 @@ class ReciprocalInstaseisDB(BaseNetCDFInstaseisDB):
                 strain_buffer_size_in_mb=self.buffer_size_in_mb,
                 displ_buffer_size_in_mb=self.buffer_size_in_mb,
                 read_on_demand=self.read_on_demand,
+                chunk_cache=self.chunk_cache,
             )
             pz_m = None
             self.parsed_mesh = px_m
@@ -108,6 +118,7 @@ class ReciprocalInstaseisDB(BaseNetCDFInstaseisDB):
                 strain_buffer_size_in_mb=self.buffer_size_in_mb,
                 displ_buffer_size_in_mb=self.buffer_size_in_mb,
                 read_on_demand=self.read_on_demand,
+                chunk_cache=self.chunk_cache,
             )
             self.parsed_mesh = pz_m
         else:
@@ -50,6 +50,13 @@ class ReciprocalMergedInstaseisDB(BaseNetCDFInstaseisDB):
             initialization, faster in individual seismogram extraction,
             useful e.g. for finite sources, default).
         :type read_on_demand: bool, optional
+        :param chunk_cache: Parameters of the HDF5 raw data chunk cache.
+            Either ``None`` for the HDF5 defaults, ``"auto"`` to size it
+            from the chunk shape of the database and the buffer size, or a
+            dictionary with any of the ``rdcc_nbytes``, ``rdcc_nslots``, and
+            ``rdcc_w0`` keys as accepted by :class:`h5py.File`. Mostly
+            useful for compressed databases.
+        :type chunk_cache: str or dict, optional
         """
         BaseNetCDFInstaseisDB.__init__(
             self,
@@ -74,6 +81,7 @@ class ReciprocalMergedInstaseisDB(BaseNetCDFInstaseisDB):
                 strain_buffer_size_in_mb=self.buffer_size_in_mb,
                 displ_buffer_size_in_mb=self.buffer_size_in_mb,
                 read_on_demand=self.read_on_demand,
+                chunk_cache=self.chunk_cache,
             )
         )
         self.parsed_mesh = self.meshes.merged
@@ -261,15 +269,18 @@ class ReciprocalMergedInstaseisDB(BaseNetCDFInstaseisDB):
 
     def _get_and_reorder_utemp(self, id_elem):
         # We can now read it in a single go!
-        utemp = self.meshes.merged.f["MergedSnapshots"][id_elem]
-
-        # utemp is currently (nvars, jpol, ipol, npts)
-        # 1. Roll to (npts, nvar, jpol, ipol)
-        utemp = np.rollaxis(utemp, 3, 0)
-        # 2. Roll to (npts, jpol, nvar, ipol)
-        utemp = np.rollaxis(utemp, 2, 1)
-        # 3. Roll to (npts, jpol, ipol, nvar)
-        utemp = np.rollaxis(utemp, 3, 2)
+        with self.stats.timer("read"):
+            utemp = self.meshes.merged.read_merged_element(id_elem)
+        self.stats.add_bytes_read(utemp)
+
+        with self.stats.timer("reorder"):
+            # utemp is currently (nvars, jpol, ipol, npts)
+            # 1. Roll to (npts, nvar, jpol, ipol)
+            utemp = np.rollaxis(utemp, 3, 0)
+            # 2. Roll to (npts, jpol, nvar, ipol)
+            utemp = np.rollaxis(utemp, 2, 1)
+            # 3. Roll to (npts, jpol, ipol, nvar)
+            utemp = np.rollaxis(utemp, 3, 2)
 
         return utemp
 
@@ -299,84 +310,95 @@ class ReciprocalMergedInstaseisDB(BaseNetCDFInstaseisDB):
 
             # We want the cache to work - thus we always have to
             # calculate both! Also I/O is the slow part here.
-
-            # Horizontal component is available if we have 3 or 5 components.
-            if utemp.shape[-1] >= 3:
-                utemp_x = utemp[:, :, :, :3]
-                utemp_x = np.require(
-                    utemp_x, requirements=["F"], dtype=np.float64
-                )
-                strain_x = strain_fct_map["dipole"](
-                    utemp_x,
-                    G,
-                    GT,
-                    col_points_xi,
-                    col_points_eta,
-                    mesh.npol,
-                    mesh.ndumps,
-                    corner_points,
-                    eltype,
-                    axis,
-                )
-            else:
-                strain_x = None
-
-            # Vertical component is available if we have 2 or 5 components.
-            if utemp.shape[-1] in (2, 5):
-                # Vertical expects disp_s at index 0 and disp_z at index 2.
-                # Expand if only vertical.
-                _s = list(utemp.shape)
-                if _s[-1] == 2:
-                    _s[-1] = 3
-                    utemp_new = np.zeros(_s, dtype=utemp.dtype)
-                    utemp_new[:, :, :, 0] = utemp[:, :, :, 0]
-                    utemp_new[:, :, :, 2] = utemp[:, :, :, 1]
-                    utemp_z = utemp_new
-                # Reform all others.
+            with self.stats.timer("derivative"):
+                # Horizontal component is available if we have 3 or 5
+                # components.
+                if utemp.shape[-1] >= 3:
+                    utemp_x = utemp[:, :, :, :3]
+                    utemp_x = np.require(
+                        utemp_x, requirements=["F"], dtype=np.float64
+                    )
+                    strain_x = strain_fct_map["dipole"](
+                        utemp_x,
+                        G,
+                        GT,
+                        col_points_xi,
+                        col_points_eta,
+                        mesh.npol,
+                        mesh.ndumps,
+                        corner_points,
+                        eltype,
+                        axis,
+                    )
                 else:
-                    utemp_z = utemp[:, :, :, -3:]
-                    utemp_z[:, :, :, 0] = utemp_z[:, :, :, 1]
-                    utemp_z[:, :, :, 1][:] = 0
-                    utemp_z = np.require(
-                        utemp_z, requirements=["F"], dtype=np.float64
+                    strain_x = None
+
+                # Vertical component is available if we have 2 or 5 components.
+                if utemp.shape[-1] in (2, 5):
+                    # Vertical expects disp_s at index 0 and disp_z at index 2.
+                    # Expand if only vertical.
+                    _s = list(utemp.shape)
+                    if _s[-1] == 2:
+                        _s[-1] = 3
+                        utemp_new = np.zeros(_s, dtype=utemp.dtype)
+                        utemp_new[:, :, :, 0] = utemp[:, :, :, 0]
+                        utemp_new[:, :, :, 2] = utemp[:, :, :, 1]
+                        utemp_z = utemp_new
+                    # Reform all others.
+                    else:
+                        utemp_z = utemp[:, :, :, -3:]
+                        utemp_z[:, :, :, 0] = utemp_z[:, :, :, 1]
+                        utemp_z[:, :, :, 1][:] = 0
+                        utemp_z = np.require(
+                            utemp_z, requirements=["F"], dtype=np.float64
+                        )
+
+                    strain_z = strain_fct_map["monopole"](
+                        utemp_z,
+                        G,
+                        GT,
+                        col_points_xi,
+                        col_points_eta,
+                        mesh.npol,
+                        mesh.ndumps,
+                        corner_points,
+                        eltype,
+                        axis,
                     )
-
-                strain_z = strain_fct_map["monopole"](
-                    utemp_z,
-                    G,
-                    GT,
-                    col_points_xi,
-                    col_points_eta,
-                    mesh.npol,
-                    mesh.ndumps,
-                    corner_points,
-                    eltype,
-                    axis,
-                )
-            else:
-                strain_z = None
+                else:
+                    strain_z = None
 
             mesh.strain_buffer.add(id_elem, (strain_x, strain_z))
         else:
             strain_x, strain_z = mesh.strain_buffer.get(id_elem)
 
-        all_strains = {}
-        for name, strain in (("strain_x", strain_x), ("strain_z", strain_z)):
-            if strain is None:
-                all_strains[name] = None
-                continue
-            final_strain = np.empty((strain.shape[0], 6), order="F")
-
-            for i in range(6):
-                final_strain[:, i] = spectral_basis.lagrange_interpol_2D_td(
-                    col_points_xi, col_points_eta, strain[:, :, :, i], xi, eta
-                )
+        with self.stats.timer("interpolation"):
+            all_strains = {}
+            for name, strain in (
+                ("strain_x", strain_x),
+                ("strain_z", strain_z),
+            ):
+                if strain is None:
+                    all_strains[name] = None
+                    continue
+                final_strain = np.empty((strain.shape[0], 6), order="F")
+
+                for i in range(6):
+                    final_strain[
+                        :, i
+                    ] = spectral_basis.lagrange_interpol_2D_td(
+                        col_points_xi,
+                        col_points_eta,
+                        strain[:, :, :, i],
+                        xi,
+                        eta,
+                    )
 
-            if not name == "strain_z":
-                final_strain[:, 3] *= -1.0
-                final_strain[:, 5] *= -1.0
+                if not name == "strain_z":
+                    final_strain[:, 3] *= -1.0
+                    final_strain[:, 5] *= -1.0
 
-            all_strains[name] = final_strain
+                all_strains[name] = final_strain
 
         return all_strains["strain_x"], all_strains["strain_z"]
 
@@ -390,28 +412,29 @@ class ReciprocalMergedInstaseisDB(BaseNetCDFInstaseisDB):
         else:
             utemp = mesh.displ_buffer.get(id_elem)
 
-        final_displacement_x = np.empty((utemp.shape[0], 3), order="F")
-        utemp_x = utemp[:, :, :, :3]
-        utemp_x = np.require(utemp_x, requirements=["F"], dtype=np.float64)
-        for i in range(3):
-            final_displacement_x[
-                :, i
-            ] = spectral_basis.lagrange_interpol_2D_td(
-                col_points_xi, col_points_eta, utemp_x[:, :, :, i], xi, eta
-            )
+        with self.stats.timer("interpolation"):
+            final_displacement_x = np.empty((utemp.shape[0], 3), order="F")
+            utemp_x = utemp[:, :, :, :3]
+            utemp_x = np.require(utemp_x, requirements=["F"], dtype=np.float64)
+            for i in range(3):
+                final_displacement_x[
+                    :, i
+                ] = spectral_basis.lagrange_interpol_2D_td(
+                    col_points_xi, col_points_eta, utemp_x[:, :, :, i], xi, eta
+                )
 
-        # Requires a copy to not modify the cached values in place because this
-        # array is later modified.
-        utemp_z = utemp[:, :, :, -3:].copy()
-        utemp_z[:, :, :, 0] = utemp_z[:, :, :, 1]
-        utemp_z[:, :, :, 1][:] = 0
-        utemp_z = np.require(utemp_z, requirements=["F"], dtype=np.float64)
-        final_displacement_z = np.empty((utemp.shape[0], 3), order="F")
-        for i in range(3):
-            final_displacement_z[
-                :, i
-            ] = spectral_basis.lagrange_interpol_2D_td(
-                col_points_xi, col_points_eta, utemp_z[:, :, :, i], xi, eta
-            )
+            # Requires a copy to not modify the cached values in place
+            # because this array is later modified.
+            utemp_z = utemp[:, :, :, -3:].copy()
+            utemp_z[:, :, :, 0] = utemp_z[:, :, :, 1]
+            utemp_z[:, :, :, 1][:] = 0
+            utemp_z = np.require(utemp_z, requirements=["F"], dtype=np.float64)
+            final_displacement_z = np.empty((utemp.shape[0], 3), order="F")
+            for i in range(3):
+                final_displacement_z[
+                    :, i
+                ] = spectral_basis.lagrange_interpol_2D_td(
+                    col_points_xi, col_points_eta, utemp_z[:, :, :, i], xi, eta
+                )
 
         return final_displacement_x, final_displacement_z
@@ -18,6 +18,7 @@ import warnings
 
 from .base_instaseis_db import BaseInstaseisDB, DEFAULT_MU
 from .. import (
+    binary_format,
     InstaseisError,
     InstaseisWarning,
     Source,
@@ -111,9 +112,29 @@ class RemoteInstaseisDB(BaseInstaseisDB):
         else:
             raise NotImplementedError
 
+        # The binary format directly transports the arrays and mu. Older
+        # servers do not support it and reject the parameter.
+        binary = "binary" in self._formats
+        if binary:
+            params["format"] = "binary"
         url = self._get_url(path="seismograms_raw", **params)
 
         r = requests.get(url)
+        if r.status_code != 200:  # pragma: no cover
+            raise InstaseisError(
+                "Status code %i when downloading '%s': %s"
+                % (r.status_code, url, r.reason)
+            )
+
+        if binary:
+            ((header, arrays),) = binary_format.iter_records(r.content)
+
+            data = {"mu": header["mu"]}
+            for channel, array in zip(header["channels"], arrays):
+                # The arrays are read-only views into the response.
+                data[channel[-1].upper()] = array.copy()
+            return data
+
         if "Instaseis-Mu" not in r.headers:  # pragma: no cover
             warnings.warn(
                 "Mu is not passed via the HTTP headers. Maybe some "
@@ -171,6 +192,10 @@ class RemoteInstaseisDB(BaseInstaseisDB):
         """
         info = self._download_url(self._get_url(path="info"))
         info["directory"] = self.url
+        # Limits of the server, not part of the database information.
+        info.pop("limits", None)
+        # Output formats of the server. Older servers only send MiniSEED.
+        self._formats = info.pop("formats", ["miniseed"])
         # Convert types lost in the translation to JSON.
         info["datetime"] = obspy.UTCDateTime(info["datetime"])
         info["slip"] = np.array(info["slip"], dtype=np.float64)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timings and counters of the seismogram extraction.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import collections
+import contextlib
+import threading
+import timeit
+
+
+class _Timer(object):
+    """
+    Adds the time between start and stop to a stage of the statistics.
+
+    Usable as a context manager.
+    """
+
+    __slots__ = ("_stats", "_stage", "_start")
+
+    def __init__(self, stats, stage):
+        self._stats = stats
+        self._stage = stage
+
+    def start(self):
+        self._start = timeit.default_timer()
+
+    def stop(self):
+        elapsed = timeit.default_timer() - self._start
+        stats = self._stats
+        if stats.enabled:
+            with stats._lock:
+                stats.times[self._stage] += elapsed
+                stats.counts[self._stage] += 1
+        collected = getattr(stats._local, "times", None)
+        if collected is not None:
+            collected[self._stage] += elapsed
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _NoTimer(object):
+    """
+    Does nothing - returned when the statistics are disabled.
+    """
+
+    __slots__ = ()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Statistics(object):
+    """
+    Timings and counters of the seismogram extraction of a database.
+
+    Disabled by default in which case recording does nothing. The stages
+    currently recorded by the local databases are:
+
+    * ``"extraction"``: Everything up to the raw seismogram.
+    * ``"rotation"``: Rotating the coordinates to the frame of the mesh.
+    * ``"element_location"``: Finding the element.
+    * ``"kd_tree"``: Searching the closest mesh points, part of the element
+      location.
+    * ``"inside_element"``: Testing which of the closest elements contains
+      the point, part of the element location of displacement only
+      databases.
+    * ``"read"``: Reading data from the files.
+    * ``"reorder"``: Bringing the read data into the order expected by the
+      derivatives and the interpolation.
+    * ``"derivative"``: Strain calculation.
+    * ``"interpolation"``: Interpolation to the exact location.
+    * ``"post_processing"``: Source time function reconvolution,
+      resampling, integration/differentiation, and ObsPy conversion.
+    * ``"stf_convolution"``: The source time function reconvolution part of
+      the post-processing.
+    * ``"resampling"``: The resampling part of the post-processing.
+    * ``"obspy_conversion"``: The ObsPy stream creation part of the
+      post-processing.
+
+    The stages are nested, e.g. ``"read"`` is part of ``"extraction"``. The
+    server additionally records the ``"serialization"`` of the extracted
+    seismograms to MiniSEED or SAC.
+
+    The number of bytes read refer to the uncompressed data. The buffer hits
+    and misses are counted since the statistics were first accessed or last
+    reset, also while disabled.
+
+    >>> db.stats.enable()  # doctest: +SKIP
+    >>> st = db.get_seismograms(source=src, receiver=rec)  # doctest: +SKIP
+    >>> print(db.stats)  # doctest: +SKIP
+
+    :param buffers: Callable returning a dictionary of all buffers of the
+        database.
+    """
+
+    def __init__(self, buffers=None):
+        self.enabled = False
+        self._buffers = buffers or dict
+        self._local = threading.local()
+        # Extractions might run in many threads at once.
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """
+        Set all timings and counters to zero.
+        """
+        with self._lock:
+            self.times = collections.defaultdict(float)
+            self.counts = collections.defaultdict(int)
+            self.bytes_read = 0
+        self._buffer_offsets = {
+            name: (buf.hits, buf.misses)
+            for name, buf in self._buffers().items()
+        }
+
+    def timer(self, stage):
+        """
+        Timer for the given stage, use as a context manager or call its
+        ``start()`` and ``stop()`` methods.
+        """
+        if not self.enabled and getattr(self._local, "times", None) is None:
+            return _NO_TIMER
+        return _Timer(self, stage)
+
+    @contextlib.contextmanager
+    def collect(self):
+        """
+        Additionally collect the time per stage spent in the current thread
+        into the yielded dictionary. Works independent of the statistics
+        being enabled.
+
+        >>> with db.stats.collect() as times:  # doctest: +SKIP
+        ...     st = db.get_seismograms(source=src, receiver=rec)
+        >>> times["read"]  # doctest: +SKIP
+        0.0012
+        """
+        times = collections.defaultdict(float)
+        self._local.times = times
+        try:
+            yield times
+        finally:
+            self._local.times = None
+
+    def add_bytes_read(self, *arrays):
+        """
+        Count the bytes of the given arrays as read.
+        """
+        if not self.enabled:
+            return
+        nbytes = sum(_i.nbytes for _i in arrays)
+        with self._lock:
+            self.bytes_read += nbytes
+
+    @property
+    def buffers(self):
+        """
+        Hits and misses per buffer.
+        """
+        buffers = {}
+        for name, buf in self._buffers().items():
+            hits, misses = self._buffer_offsets.get(name, (0, 0))
+            buffers[name] = {
+                "hits": buf.hits - hits,
+                "misses": buf.misses - misses,
+            }
+        return buffers
+
+    def as_dict(self):
+        """
+        Consistent copy of all timings and counters, safe to call while
+        other threads are extracting seismograms.
+        """
+        with self._lock:
+            stages = {
+                stage: {"count": self.counts[stage], "time": time}
+                for stage, time in self.times.items()
+            }
+            bytes_read = self.bytes_read
+        return {
+            "stages": stages,
+            "bytes_read": bytes_read,
+            "buffers": self.buffers,
+        }
+
+    def __str__(self):
+        stats = self.as_dict()
+        ret = [
+            "Statistics (%s):" % ("enabled" if self.enabled else "disabled")
+        ]
+        for stage, s in stats["stages"].items():
+            ret.append(
+                "\t{0:<18}: {1:>8d} calls, {2:>10.4f} sec".format(
+                    stage, s["count"], s["time"]
+                )
+            )
+        ret.append("\tbytes read        : %i" % stats["bytes_read"])
+        for name, b in sorted(stats["buffers"].items()):
+            ret.append(
+                "\t{0:<18}: {1:>8d} hits, {2:>8d} misses".format(
+                    name, b["hits"], b["misses"]
+                )
+            )
+        return "\n".join(ret)
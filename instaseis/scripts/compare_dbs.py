@@ -5,8 +5,11 @@ Useful script to make sure two databases return exactly the same the
 seismograms.
 
 Especially useful to be able to trust the repacking script. It works by
-generating random source and receiver locations and compares both. It is an
-infinite loop so the user has to manually cancel it after a while.
+generating a fixed number of random source and receiver locations within the
+region covered by the reference database, extracting the seismograms for all
+of them from all databases in parallel worker processes, and comparing them.
+It prints error statistics per database and component and exits with a
+non-zero status code if any seismogram differs.
 
 
 Usage:
@@ -18,6 +21,12 @@ Usage:
 
 In this example ``DB2``  and ``DB3`` will both be compared the ``DB1``.
 
+Lossy databases (e.g. quantized ones) will not produce the exact same
+seismograms. Pass ``--rtol`` and/or ``--atol`` to compare with the given
+relative and absolute tolerances and/or ``--max_misfit`` to assert that the
+relative L2 misfit of the waveforms of each geometry stays below the given
+value.
+
 
 Requires click, Instaseis, and ObsPy.
 
@@ -27,13 +36,305 @@ Requires click, Instaseis, and ObsPy.
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
-import random
+import collections
+import concurrent.futures
+import os
 
 import click
 import instaseis
+import numpy as np
 import obspy
 
 
+COMPONENTS = "ZNERT"
+
+
+def get_random_geometries(info, count, seed=None, subset=None):
+    """
+    Random source-receiver geometries within the region of a database.
+
+    :param info: The info dictionary of the database.
+    :param count: The number of geometries.
+    :param seed: Optional seed for reproducible geometries.
+    :param subset: Optional dictionary with any of the ``min_radius`` and
+        ``max_depth`` (in km) and ``min_colatitude`` and ``max_colatitude``
+        (in degree) keys further restricting the region.
+    :returns: A list of ``(source, receiver)`` tuples.
+    """
+    subset = subset or {}
+    rng = np.random.RandomState(seed)
+
+    planet_radius = info.planet_radius / 1e3
+    min_radius = max(
+        info.min_radius / 1e3,
+        subset.get("min_radius") or -np.inf,
+        planet_radius - (subset.get("max_depth") or np.inf),
+    )
+    min_d = max(info.min_d, subset.get("min_colatitude") or -np.inf)
+    max_d = min(info.max_d, subset.get("max_colatitude") or np.inf)
+
+    # Stay clear of the boundaries to not trip the sanity checks.
+    margin = min(0.5, (max_d - min_d) / 4.0)
+    min_d += margin
+    max_d -= margin
+    max_depth = (info.max_radius / 1e3 - min_radius) * 0.99
+
+    geometries = []
+    for _ in range(count):
+        # The pole of the database is at the receiver for reciprocal and at
+        # the source for forward databases. Place the other one at a random
+        # distance and azimuth.
+        lat1 = np.arcsin(2 * rng.rand() - 1)
+        lng1 = rng.rand() * 2 * np.pi - np.pi
+        delta = np.radians(min_d + rng.rand() * (max_d - min_d))
+        azimuth = rng.rand() * 2 * np.pi
+        lat2 = np.arcsin(
+            np.sin(lat1) * np.cos(delta)
+            + np.cos(lat1) * np.sin(delta) * np.cos(azimuth)
+        )
+        lng2 = lng1 + np.arctan2(
+            np.sin(azimuth) * np.sin(delta) * np.cos(lat1),
+            np.cos(delta) - np.sin(lat1) * np.sin(lat2),
+        )
+        lng2 = (lng2 + np.pi) % (2 * np.pi) - np.pi
+
+        first = (np.degrees(lat1), np.degrees(lng1))
+        second = (np.degrees(lat2), np.degrees(lng2))
+        moment_tensor = {
+            "m_rr": 4.710000e24 / 1e7,
+            "m_tt": 3.810000e22 / 1e7,
+            "m_pp": -4.740000e24 / 1e7,
+            "m_rt": 3.990000e23 / 1e7,
+            "m_rp": -8.050000e23 / 1e7,
+            "m_tp": -1.230000e24 / 1e7,
+        }
+        origin_time = obspy.UTCDateTime(2011, 1, 2, 3, 4, 5)
+        if info.is_reciprocal:
+            receiver = instaseis.Receiver(
+                latitude=first[0],
+                longitude=first[1],
+                network="AB",
+                station="CED",
+            )
+            source = instaseis.Source(
+                latitude=second[0],
+                longitude=second[1],
+                depth_in_m=rng.rand() * max_depth * 1e3,
+                origin_time=origin_time,
+                **moment_tensor,
+            )
+        else:
+            source = instaseis.Source(
+                latitude=first[0],
+                longitude=first[1],
+                origin_time=origin_time,
+                **moment_tensor,
+            )
+            receiver = instaseis.Receiver(
+                latitude=second[0],
+                longitude=second[1],
+                network="AB",
+                station="CED",
+            )
+        geometries.append((source, receiver))
+    return geometries
+
+
+# Per worker process state.
+_worker = {}
+
+
+def _init_worker(databases, geometries):
+    _worker["dbs"] = [instaseis.open_db(_i) for _i in databases]
+    _worker["geometries"] = geometries
+
+
+def _extract(db, source, receiver):
+    data = db.get_seismograms(
+        source=source,
+        receiver=receiver,
+        components=COMPONENTS,
+        return_obspy_stream=False,
+    )
+    return np.array([data[_i] for _i in COMPONENTS], dtype=np.float64)
+
+
+def compare_geometry(reference, others, rtol, atol):
+    """
+    Compare the seismograms of all databases for one geometry.
+
+    :param reference: The reference data with shape ``(ncomponents, npts)``.
+    :param others: A list of data arrays with the same shape.
+    :param rtol: Relative tolerance, ``None`` to skip the check.
+    :param atol: Absolute tolerance, ``None`` to skip the check.
+    :returns: A list with an array of shape ``(ncomponents, 5)`` per other
+        database. The columns are the maximum absolute error, the maximum
+        absolute reference value, the squared L2 norm of the difference,
+        the squared L2 norm of the reference, and whether the component is
+        within the tolerances.
+    """
+    stats = []
+    ref_max = np.abs(reference).max(axis=1)
+    ref_norm = np.sum(reference ** 2, axis=1)
+    for other in others:
+        if other.shape != reference.shape:
+            s = np.zeros((len(reference), 5))
+            s[:, 0] = np.inf
+            s[:, 1] = ref_max
+            s[:, 2] = np.inf
+            s[:, 3] = ref_norm
+            stats.append(s)
+            continue
+        diff = other - reference
+        if rtol is None and atol is None:
+            ok = np.ones(len(reference), dtype=bool)
+        else:
+            ok = np.all(
+                np.abs(diff)
+                <= (atol or 0.0) + (rtol or 0.0) * np.abs(reference),
+                axis=1,
+            )
+        stats.append(
+            np.stack(
+                [
+                    np.abs(diff).max(axis=1),
+                    ref_max,
+                    np.sum(diff ** 2, axis=1),
+                    ref_norm,
+                    ok,
+                ],
+                axis=1,
+            )
+        )
+    return stats
+
+
+def _rel_l2_misfit(diff_norm, ref_norm):
+    """
+    Relative L2 misfit from the squared L2 norms of the difference and the
+    reference.
+
+    A zero reference norm results in a zero misfit if the difference is
+    zero as well and in an infinite misfit otherwise.
+    """
+    diff_norm = np.asarray(diff_norm, dtype=np.float64)
+    ref_norm = np.asarray(ref_norm, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        misfit = np.sqrt(diff_norm / ref_norm)
+    return np.where(
+        ref_norm == 0, np.where(diff_norm == 0, 0.0, np.inf), misfit
+    )
+
+
+def _compare_chunk(indices, rtol, atol):
+    dbs = _worker["dbs"]
+    results = []
+    for _i in indices:
+        source, receiver = _worker["geometries"][_i]
+        data = [_extract(db, source, receiver) for db in dbs]
+        results.append(compare_geometry(data[0], data[1:], rtol, atol))
+    return results
+
+
+def compare(
+    databases,
+    count=100,
+    seed=None,
+    rtol=None,
+    atol=None,
+    max_misfit=None,
+    processes=None,
+):
+    """
+    Compare the seismograms of multiple databases.
+
+    :param databases: Paths to the databases, the first is the reference.
+    :param count: The number of random geometries.
+    :param seed: Optional seed for reproducible geometries.
+    :param rtol: Relative tolerance per sample.
+    :param atol: Absolute tolerance per sample.
+    :param max_misfit: Maximum relative L2 misfit over all components per
+        geometry.
+    :param processes: The number of worker processes. Defaults to the
+        number of CPUs.
+    :returns: A tuple of the error statistics per database and component and
+        a list of the failed geometries per database. If neither tolerances
+        nor a maximum misfit are given, the seismograms must be identical.
+    """
+    if rtol is None and atol is None and max_misfit is None:
+        rtol = atol = 0.0
+
+    # Only use geometries all databases can handle.
+    infos = [instaseis.open_db(_i).info for _i in databases]
+    subset = {
+        "min_radius": max(_i.min_radius for _i in infos) / 1e3,
+        "min_colatitude": max(_i.min_d for _i in infos),
+        "max_colatitude": min(_i.max_d for _i in infos),
+    }
+    geometries = get_random_geometries(
+        infos[0], count, seed=seed, subset=subset
+    )
+
+    processes = processes or os.cpu_count() or 1
+    chunk_size = max(1, count // (4 * processes))
+    chunks = [
+        list(range(_i, min(_i + chunk_size, count)))
+        for _i in range(0, count, chunk_size)
+    ]
+
+    # (geometries, databases, components, 5)
+    stats = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(databases, geometries),
+    ) as executor:
+        for results in executor.map(
+            _compare_chunk,
+            chunks,
+            [rtol] * len(chunks),
+            [atol] * len(chunks),
+        ):
+            stats.extend(results)
+    stats = np.array(stats, dtype=np.float64)
+
+    misfit = _rel_l2_misfit(
+        stats[:, :, :, 2].sum(axis=2), stats[:, :, :, 3].sum(axis=2)
+    )
+    failed = ~stats[:, :, :, 4].astype(bool).all(axis=2)
+    if max_misfit is not None:
+        failed |= misfit > max_misfit
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary = collections.OrderedDict()
+        for _i, path in enumerate(databases[1:]):
+            s = stats[:, _i]
+            summary[path] = collections.OrderedDict(
+                (
+                    component,
+                    {
+                        "max_abs_error": s[:, _j, 0].max(),
+                        "max_rel_error": np.nan_to_num(
+                            s[:, _j, 0] / s[:, _j, 1]
+                        ).max(),
+                        "rel_l2_misfit": float(
+                            _rel_l2_misfit(
+                                s[:, _j, 2].sum(), s[:, _j, 3].sum()
+                            )
+                        ),
+                        "within_tolerance": int(s[:, _j, 4].sum()),
+                    },
+                )
+                for _j, component in enumerate(COMPONENTS)
+            )
+
+    failures = {
+        path: [geometries[_j] for _j in np.where(failed[:, _i])[0]]
+        for _i, path in enumerate(databases[1:])
+    }
+    return summary, failures
+
+
 @click.command(
     help="Pass a list of databases to assert that they produce the "
     "same seismograms. The first one will be treated as the "
@@ -44,55 +345,89 @@ import obspy
     type=int,
     help="Optionally pass a seed number to make it reproducible.",
 )
+@click.option(
+    "--count",
+    type=click.IntRange(1, None),
+    default=100,
+    show_default=True,
+    help="Number of random source-receiver geometries.",
+)
+@click.option(
+    "--rtol",
+    type=click.FloatRange(0, None),
+    help="Relative tolerance per sample.",
+)
+@click.option(
+    "--atol",
+    type=click.FloatRange(0, None),
+    help="Absolute tolerance per sample.",
+)
+@click.option(
+    "--max_misfit",
+    type=float,
+    help="Assert that the relative L2 misfit of the waveforms is below this "
+    "value instead of requiring identical seismograms. Useful for lossy "
+    "databases.",
+)
+@click.option(
+    "--processes",
+    type=click.IntRange(1, None),
+    help="Number of worker processes. Defaults to the number of CPUs.",
+)
 @click.argument(
     "databases",
     type=click.Path(exists=True, file_okay=False, dir_okay=True),
     nargs=-1,
 )
-def compare_dbs(seed, databases):
-    if seed:
-        random.seed(seed)
-    reference = instaseis.open_db(databases[0])
-    others = [instaseis.open_db(_i) for _i in databases[1:]]
-
-    max_depth = reference.info.max_radius - reference.info.min_radius
-
-    while True:
-        receiver = instaseis.Receiver(
-            latitude=random.random() * 180.0 - 90.0,
-            longitude=random.random() * 360.0 - 180.0,
-            network="AB",
-            station="CED",
-        )
-        source = instaseis.Source(
-            latitude=random.random() * 180.0 - 90.0,
-            longitude=random.random() * 360.0 - 180.0,
-            depth_in_m=random.random() * max_depth,
-            m_rr=4.710000e24 / 1e7,
-            m_tt=3.810000e22 / 1e7,
-            m_pp=-4.740000e24 / 1e7,
-            m_rt=3.990000e23 / 1e7,
-            m_rp=-8.050000e23 / 1e7,
-            m_tp=-1.230000e24 / 1e7,
-            origin_time=obspy.UTCDateTime(2011, 1, 2, 3, 4, 5),
-        )
+def compare_dbs(seed, count, rtol, atol, max_misfit, processes, databases):
+    if len(databases) < 2:
+        raise click.UsageError("At least two databases are required.")
 
-        print("======")
+    summary, failures = compare(
+        databases=databases,
+        count=count,
+        seed=seed,
+        rtol=rtol,
+        atol=atol,
+        max_misfit=max_misfit,
+        processes=processes,
+    )
 
-        ref = reference.get_seismograms(
-            source=source, receiver=receiver, components="ZNERT"
+    success = True
+    for path, components in summary.items():
+        click.echo("======")
+        click.echo(path)
+        click.echo(
+            "  %9s %14s %14s %14s %10s"
+            % ("component", "max abs error", "max rel error", "rel L2", "ok")
         )
-
-        oth = [
-            _i.get_seismograms(
-                source=source, receiver=receiver, components="ZNERT"
+        for component, s in components.items():
+            click.echo(
+                "  %9s %14.6g %14.6g %14.6g %5i/%-4i"
+                % (
+                    component,
+                    s["max_abs_error"],
+                    s["max_rel_error"],
+                    s["rel_l2_misfit"],
+                    s["within_tolerance"],
+                    count,
+                )
+            )
+        failed = failures[path]
+        if failed:
+            success = False
+            click.echo(
+                click.style(
+                    "  %i of %i geometries failed. First one:\n%s\n%s"
+                    % (len(failed), count, failed[0][0], failed[0][1]),
+                    fg="red",
+                )
             )
-            for _i in others
-        ]
+        else:
+            click.echo(click.style("  All geometries passed.", fg="green"))
 
-        for _i, _j in zip(oth, others):
-            print(_j.info.directory, ":", ref == _i)
-            assert ref == _i, str(source) + "\n" + str(receiver)
+    if not success:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -11,7 +11,10 @@ Requires click, netCDF4, and numpy.
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
+import collections
+import concurrent.futures
 import contextlib
+import hashlib
 import math
 import os
 import sys
@@ -19,6 +22,7 @@ import sys
 import click
 import netCDF4
 import numpy as np
+import scipy.signal
 from scipy.spatial import cKDTree
 
 
@@ -31,11 +35,377 @@ else:
 __netcdf_version = tuple(int(i) for i in netCDF4.__version__.split("."))
 
 
+# Integer types the merged snapshots can be quantized to.
+QUANTIZATION_TYPES = {"int16": np.int16, "int8": np.int8}
+
+# Global attribute tracking the progress of an unfinished merge.
+CHECKPOINT_ATTRIBUTE = "repack_db checkpoint"
+
+# Global attribute identifying the parameters of an unfinished merge.
+PARAMETERS_ATTRIBUTE = "repack_db parameters"
+
+# Global attribute storing the order of the elements of merged databases.
+ELEMENT_ORDER_ATTRIBUTE = "element ordering"
+ELEMENT_ORDERS = ("kdtree", "hilbert", "zorder", "access")
+
+
 @contextlib.contextmanager
 def dummy_progressbar(iterator, *args, **kwargs):
     yield iterator
 
 
+def quantize(utemp, dtype):
+    """
+    Quantize the data of one or more elements to scaled integers.
+
+    Each variable of each element gets its own scale factor so that its
+    maximum absolute value maps to the largest integer of the type.
+
+    :param utemp: The data of one element with shape
+        ``(nvars, jpol, ipol, npts)`` or of multiple elements with shape
+        ``(nelem, nvars, jpol, ipol, npts)``.
+    :param dtype: The integer type.
+    :returns: The quantized data and the float32 scale factors per variable.
+    """
+    qmax = np.iinfo(dtype).max
+    scale = (
+        np.abs(utemp).reshape(utemp.shape[:-3] + (-1,)).max(axis=-1) / qmax
+    ).astype(np.float32)
+    # All zero variables are stored as zeros with a scale of zero.
+    safe_scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+    data = np.round(utemp / safe_scale[..., None, None, None])
+    data = np.clip(data, -qmax, qmax).astype(dtype)
+    return data, scale
+
+
+def get_time_sampling(f, decimation_factor=1, max_length=None):
+    """
+    Determine the time sampling of a decimated and/or truncated database.
+
+    The first ``offset`` samples are dropped so that the peak of the source
+    time function still falls on a sample after the decimation.
+
+    :param f: The open netCDF file of the input database.
+    :param decimation_factor: Integer decimation factor.
+    :param max_length: Maximum record length in seconds after the origin
+        time of the source. ``None`` to keep the full length.
+    :returns: A dictionary with the ``offset``, the final number of samples
+        ``npts`` and the new values of the time related global attributes.
+    """
+    ndumps = int(np.ravel(f.getncattr("number of strain dumps"))[0])
+    dt = float(np.ravel(f.getncattr("strain dump sampling rate in sec"))[0])
+    src_shift = float(np.ravel(f.getncattr("source shift factor in sec"))[0])
+    src_shift_samples = int(
+        np.ravel(f.getncattr("source shift factor for deltat_coarse"))[0]
+    )
+
+    offset = src_shift_samples % decimation_factor
+    new_dt = dt * decimation_factor
+    new_src_shift_samples = (src_shift_samples - offset) // decimation_factor
+    npts = len(range(offset, ndumps, decimation_factor))
+    if max_length is not None:
+        npts = min(
+            npts,
+            new_src_shift_samples + int(math.floor(max_length / new_dt)) + 1,
+        )
+
+    return {
+        "offset": offset,
+        "npts": npts,
+        "attributes": {
+            "number of strain dumps": npts,
+            "strain dump sampling rate in sec": new_dt,
+            "source shift factor in sec": src_shift - offset * dt,
+            "source shift factor for deltat_coarse": new_src_shift_samples,
+        },
+    }
+
+
+def decimate_snapshots(data, decimation_factor, offset, npts):
+    """
+    Low-pass filter, decimate, and truncate data along the last axis.
+
+    Uses a zero phase FIR anti-aliasing filter so the timing is preserved.
+    Data and source time functions are treated the same way thus the
+    deconvolution of the source time function stays consistent.
+    """
+    data = data[..., offset:]
+    if decimation_factor > 1:
+        data = scipy.signal.decimate(
+            data, decimation_factor, ftype="fir", zero_phase=True, axis=-1
+        )
+    return data[..., :npts]
+
+
+def get_spatial_subset(
+    f,
+    min_radius=None,
+    max_depth=None,
+    min_colatitude=None,
+    max_colatitude=None,
+):
+    """
+    Determine the elements and GLL points of a spatial subset of a database.
+
+    An element is kept if the range of radii and colatitudes spanned by its
+    GLL points overlaps the requested region so every point inside the
+    region remains covered by an element.
+
+    :param f: The open netCDF file of the input database.
+    :param min_radius: Minimum radius in km.
+    :param max_depth: Maximum depth in km. Alternative to ``min_radius``,
+        the more restrictive of both is used.
+    :param min_colatitude: Minimum colatitude in degree.
+    :param max_colatitude: Maximum colatitude in degree.
+    :returns: ``None`` if no bounds are given. Otherwise a dictionary with
+        the sorted original ``elements`` and ``gllpoints`` ids to keep and
+        the new values of the affected global attributes.
+    """
+    if (
+        min_radius is None
+        and max_depth is None
+        and min_colatitude is None
+        and max_colatitude is None
+    ):
+        return None
+
+    def _attr(name):
+        return float(np.ravel(f.getncattr(name))[0])
+
+    rmin = _attr("kernel wavefield rmin")
+    rmax = _attr("kernel wavefield rmax")
+    colatmin = _attr("kernel wavefield colatmin")
+    colatmax = _attr("kernel wavefield colatmax")
+
+    if min_radius is not None:
+        rmin = max(rmin, min_radius)
+    if max_depth is not None:
+        rmin = max(rmin, _attr("planet radius") - max_depth)
+    if min_colatitude is not None:
+        colatmin = max(colatmin, min_colatitude)
+    if max_colatitude is not None:
+        colatmax = min(colatmax, max_colatitude)
+
+    if rmin >= rmax:
+        raise ValueError(
+            "The minimum radius of %g km must be smaller than the maximum "
+            "radius of the database of %g km." % (rmin, rmax)
+        )
+    if colatmin >= colatmax:
+        raise ValueError(
+            "Empty colatitude range from %g to %g degree."
+            % (colatmin, colatmax)
+        )
+
+    mesh = f["Mesh"]
+    s = mesh["mesh_S"][:].astype(np.float64)
+    z = mesh["mesh_Z"][:].astype(np.float64)
+    # The mesh coordinates are in meter.
+    radius = np.hypot(s, z) / 1000.0
+    colatitude = np.degrees(np.arctan2(s, z))
+
+    sem_mesh = mesh["sem_mesh"][:]
+    nelem = sem_mesh.shape[0]
+    elem_radius = radius[sem_mesh].reshape(nelem, -1)
+    elem_colatitude = colatitude[sem_mesh].reshape(nelem, -1)
+    elements = np.where(
+        (elem_radius.max(axis=1) >= rmin)
+        & (elem_radius.min(axis=1) <= rmax)
+        & (elem_colatitude.max(axis=1) >= colatmin)
+        & (elem_colatitude.min(axis=1) <= colatmax)
+    )[0]
+
+    # All GLL points referenced by the remaining elements.
+    gllpoints = np.unique(
+        np.concatenate(
+            [
+                sem_mesh[elements].ravel(),
+                mesh["fem_mesh"][:][elements].ravel(),
+                mesh["midpoint_mesh"][:][elements].ravel(),
+            ]
+        )
+    )
+
+    return {
+        "elements": elements,
+        "gllpoints": gllpoints,
+        "attributes": {
+            "nelem_kwf_global": len(elements),
+            "npoints": len(gllpoints),
+            "kernel wavefield rmin": rmin,
+            "kernel wavefield colatmin": colatmin,
+            "kernel wavefield colatmax": colatmax,
+        },
+    }
+
+
+def _grid_coordinates(s, z, order):
+    """
+    Map coordinates to integers on a ``2 ** order`` sided square grid.
+
+    Both axes are scaled the same to preserve the aspect ratio.
+    """
+    s = np.asarray(s, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    extent = max(np.ptp(s), np.ptp(z)) or 1.0
+    n = 2 ** order
+    x = np.floor((s - s.min()) / extent * (n - 1) + 0.5).astype(np.int64)
+    y = np.floor((z - z.min()) / extent * (n - 1) + 0.5).astype(np.int64)
+    return x, y
+
+
+def zorder_index(x, y, order):
+    """
+    Position of integer grid coordinates along a Z-order (Morton) curve.
+    """
+    d = np.zeros(len(x), dtype=np.int64)
+    for bit in range(order):
+        d |= ((x >> bit) & 1) << (2 * bit)
+        d |= ((y >> bit) & 1) << (2 * bit + 1)
+    return d
+
+
+def hilbert_index(x, y, order):
+    """
+    Position of integer grid coordinates along a Hilbert curve.
+    """
+    n = 2 ** order
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant.
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s //= 2
+    return d
+
+
+def _access_order(accessed, nelem, fallback):
+    """
+    Order elements by how often they are accessed after each other.
+
+    Starting at the most often accessed element not yet placed, the chain
+    is extended with the element most often accessed directly before or
+    after the last one. Never accessed elements follow in the fallback
+    order.
+    """
+    accessed = np.asarray(accessed, dtype=np.int64)
+    counts = np.bincount(accessed, minlength=nelem)
+
+    # Symmetric transition counts between consecutively accessed elements.
+    pairs = np.stack([accessed[:-1], accessed[1:]], axis=1)
+    pairs = np.sort(pairs[pairs[:, 0] != pairs[:, 1]], axis=1)
+    pairs, pair_counts = np.unique(pairs, axis=0, return_counts=True)
+    neighbours = collections.defaultdict(dict)
+    for (a, b), count in zip(pairs.tolist(), pair_counts.tolist()):
+        neighbours[a][b] = count
+        neighbours[b][a] = count
+
+    placed = np.zeros(nelem, dtype=bool)
+    order = []
+    for start in np.argsort(-counts, kind="stable"):
+        if placed[start] or not counts[start]:
+            continue
+        current = start
+        while current is not None:
+            placed[current] = True
+            order.append(current)
+            candidates = [
+                (count, elem)
+                for elem, count in neighbours[current].items()
+                if not placed[elem]
+            ]
+            current = max(candidates)[1] if candidates else None
+
+    order.extend(elem for elem in fallback if not placed[elem])
+    return np.array(order, dtype=np.int64)
+
+
+def get_element_order(s_mp, z_mp, element_order="kdtree", access_log=None):
+    """
+    Determine the order in which the elements are written.
+
+    Elements that are usually accessed together should also be close on
+    disc so that the readahead of the operating system and the HDF5 chunk
+    cache are effective.
+
+    :param s_mp: The s coordinates of the element midpoints.
+    :param z_mp: The z coordinates of the element midpoints.
+    :param element_order: One of ``ELEMENT_ORDERS``. ``"kdtree"`` follows
+        the traversal of the kd-tree instaseis uses to find elements,
+        ``"hilbert"`` and ``"zorder"`` follow the respective space filling
+        curve over ``(s, z)``, and ``"access"`` orders elements accessed
+        after each other in the ``access_log`` next to each other.
+    :param access_log: Array of accessed mesh coordinates with shape
+        ``(N, 2)`` and the columns being ``s`` and ``z`` in meter in the
+        order they were accessed. Required for the ``"access"`` ordering.
+    :returns: The element indices in their new order.
+    """
+    if element_order not in ELEMENT_ORDERS:
+        raise ValueError(
+            "Unknown element order '%s'. Valid: %s."
+            % (element_order, ", ".join(ELEMENT_ORDERS))
+        )
+
+    if element_order == "kdtree":
+        midpoints = np.empty((len(s_mp), 2), dtype=np.asarray(s_mp).dtype)
+        midpoints[:, 0] = s_mp
+        midpoints[:, 1] = z_mp
+        return cKDTree(data=midpoints).indices
+
+    # Resolution of the grid the space filling curves are built on.
+    order = 16
+    x, y = _grid_coordinates(s_mp, z_mp, order=order)
+    if element_order == "zorder":
+        return np.argsort(zorder_index(x, y, order=order), kind="stable")
+    curve = np.argsort(hilbert_index(x, y, order=order), kind="stable")
+    if element_order == "hilbert":
+        return curve
+
+    if access_log is None:
+        raise ValueError("The 'access' element order requires an access log.")
+    access_log = np.asarray(access_log, dtype=np.float64).reshape(-1, 2)
+    # The closest midpoint is good enough to identify the element.
+    _, accessed = cKDTree(np.stack([s_mp, z_mp], axis=1)).query(access_log)
+    return _access_order(accessed, nelem=len(s_mp), fallback=curve)
+
+
+def hash_merge_parameters(**kwargs):
+    """
+    Hash of all parameters determining the contents of a merged file.
+
+    Arrays are hashed by their type, shape, and values, everything else by
+    its representation.
+    """
+    h = hashlib.sha256()
+    for key in sorted(kwargs):
+        value = kwargs[key]
+        h.update(key.encode())
+        if isinstance(value, np.ndarray):
+            h.update(("%s%s" % (value.dtype.str, value.shape)).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        else:
+            h.update(repr(value).encode())
+    return h.hexdigest()
+
+
+def _set_string_attribute(dst, name, value):
+    # The setncattr_string() was added in version 1.2.3. Before that it was
+    # the default behavior.
+    if __netcdf_version >= (1, 2, 3):
+        dst.setncattr_string(name, value)
+    else:
+        dst.setncattr(name, str(value))
+
+
 def repack_file(
     input_filename,
     output_filename,
@@ -43,12 +413,15 @@ def repack_file(
     compression_level,
     transpose,
     quiet=False,
+    points_per_chunk=None,
 ):
     """
     Transposes all data in the "/Snapshots" group.
 
     :param input_filename: The input filename.
     :param output_filename: The output filename.
+    :param points_per_chunk: The number of GLL points per chunk of the
+        snapshots. Defaults to chunks of about 32 kB.
     """
     assert os.path.exists(input_filename)
     assert not os.path.exists(output_filename)
@@ -65,10 +438,19 @@ def repack_file(
             compression_level=compression_level,
             quiet=quiet,
             transpose=transpose,
+            points_per_chunk=points_per_chunk,
         )
 
 
-def recursive_copy(src, dst, contiguous, compression_level, transpose, quiet):
+def recursive_copy(
+    src,
+    dst,
+    contiguous,
+    compression_level,
+    transpose,
+    quiet,
+    points_per_chunk=None,
+):
     """
     Recursively copy the whole file and transpose the all /Snapshots
     variables while at it..
@@ -79,12 +461,7 @@ def recursive_copy(src, dst, contiguous, compression_level, transpose, quiet):
     for attr in src.ncattrs():
         _s = getattr(src, attr)
         if isinstance(_s, str_type):
-            # The setncattr_string() was added in version 1.2.3. Before that
-            # it was the default behavior.
-            if __netcdf_version >= (1, 2, 3):
-                dst.setncattr_string(attr, _s)
-            else:
-                dst.setncattr(attr, str(_s))
+            _set_string_attribute(dst, attr, _s)
         else:
             setattr(dst, attr, _s)
 
@@ -114,8 +491,11 @@ def recursive_copy(src, dst, contiguous, compression_level, transpose, quiet):
             npts = min(shape)
             num_elems = max(shape)
             time_axis = np.argmin(shape)
-            # Arbitrary limit.
-            _c = max(int(round(32768 / (npts * 4))), 1)
+            if points_per_chunk:
+                _c = min(points_per_chunk, num_elems)
+            else:
+                # Arbitrary limit.
+                _c = max(int(round(32768 / (npts * 4))), 1)
 
             if time_axis == 0:
                 chunksizes = (npts, _c)
@@ -221,34 +601,47 @@ def recursive_copy(src, dst, contiguous, compression_level, transpose, quiet):
             compression_level=compression_level,
             quiet=quiet,
             transpose=transpose,
+            points_per_chunk=points_per_chunk,
         )
 
 
 def recursive_copy_no_snapshots_no_seismograms_no_surface(
-    src, dst, quiet, contiguous, compression_level
+    src,
+    dst,
+    quiet,
+    contiguous,
+    compression_level,
+    dimension_sizes=None,
+    dimension_indices=None,
 ):
     """
     A bit of a copy of the recursive_copy function but it does not copy the
     Snapshots, Seismograms, or Surface group.
+
+    :param dimension_sizes: Optionally overwrite the size of some
+        dimensions.
+    :param dimension_indices: Optionally only copy the given indices along
+        some dimensions.
     """
+    dimension_indices = dimension_indices or {}
+    dimension_sizes = dict(dimension_sizes or {})
+    for name, indices in dimension_indices.items():
+        dimension_sizes[name] = len(indices)
     for attr in src.ncattrs():
         _s = getattr(src, attr)
         if isinstance(_s, str_type):
-            # The setncattr_string() was added in version 1.2.3. Before that
-            # it was the default behavior.
-            if __netcdf_version >= (1, 2, 3):
-                dst.setncattr_string(attr, _s)
-            else:
-                dst.setncattr(attr, str(_s))
+            _set_string_attribute(dst, attr, _s)
         else:
             setattr(dst, attr, _s)
 
     items = list(src.dimensions.items())
 
     for name, dimension in items:
-        dst.createDimension(
-            name, len(dimension) if not dimension.isunlimited() else None
-        )
+        if name in dimension_sizes:
+            size = dimension_sizes[name]
+        else:
+            size = len(dimension) if not dimension.isunlimited() else None
+        dst.createDimension(name, size)
 
     for name, variable in src.variables.items():
         if name in ["Snapshots", "Seismograms", "Surface"]:
@@ -260,6 +653,15 @@ def recursive_copy_no_snapshots_no_seismograms_no_surface(
         if isinstance(chunksizes, str_type) and chunksizes == "contiguous":
             chunksizes = None
 
+        dimensions = variable.dimensions
+
+        # Chunks cannot be larger than the possibly shrunk dimensions.
+        if chunksizes is not None:
+            chunksizes = [
+                min(c, dimension_sizes[d]) if d in dimension_sizes else c
+                for c, d in zip(chunksizes, dimensions)
+            ]
+
         # For a contiguous output, compression and chunking has to be turned
         # off.
         if contiguous:
@@ -268,8 +670,6 @@ def recursive_copy_no_snapshots_no_seismograms_no_surface(
         else:
             zlib = True
 
-        dimensions = variable.dimensions
-
         x = dst.createVariable(
             name,
             variable.datatype,
@@ -283,7 +683,11 @@ def recursive_copy_no_snapshots_no_seismograms_no_surface(
             click.echo(
                 click.style("\tCopying group '%s'..." % name, fg="blue")
             )
-        dst.variables[x.name][:] = src.variables[x.name][:]
+        data = src.variables[x.name][:]
+        for axis, dim in enumerate(dimensions):
+            if dim in dimension_indices:
+                data = np.take(data, dimension_indices[dim], axis=axis)
+        dst.variables[x.name][:] = data
 
     for src_group in src.groups.values():
         if src_group.name in ["Snapshots", "Seismograms", "Surface"]:
@@ -295,14 +699,124 @@ def recursive_copy_no_snapshots_no_seismograms_no_surface(
             contiguous=contiguous,
             compression_level=compression_level,
             quiet=quiet,
+            dimension_sizes=dimension_sizes,
+            dimension_indices=dimension_indices,
+        )
+
+
+def find_database_files(input_folder):
+    """
+    Find the netCDF files of a database in the multi file layout.
+    """
+    found_filenames = []
+    for root, _, filenames in os.walk(input_folder, followlinks=True):
+        for filename in sorted(filenames, reverse=True):
+            if filename not in ["ordered_output.nc4", "axisem_output.nc4"]:
+                continue
+            found_filenames.append(os.path.join(root, filename))
+            break
+
+    assert found_filenames, "No files named `ordered_output.nc4` found."
+    return found_filenames
+
+
+def repack_files(
+    filenames,
+    input_folder,
+    output_folder,
+    contiguous,
+    compression_level,
+    transpose,
+    quiet=False,
+    points_per_chunk=None,
+):
+    """
+    Repack or transpose all files of a database keeping the folder
+    structure.
+    """
+    for _i, filename in enumerate(filenames):
+        if not quiet:
+            click.echo(
+                click.style(
+                    "--> Processing file %i of %i: %s"
+                    % (_i + 1, len(filenames), filename),
+                    fg="green",
+                )
+            )
+
+        output_filename = os.path.join(
+            output_folder, os.path.relpath(filename, input_folder)
+        )
+
+        output_filename = output_filename.replace(
+            "axisem_output.nc4", "ordered_output.nc4"
+        )
+
+        if not input_folder == output_folder:
+            os.makedirs(os.path.dirname(output_filename))
+
+        repack_file(
+            input_filename=filename,
+            output_filename=output_filename,
+            contiguous=contiguous,
+            transpose=transpose,
+            compression_level=compression_level,
+            quiet=quiet,
+            points_per_chunk=points_per_chunk,
         )
 
 
 def merge_files(
-    filenames, output_folder, contiguous, compression_level, quiet
+    filenames,
+    output_folder,
+    contiguous,
+    compression_level,
+    quiet,
+    quantization=None,
+    decimation_factor=1,
+    max_length=None,
+    min_radius=None,
+    max_depth=None,
+    min_colatitude=None,
+    max_colatitude=None,
+    workers=1,
+    max_memory_in_mb=512,
+    resume=False,
+    element_order="kdtree",
+    access_log=None,
+    elements_per_chunk=1,
 ):
     """
     Completely unroll and merge both files to a single database.
+
+    :param quantization: Optionally store the snapshots lossy as scaled
+        integers. One of the keys of ``QUANTIZATION_TYPES``.
+    :param decimation_factor: Low-pass filter and decimate the snapshots by
+        this integer factor.
+    :param max_length: Optionally truncate the records to this many seconds
+        after the origin time of the source.
+    :param min_radius: Only keep the elements above this radius in km.
+    :param max_depth: Only keep the elements above this depth in km.
+    :param min_colatitude: Only keep the elements north of this colatitude
+        in degree.
+    :param max_colatitude: Only keep the elements south of this colatitude
+        in degree.
+    :param workers: The number of threads processing the snapshots while
+        the next batch of elements is read.
+    :param max_memory_in_mb: Approximate upper limit of the memory used for
+        the snapshots that are in flight.
+    :param resume: Continue an interrupted merge of the same input files
+        with the same settings if the output file already exists.
+    :param element_order: The order of the elements in the merged file.
+        See :func:`get_element_order`.
+    :param access_log: Accessed mesh coordinates for the ``"access"``
+        element order. Either an array with shape ``(N, 2)`` or the name of
+        a text file with the ``s`` and ``z`` coordinates in meter as
+        columns.
+    :param elements_per_chunk: The number of elements per HDF5 chunk of the
+        merged snapshots. Ignored for contiguous files.
+    :returns: The relative L2 misfit of the quantized snapshots or ``None``
+        if not quantized.
     """
     assert len(filenames) in (1, 2, 4)
 
@@ -323,20 +837,37 @@ def merge_files(
         or (keys == ["MXX_P_MYY", "MXY_MXX_M_MYY", "MXZ_MYZ", "MZZ"])
     )
 
+    if isinstance(access_log, str_type):
+        access_log = np.loadtxt(access_log, ndmin=2)
+
     output = os.path.join(output_folder, "merged_output.nc4")
-    assert not os.path.exists(output)
+    resume = resume and os.path.exists(output)
+    assert resume or not os.path.exists(output)
 
     input_files = {}
     try:
         for key, value in files.items():
             input_files[key] = netCDF4.Dataset(value, "r", format="NETCDF4")
-        out = netCDF4.Dataset(output, "w", format="NETCDF4")
-        _merge_files(
+        out = netCDF4.Dataset(output, "a" if resume else "w", format="NETCDF4")
+        return _merge_files(
             input=input_files,
             out=out,
             contiguous=contiguous,
             compression_level=compression_level,
             quiet=quiet,
+            quantization=quantization,
+            decimation_factor=decimation_factor,
+            max_length=max_length,
+            min_radius=min_radius,
+            max_depth=max_depth,
+            min_colatitude=min_colatitude,
+            max_colatitude=max_colatitude,
+            workers=workers,
+            max_memory_in_mb=max_memory_in_mb,
+            resume=resume,
+            element_order=element_order,
+            access_log=access_log,
+            elements_per_chunk=elements_per_chunk,
         )
     finally:
         for filename in input_files.values():
@@ -350,49 +881,81 @@ def merge_files(
             pass
 
 
-def _merge_files(input, out, contiguous, compression_level, quiet):
-    # First copy everything non-snapshot related.
-    c_db = list(input.values())[0]
-    recursive_copy_no_snapshots_no_seismograms_no_surface(
-        src=c_db,
-        dst=out,
-        quiet=quiet,
-        contiguous=contiguous,
-        compression_level=compression_level,
-    )
+def read_gll_points(var, ids, time_axis):
+    """
+    Read the snapshots of the given GLL points from one variable.
 
-    if contiguous:
-        zlib = False
+    Dense ids are read as one contiguous block which is much faster than
+    reading scattered points. Sparse ids only read the unique points.
+
+    :param var: The snapshot variable.
+    :param ids: Array of GLL point ids of arbitrary shape.
+    :param time_axis: The time axis of the variable.
+    :returns: An array of shape ``ids.shape + (npts,)``.
+    """
+    lo = ids.min()
+    hi = ids.max() + 1
+    unique = np.unique(ids)
+    if hi - lo <= 4 * len(unique):
+        selection = slice(lo, hi)
+        local_ids = ids - lo
     else:
-        zlib = True
+        selection = unique
+        local_ids = np.searchsorted(unique, ids)
 
-    # We need the stf_dump and stf_d_dump datasets. They are either in the
-    # "Snapshots" group or in the "Surface" group.
-    for g in ("Snapshots", "Surface"):
-        if g not in c_db.groups:
-            continue
-        if "stf_dump" not in c_db[g].variables:
-            continue
-        break
+    if time_axis == 0:
+        block = np.asarray(var[:, selection]).T
     else:
-        raise Exception("Could not find `stf_dump` array.")
+        block = np.asarray(var[selection, :])
+    return block[local_ids]
 
-    stf_dump = c_db[g]["stf_dump"]
-    stf_d_dump = c_db[g]["stf_d_dump"]
 
-    for data in [stf_dump, stf_d_dump]:
-        chunksizes = data.shape
-        if contiguous:
-            chunksizes = None
-        d = out.createVariable(
-            varname=data.name,
-            dimensions=["snapshots"],
-            contiguous=contiguous,
-            zlib=zlib,
-            chunksizes=chunksizes,
-            datatype=data.dtype,
-        )
-        d[:] = data[:]
+def _merge_files(
+    input,
+    out,
+    contiguous,
+    compression_level,
+    quiet,
+    quantization=None,
+    decimation_factor=1,
+    max_length=None,
+    min_radius=None,
+    max_depth=None,
+    min_colatitude=None,
+    max_colatitude=None,
+    workers=1,
+    max_memory_in_mb=512,
+    resume=False,
+    element_order="kdtree",
+    access_log=None,
+    elements_per_chunk=1,
+):
+    c_db = list(input.values())[0]
+    sampling = get_time_sampling(
+        c_db, decimation_factor=decimation_factor, max_length=max_length
+    )
+    subset = get_spatial_subset(
+        c_db,
+        min_radius=min_radius,
+        max_depth=max_depth,
+        min_colatitude=min_colatitude,
+        max_colatitude=max_colatitude,
+    )
+    attributes = dict(sampling["attributes"])
+
+    if subset is None:
+        # Keep everything.
+        elements = np.arange(c_db.getncattr("nelem_kwf_global"))
+        dimension_indices = None
+    else:
+        elements = subset["elements"]
+        dimension_indices = {
+            "elements": elements,
+            "gllpoints_all": subset["gllpoints"],
+        }
+        attributes.update(subset["attributes"])
+
+    nelem = len(elements)
 
     # Get all the snapshots from the other databases.
     if "PX" in input and "PZ" in input:
@@ -438,13 +1001,289 @@ def _merge_files(input, out, contiguous, compression_level, quiet):
     time_axis = np.argmin(meshes[0].shape)
 
     dtype = meshes[0].dtype
+    if quantization:
+        out_dtype = QUANTIZATION_TYPES[quantization]
+    else:
+        out_dtype = dtype
+
+    # We also re-sort the elements so that spatially adjacent or commonly
+    # co-accessed elements are also close on disc - this allows for faster
+    # I/O. By default this follows the traversal of a kd-tree in the same
+    # fashion instaseis uses it.
+
+    # Get the midpoints for each element.
+    s_mp = c_db["Mesh"]["mp_mesh_S"][:][elements]
+    z_mp = c_db["Mesh"]["mp_mesh_Z"][:][elements]
+
+    # This is now the order in which we will write the indices.
+    inds = get_element_order(
+        s_mp, z_mp, element_order=element_order, access_log=access_log
+    )
+
+    # Make sure all indices are available.
+    assert np.array_equal(np.sort(inds), np.arange(nelem))
+
+    # The inverse permutation: the new index of each element.
+    new_indices = np.empty(nelem, dtype=np.int64)
+    new_indices[inds] = np.arange(nelem)
+
+    # The GLL point ids in the input snapshots.
+    sem_mesh = c_db["Mesh"]["sem_mesh"][:][elements]
+
+    shape = (nelem, len(meshes), 5, 5, sampling["npts"])
+    parameters = hash_merge_parameters(
+        shape=shape,
+        dtype=np.dtype(out_dtype).str,
+        quantization=quantization,
+        elements=np.asarray(elements, dtype=np.int64),
+        element_order=element_order,
+        order=np.asarray(inds, dtype=np.int64),
+        decimation_factor=decimation_factor,
+        offset=int(sampling["offset"]),
+        sampling=sorted(
+            (_k, float(_v)) for _k, _v in sampling["attributes"].items()
+        ),
+        contiguous=bool(contiguous),
+        elements_per_chunk=None if contiguous else elements_per_chunk,
+    )
+    if resume:
+        if CHECKPOINT_ATTRIBUTE not in out.ncattrs():
+            raise ValueError(
+                "The output file has no checkpoint. It is either complete "
+                "or has been interrupted before the first checkpoint."
+            )
+        x = out["MergedSnapshots"]
+        if (
+            PARAMETERS_ATTRIBUTE not in out.ncattrs()
+            or out.getncattr(PARAMETERS_ATTRIBUTE) != parameters
+        ):
+            raise ValueError(
+                "Cannot resume - the output file has been created with "
+                "different settings."
+            )
+        if quantization:
+            scale_var = out["MergedSnapshotsScale"]
+        progress = np.array(out.getncattr(CHECKPOINT_ATTRIBUTE))
+    else:
+        x, scale_var = _create_merged_file(
+            c_db=c_db,
+            out=out,
+            contiguous=contiguous,
+            compression_level=compression_level,
+            quiet=quiet,
+            quantization=quantization,
+            decimation_factor=decimation_factor,
+            sampling=sampling,
+            attributes=attributes,
+            dimension_indices=dimension_indices,
+            subset=subset,
+            shape=shape,
+            out_dtype=out_dtype,
+            sem_mesh=sem_mesh,
+            s_mp=s_mp,
+            z_mp=z_mp,
+            inds=inds,
+            elements_per_chunk=elements_per_chunk,
+        )
+        _set_string_attribute(out, ELEMENT_ORDER_ATTRIBUTE, element_order)
+        _set_string_attribute(out, PARAMETERS_ATTRIBUTE, parameters)
+        # Elements done, squared misfit, and squared signal.
+        progress = np.zeros(3, dtype=np.float64)
+        out.setncattr(CHECKPOINT_ATTRIBUTE, progress)
+        out.sync()
+
+    # Bound the memory of all batches in flight. Each element goes through
+    # a couple of temporary copies.
+    element_size = np.prod(shape[1:-1]) * meshes[0].shape[time_axis] * 4
+    batch_size = max(
+        1,
+        int(max_memory_in_mb * 1024 ** 2 / (4 * element_size * (workers + 1))),
+    )
+    if elements_per_chunk == 1:
+        # Elements are processed in their input order as neighbouring
+        # elements share contiguous GLL points.
+        processing_order = np.arange(nelem)
+    else:
+        # Otherwise in their output order so that every chunk is written
+        # exactly once.
+        processing_order = inds
+        batch_size = max(batch_size // elements_per_chunk, 1)
+        batch_size *= elements_per_chunk
+    batches = []
+    for start in range(int(progress[0]), nelem, batch_size):
+        stop = min(start + batch_size, nelem)
+        batches.append((stop, processing_order[start:stop]))
+
+    def process(u):
+        u = decimate_snapshots(
+            u,
+            decimation_factor=decimation_factor,
+            offset=sampling["offset"],
+            npts=sampling["npts"],
+        )
+        if not quantization:
+            return u, None, 0.0, 0.0
+        data, scale = quantize(u, out_dtype)
+        misfit_sq = np.sum(
+            (data * scale[..., None, None, None] - u) ** 2, dtype=np.float64
+        )
+        signal_sq = np.sum(u.astype(np.float64) ** 2)
+        return data, scale, misfit_sq, signal_sq
+
+    def write(done, batch, future):
+        data, scale, misfit_sq, signal_sq = future.result()
+        targets = new_indices[batch]
+        if np.array_equal(targets, np.arange(targets[0], targets[-1] + 1)):
+            _s = slice(targets[0], targets[-1] + 1)
+            x[_s] = data
+            if quantization:
+                scale_var[_s] = scale
+        else:
+            # Each chunk holds exactly one element so writing them one by
+            # one is as fast as it gets.
+            for _i, new_index in enumerate(targets):
+                x[new_index] = data[_i]
+                if quantization:
+                    scale_var[new_index] = scale[_i]
+        progress[:] = (
+            done,
+            progress[1] + misfit_sq,
+            progress[2] + signal_sq,
+        )
+        out.setncattr(CHECKPOINT_ATTRIBUTE, progress)
+        out.sync()
+
+    if not quiet:
+        click.echo(click.style("\tCreating '/MergedSnapshots'...", fg="blue"))
+        pbar = click.progressbar
+    else:
+        pbar = dummy_progressbar
+
+    # All netCDF calls happen in this thread, the workers only decimate and
+    # quantize. Results are written in order so the checkpoint is always a
+    # single number of elements.
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor, pbar(batches, length=len(batches), label="\t  ") as bs:
+        for done, batch in bs:
+            # Same layout as the merged snapshots.
+            gll_point_ids = sem_mesh[batch].transpose(0, 2, 1)
+            u = np.stack(
+                [
+                    read_gll_points(var, gll_point_ids, time_axis)
+                    for var in meshes
+                ],
+                axis=1,
+            ).astype(dtype, copy=False)
+            pending.append((done, batch, executor.submit(process, u)))
+            if len(pending) > workers:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+
+    out.delncattr(CHECKPOINT_ATTRIBUTE)
+    out.delncattr(PARAMETERS_ATTRIBUTE)
+
+    if not quantization:
+        return None
+
+    misfit = math.sqrt(progress[1] / progress[2]) if progress[2] else 0.0
+    if not quiet:
+        click.echo(
+            click.style(
+                "\tRelative L2 misfit of the quantized snapshots: %g" % misfit,
+                fg="blue",
+            )
+        )
+    return misfit
+
+
+def _create_merged_file(
+    c_db,
+    out,
+    contiguous,
+    compression_level,
+    quiet,
+    quantization,
+    decimation_factor,
+    sampling,
+    attributes,
+    dimension_indices,
+    subset,
+    shape,
+    out_dtype,
+    sem_mesh,
+    s_mp,
+    z_mp,
+    inds,
+    elements_per_chunk=1,
+):
+    """
+    Write everything but the merged snapshots and create their variables.
+
+    :returns: The merged snapshots and their scale variables. The latter is
+        ``None`` if not quantized.
+    """
+    # First copy everything non-snapshot related.
+    recursive_copy_no_snapshots_no_seismograms_no_surface(
+        src=c_db,
+        dst=out,
+        quiet=quiet,
+        contiguous=contiguous,
+        compression_level=compression_level,
+        dimension_sizes={"snapshots": sampling["npts"]},
+        dimension_indices=dimension_indices,
+    )
+
+    # Keep the types of the time and space related attributes.
+    for name, value in attributes.items():
+        dtype = np.asarray(c_db.getncattr(name)).dtype
+        out.setncattr(name, np.array(value, dtype=dtype))
+
+    if contiguous:
+        zlib = False
+    else:
+        zlib = True
+
+    # We need the stf_dump and stf_d_dump datasets. They are either in the
+    # "Snapshots" group or in the "Surface" group.
+    for g in ("Snapshots", "Surface"):
+        if g not in c_db.groups:
+            continue
+        if "stf_dump" not in c_db[g].variables:
+            continue
+        break
+    else:
+        raise Exception("Could not find `stf_dump` array.")
+
+    stf_dump = c_db[g]["stf_dump"]
+    stf_d_dump = c_db[g]["stf_d_dump"]
+
+    for data in [stf_dump, stf_d_dump]:
+        chunksizes = (sampling["npts"],)
+        if contiguous:
+            chunksizes = None
+        d = out.createVariable(
+            varname=data.name,
+            dimensions=["snapshots"],
+            contiguous=contiguous,
+            zlib=zlib,
+            chunksizes=chunksizes,
+            datatype=data.dtype,
+        )
+        d[:] = decimate_snapshots(
+            data[:],
+            decimation_factor=decimation_factor,
+            offset=sampling["offset"],
+            npts=sampling["npts"],
+        )
 
     # Create new dimensions.
-    dim_ipol = out.createDimension("ipol", 5)
-    dim_jpol = out.createDimension("jpol", 5)
-    dim_nvars = out.createDimension("nvars", len(meshes))
-    nelem = out.getncattr("nelem_kwf_global")
-    dim_elements = out.createDimension("elements", nelem)
+    dim_ipol = out.createDimension("ipol", shape[3])
+    dim_jpol = out.createDimension("jpol", shape[2])
+    dim_nvars = out.createDimension("nvars", shape[1])
+    dim_elements = out.createDimension("elements", shape[0])
 
     # New dimensions for the 5D Array.
     dims = (
@@ -459,9 +1298,9 @@ def _merge_files(input, out, contiguous, compression_level, quiet):
     if contiguous:
         chunksizes = None
     else:
-        # Each chunk is exactly the data from one element.
+        # Each chunk is exactly the data from one or a few elements.
         chunksizes = [_i.size for _i in dims]
-        chunksizes[0] = 1
+        chunksizes[0] = min(elements_per_chunk, shape[0])
 
     # We'll called it MergedSnapshots
     x = out.createVariable(
@@ -470,80 +1309,46 @@ def _merge_files(input, out, contiguous, compression_level, quiet):
         contiguous=contiguous,
         zlib=zlib,
         chunksizes=chunksizes,
-        datatype=dtype,
+        datatype=out_dtype,
     )
 
-    utemp = np.zeros([_i.size for _i in dims[1:]], dtype=dtype, order="C")
-
-    # We also re-sort the elements to follow the traversal of a kd-tree in
-    # the same fashion instaseis uses it - this should allow for even faster
-    # I/O for spatially adjacent elements.
+    # Quantized data requires a scale factor per element and variable.
+    scale_var = None
+    if quantization:
+        scale_var = out.createVariable(
+            varname="MergedSnapshotsScale",
+            dimensions=dimensions[:2],
+            contiguous=contiguous,
+            zlib=zlib,
+            datatype=np.float32,
+        )
 
-    # Get the midpoints for each element.
-    s_mp = c_db["Mesh"]["mp_mesh_S"][:]
-    z_mp = c_db["Mesh"]["mp_mesh_Z"][:]
+    # Map the GLL point ids to the possibly subsetted GLL points.
+    if subset is None:
 
-    # Fill kd-tree.
-    midpoints = np.empty((s_mp.shape[0], 2), dtype=s_mp.dtype)
-    midpoints[:, 0] = s_mp[:]
-    midpoints[:, 1] = z_mp[:]
-    kdtree = cKDTree(data=midpoints)
+        def remap(ids):
+            return ids
 
-    # This is now the order in which we will write the indices.
-    inds = kdtree.indices
-
-    # Make sure all indices are available.
-    assert list(range(nelem)) == sorted(inds)
+    else:
 
-    sem_mesh = c_db["Mesh"]["sem_mesh"][:].copy()
+        def remap(ids):
+            return np.searchsorted(subset["gllpoints"], ids).astype(ids.dtype)
 
     # Resort and write the new order to the file.
-    out["Mesh"]["sem_mesh"][:] = sem_mesh[inds]
-    out["Mesh"]["fem_mesh"][:] = out["Mesh"]["fem_mesh"][:][inds]
+    out["Mesh"]["sem_mesh"][:] = remap(sem_mesh)[inds]
+    out["Mesh"]["fem_mesh"][:] = remap(out["Mesh"]["fem_mesh"][:])[inds]
+    out["Mesh"]["midpoint_mesh"][:] = remap(out["Mesh"]["midpoint_mesh"][:])[
+        inds
+    ]
 
     # We'll also have to resort the midpoints.
-    out["Mesh"]["mp_mesh_S"][:] = c_db["Mesh"]["mp_mesh_S"][:][inds]
-    out["Mesh"]["mp_mesh_Z"][:] = c_db["Mesh"]["mp_mesh_Z"][:][inds]
+    out["Mesh"]["mp_mesh_S"][:] = s_mp[inds]
+    out["Mesh"]["mp_mesh_Z"][:] = z_mp[inds]
     # And a couple of other things.
     out["Mesh"]["eltype"][:] = out["Mesh"]["eltype"][:][inds]
     out["Mesh"]["axis"][:] = out["Mesh"]["axis"][:][inds]
 
-    if not quiet:
-        click.echo(click.style("\tCreating '/MergedSnapshots'...", fg="blue"))
-        pbar = click.progressbar
-    else:
-        pbar = dummy_progressbar
-
-    with pbar(range(nelem), length=nelem, label="\t  ") as indices:
-        for elem_id in indices:
-            # Get the old and new indices.
-            old_index = elem_id
-            new_index = np.where(inds == elem_id)[0][0]
-
-            gll_point_ids = sem_mesh[old_index]
-
-            # Load displacement from all GLL points.
-            for i, var in enumerate(meshes):
-                # The list of ids we have is unique but not sorted.
-                ids = gll_point_ids.flatten()
-                s_ids = np.sort(ids)
-                if time_axis == 0:
-                    temp = var[:, s_ids]
-                    for jpol in range(dim_jpol.size):
-                        for ipol in range(dim_ipol.size):
-                            idx = ipol * 5 + jpol
-                            utemp[i, jpol, ipol, :] = temp[
-                                :, np.argwhere(s_ids == ids[idx])[0][0]
-                            ]
-                else:
-                    temp = var[s_ids, :]
-                    for jpol in range(dim_jpol.size):
-                        for ipol in range(dim_ipol.size):
-                            idx = ipol * 5 + jpol
-                            utemp[i, jpol, ipol, :] = temp[
-                                np.argwhere(s_ids == ids[idx])[0][0], :
-                            ]
-            x[new_index] = utemp
+    return x, scale_var
 
 
 @click.command()
@@ -574,18 +1379,152 @@ def _merge_files(input, out, contiguous, compression_level, quiet):
     "issues. `merge` will create a single much larger file "
     "which is much quicker to read but will take more space.",
 )
+@click.option(
+    "--quantize",
+    type=click.Choice(sorted(QUANTIZATION_TYPES.keys())),
+    help="Lossy storage of the snapshots as integers with a scale factor "
+    "per element and variable. Only for the `merge` method.",
+)
+@click.option(
+    "--decimation_factor",
+    type=click.IntRange(1, None),
+    default=1,
+    help="Low-pass filter and decimate the snapshots by this factor. Only "
+    "for the `merge` method.",
+)
+@click.option(
+    "--max_length",
+    type=click.FloatRange(0, None),
+    help="Truncate the records to this many seconds after the origin time "
+    "of the source. Only for the `merge` method.",
+)
+@click.option(
+    "--min_radius",
+    type=click.FloatRange(0, None),
+    help="Only keep the elements above this radius in km. Only for the "
+    "`merge` method.",
+)
+@click.option(
+    "--max_depth",
+    type=click.FloatRange(0, None),
+    help="Only keep the elements above this depth in km. Only for the "
+    "`merge` method.",
+)
+@click.option(
+    "--min_colatitude",
+    type=click.FloatRange(0, 180),
+    help="Only keep the elements with a larger colatitude in degree. Only "
+    "for the `merge` method.",
+)
+@click.option(
+    "--max_colatitude",
+    type=click.FloatRange(0, 180),
+    help="Only keep the elements with a smaller colatitude in degree. Only "
+    "for the `merge` method.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(1, None),
+    default=1,
+    help="Number of threads decimating and quantizing the snapshots while "
+    "the next elements are read. Only for the `merge` method.",
+)
+@click.option(
+    "--max_memory",
+    type=click.IntRange(1, None),
+    default=512,
+    help="Approximate memory limit in MB for the snapshots being processed. "
+    "Only for the `merge` method.",
+)
+@click.option(
+    "--element_order",
+    type=click.Choice(ELEMENT_ORDERS),
+    default="kdtree",
+    help="Order of the elements in the merged file. `kdtree` follows the "
+    "traversal of instaseis' kd-tree, `hilbert` and `zorder` the "
+    "respective space filling curve, and `access` places elements accessed "
+    "after each other in the `--access_log` next to each other. Only for "
+    "the `merge` method.",
+)
+@click.option(
+    "--access_log",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Text file with the accessed s and z mesh coordinates in meter as "
+    "columns, e.g. written by the benchmark's `--access_log` option. "
+    "Required for the `access` element order.",
+)
+@click.option(
+    "--elements_per_chunk",
+    type=click.IntRange(1, None),
+    default=1,
+    help="Number of elements per chunk of the merged snapshots. Only for "
+    "the `merge` method.",
+)
+@click.option(
+    "--points_per_chunk",
+    type=click.IntRange(1, None),
+    help="Number of GLL points per chunk of the snapshots. Defaults to "
+    "chunks of about 32 kB. Only for the `transpose` and `repack` methods.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Resume an interrupted merge. Requires the same input and "
+    "settings. Only for the `merge` method.",
+)
 def repack_database(
-    input_folder, output_folder, contiguous, compression_level, method
+    input_folder,
+    output_folder,
+    contiguous,
+    compression_level,
+    method,
+    quantize,
+    decimation_factor,
+    max_length,
+    min_radius,
+    max_depth,
+    min_colatitude,
+    max_colatitude,
+    workers,
+    max_memory,
+    resume,
+    element_order,
+    access_log,
+    elements_per_chunk,
+    points_per_chunk,
 ):
-    found_filenames = []
-    for root, _, filenames in os.walk(input_folder, followlinks=True):
-        for filename in sorted(filenames, reverse=True):
-            if filename not in ["ordered_output.nc4", "axisem_output.nc4"]:
-                continue
-            found_filenames.append(os.path.join(root, filename))
-            break
+    if (element_order == "access") != (access_log is not None):
+        raise click.UsageError(
+            "--access_log is required for and only used by the `access` "
+            "element order."
+        )
 
-    assert found_filenames, "No files named `ordered_output.nc4` found."
+    if method != "merge":
+        for name, value in [
+            ("--quantize", quantize),
+            ("--decimation_factor", decimation_factor != 1),
+            ("--max_length", max_length is not None),
+            ("--min_radius", min_radius is not None),
+            ("--max_depth", max_depth is not None),
+            ("--min_colatitude", min_colatitude is not None),
+            ("--max_colatitude", max_colatitude is not None),
+            ("--workers", workers != 1),
+            ("--max_memory", max_memory != 512),
+            ("--resume", resume),
+            ("--element_order", element_order != "kdtree"),
+            ("--elements_per_chunk", elements_per_chunk != 1),
+        ]:
+            if value:
+                raise click.UsageError(
+                    "%s is only available for the `merge` method." % name
+                )
+
+    if method == "merge" and points_per_chunk is not None:
+        raise click.UsageError(
+            "--points_per_chunk is not available for the `merge` method."
+        )
+
+    found_filenames = find_database_files(input_folder)
 
     input_folder = os.path.normpath(os.path.realpath(input_folder))
     output_folder = os.path.normpath(os.path.realpath(output_folder))
@@ -596,41 +1535,18 @@ def repack_database(
         ]:
             raise ValueError("ordered_output.nc4 already exists.")
     else:
-        os.makedirs(output_folder)
+        os.makedirs(output_folder, exist_ok=resume)
 
     if method in ["transpose", "repack"]:
-        for _i, filename in enumerate(found_filenames):
-            click.echo(
-                click.style(
-                    "--> Processing file %i of %i: %s"
-                    % (_i + 1, len(found_filenames), filename),
-                    fg="green",
-                )
-            )
-
-            output_filename = os.path.join(
-                output_folder, os.path.relpath(filename, input_folder)
-            )
-
-            output_filename = output_filename.replace(
-                "axisem_output.nc4", "ordered_output.nc4"
-            )
-
-            if not input_folder == output_folder:
-                os.makedirs(os.path.dirname(output_filename))
-
-            if method == "transpose":
-                transpose = True
-            else:
-                transpose = False
-
-            repack_file(
-                input_filename=filename,
-                output_filename=output_filename,
-                contiguous=contiguous,
-                transpose=transpose,
-                compression_level=compression_level,
-            )
+        repack_files(
+            filenames=found_filenames,
+            input_folder=input_folder,
+            output_folder=output_folder,
+            contiguous=contiguous,
+            compression_level=compression_level,
+            transpose=method == "transpose",
+            points_per_chunk=points_per_chunk,
+        )
     elif method == "merge":
         merge_files(
             filenames=found_filenames,
@@ -638,6 +1554,19 @@ def repack_database(
             contiguous=contiguous,
             compression_level=compression_level,
             quiet=False,
+            quantization=quantize,
+            decimation_factor=decimation_factor,
+            max_length=max_length,
+            min_radius=min_radius,
+            max_depth=max_depth,
+            min_colatitude=min_colatitude,
+            max_colatitude=max_colatitude,
+            workers=workers,
+            max_memory_in_mb=max_memory,
+            resume=resume,
+            element_order=element_order,
+            access_log=access_log,
+            elements_per_chunk=elements_per_chunk,
         )
     else:
         raise NotImplementedError
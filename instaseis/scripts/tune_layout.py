@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Find the best on-disc layout of an Instaseis database.
+
+The optimal chunking and compression of a database depends on the file
+system, the hardware, and the typical workload. This script writes small
+sample databases with different layouts from a database in the multi file
+layout, replays the same extraction workload against each of them, and
+reports the latency and throughput per layout together with the
+``repack_db`` options that produced the best one.
+
+Usage:
+
+.. code-block:: bash
+
+    $ python -m instaseis.scripts.tune_layout --max_depth 100 \\
+        --max_colatitude 30 DB
+
+A spatial subset keeps the samples small and the workload then only requests
+seismograms within that region. Only merged layouts can be subsetted so
+giving any of the subset options restricts the comparison to merged layouts -
+full copies of the other layouts would not be comparable. The results do not
+account for OS level caches - the freshly written sample databases most
+likely still reside in the page cache.
+
+Requires click, netCDF4, and numpy.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import itertools
+import os
+import shutil
+import tempfile
+import timeit
+
+import click
+import numpy as np
+
+from instaseis import open_db
+from instaseis.scripts.compare_dbs import get_random_geometries
+from instaseis.scripts.repack_db import (
+    find_database_files,
+    merge_files,
+    repack_files,
+)
+
+
+def get_layouts(
+    methods=("merge", "transpose", "repack"),
+    compression_levels=(1, 4),
+    elements_per_chunk=(1, 4, 16),
+    points_per_chunk=(None,),
+    contiguous=True,
+):
+    """
+    All combinations of the given layout parameters.
+
+    :param methods: The repacking methods.
+    :param compression_levels: Compression levels of chunked layouts.
+    :param elements_per_chunk: Elements per chunk of merged layouts.
+    :param points_per_chunk: GLL points per chunk of the other layouts.
+        ``None`` is the default chunking of ``repack_db``.
+    :param contiguous: Also test contiguous layouts.
+    """
+    layouts = []
+    for method in methods:
+        if contiguous:
+            layouts.append({"method": method, "contiguous": True})
+        if method == "merge":
+            chunks = [{"elements_per_chunk": _i} for _i in elements_per_chunk]
+        else:
+            chunks = [{"points_per_chunk": _i} for _i in points_per_chunk]
+        for level, chunk in itertools.product(compression_levels, chunks):
+            layout = {
+                "method": method,
+                "contiguous": False,
+                "compression_level": level,
+            }
+            layout.update(chunk)
+            layouts.append(layout)
+    return layouts
+
+
+def repack_options(layout):
+    """
+    The ``repack_db`` command line options resulting in the given layout.
+    """
+    options = ["--method %s" % layout["method"]]
+    if layout["contiguous"]:
+        options.append("--contiguous")
+        return " ".join(options)
+    options.append("--compression_level %i" % layout["compression_level"])
+    if layout.get("elements_per_chunk", 1) != 1:
+        options.append(
+            "--elements_per_chunk %i" % layout["elements_per_chunk"]
+        )
+    if layout.get("points_per_chunk"):
+        options.append("--points_per_chunk %i" % layout["points_per_chunk"])
+    return " ".join(options)
+
+
+def create_layout(filenames, input_folder, output_folder, layout, subset):
+    """
+    Write a sample database with the given layout.
+
+    :param subset: Spatial subset options passed to
+        :func:`~instaseis.scripts.repack_db.merge_files`. Only merged
+        layouts can be subsetted.
+    """
+    # Compression level is irrelevant for contiguous files but still
+    # required.
+    compression_level = layout.get("compression_level", 1)
+    if layout["method"] == "merge":
+        os.makedirs(output_folder)
+        merge_files(
+            filenames=filenames,
+            output_folder=output_folder,
+            contiguous=layout["contiguous"],
+            compression_level=compression_level,
+            quiet=True,
+            elements_per_chunk=layout.get("elements_per_chunk", 1),
+            **subset,
+        )
+    else:
+        repack_files(
+            filenames=filenames,
+            input_folder=input_folder,
+            output_folder=output_folder,
+            contiguous=layout["contiguous"],
+            compression_level=compression_level,
+            transpose=layout["method"] == "transpose",
+            quiet=True,
+            points_per_chunk=layout.get("points_per_chunk"),
+        )
+
+
+def run_workload(path, workload, buffer_size_in_mb=0, read_on_demand=True):
+    """
+    Extract all seismograms of the workload.
+
+    :returns: The time per extraction in seconds.
+    """
+    db = open_db(
+        path,
+        buffer_size_in_mb=buffer_size_in_mb,
+        read_on_demand=read_on_demand,
+    )
+    times = []
+    for source, receiver in workload:
+        a = timeit.default_timer()
+        db.get_seismograms(
+            source=source, receiver=receiver, return_obspy_stream=False
+        )
+        times.append(timeit.default_timer() - a)
+    return np.array(times, dtype=np.float64)
+
+
+def _folder_size_in_mb(folder):
+    size = 0
+    for root, _, filenames in os.walk(folder):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(root, filename))
+    return size / 1024.0 ** 2
+
+
+def tune_layout(
+    input_folder,
+    work_folder,
+    layouts,
+    count=200,
+    seed=None,
+    subset=None,
+    buffer_size_in_mb=0,
+    read_on_demand=True,
+    quiet=False,
+):
+    """
+    Write sample databases for all layouts and benchmark them.
+
+    :param input_folder: Database in the multi file layout.
+    :param work_folder: The sample databases are written to this folder.
+    :param layouts: The layouts, e.g. from :func:`get_layouts`.
+    :param count: The number of extractions per layout.
+    :param seed: Optional seed for reproducible workloads.
+    :param subset: Optional spatial subset options of the samples and the
+        workload. Requires all layouts to be merged layouts.
+    :param buffer_size_in_mb: Buffer size when opening the samples. The
+        default of zero measures the actual I/O.
+    :param read_on_demand: Open the samples in read on demand mode.
+    :param quiet: Do not print progress.
+    :returns: A list of result dictionaries, one per layout, sorted by
+        descending throughput.
+    """
+    subset = {
+        key: value
+        for key, value in (subset or {}).items()
+        if value is not None
+    }
+    if subset and any(_i["method"] != "merge" for _i in layouts):
+        raise ValueError(
+            "Only merged layouts can be restricted to a spatial subset."
+        )
+    filenames = find_database_files(input_folder)
+    workload = get_random_geometries(
+        open_db(input_folder).info, count=count, seed=seed, subset=subset
+    )
+
+    results = []
+    for _i, layout in enumerate(layouts):
+        options = repack_options(layout)
+        if not quiet:
+            click.echo(
+                click.style(
+                    "--> Layout %i of %i: %s"
+                    % (_i + 1, len(layouts), options),
+                    fg="green",
+                )
+            )
+        output_folder = os.path.join(work_folder, "layout_%03i" % _i)
+        a = timeit.default_timer()
+        create_layout(
+            filenames=filenames,
+            input_folder=input_folder,
+            output_folder=output_folder,
+            layout=layout,
+            subset=subset,
+        )
+        creation_time = timeit.default_timer() - a
+        times = run_workload(
+            output_folder,
+            workload,
+            buffer_size_in_mb=buffer_size_in_mb,
+            read_on_demand=read_on_demand,
+        )
+        results.append(
+            {
+                "layout": layout,
+                "options": options,
+                "path": output_folder,
+                "size_in_mb": _folder_size_in_mb(output_folder),
+                "creation_time": creation_time,
+                "latency_p50": float(np.percentile(times, 50)),
+                "latency_p90": float(np.percentile(times, 90)),
+                "throughput": len(times) / times.sum(),
+            }
+        )
+
+    results.sort(key=lambda x: x["throughput"], reverse=True)
+    return results
+
+
+@click.command()
+@click.argument(
+    "input_folder",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+)
+@click.option(
+    "--work_folder",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Folder for the sample databases. Defaults to a temporary folder.",
+)
+@click.option(
+    "--keep",
+    is_flag=True,
+    help="Keep the sample databases.",
+)
+@click.option(
+    "--method",
+    "methods",
+    type=click.Choice(["merge", "transpose", "repack"]),
+    multiple=True,
+    default=["merge", "transpose", "repack"],
+    show_default=True,
+    help="Repacking method to test. Can be given multiple times. The "
+    "spatial subset options only support merge.",
+)
+@click.option(
+    "--compression_level",
+    "compression_levels",
+    type=click.IntRange(1, 9),
+    multiple=True,
+    default=[1, 4],
+    show_default=True,
+    help="Compression level to test. Can be given multiple times.",
+)
+@click.option(
+    "--elements_per_chunk",
+    type=click.IntRange(1, None),
+    multiple=True,
+    default=[1, 4, 16],
+    show_default=True,
+    help="Elements per chunk of merged layouts to test. Can be given "
+    "multiple times.",
+)
+@click.option(
+    "--points_per_chunk",
+    type=click.IntRange(1, None),
+    multiple=True,
+    help="GLL points per chunk of the other layouts to test. Can be given "
+    "multiple times. Defaults to the chunking of `repack_db`.",
+)
+@click.option(
+    "--no_contiguous",
+    is_flag=True,
+    help="Do not test contiguous layouts.",
+)
+@click.option(
+    "--count",
+    type=click.IntRange(1, None),
+    default=200,
+    show_default=True,
+    help="Number of seismograms extracted per layout.",
+)
+@click.option(
+    "--seed", type=int, help="Seed to make the workload reproducible."
+)
+@click.option(
+    "--buffer_size_in_mb",
+    type=click.IntRange(0, None),
+    default=0,
+    show_default=True,
+    help="Buffer size of the sample databases.",
+)
+@click.option(
+    "--min_radius",
+    type=click.FloatRange(0, None),
+    help="Restrict samples and workload to radii above this value in km.",
+)
+@click.option(
+    "--max_depth",
+    type=click.FloatRange(0, None),
+    help="Restrict samples and workload to depths above this value in km.",
+)
+@click.option(
+    "--min_colatitude",
+    type=click.FloatRange(0, 180),
+    help="Restrict samples and workload to larger colatitudes in degree.",
+)
+@click.option(
+    "--max_colatitude",
+    type=click.FloatRange(0, 180),
+    help="Restrict samples and workload to smaller colatitudes in degree.",
+)
+def main(
+    input_folder,
+    work_folder,
+    keep,
+    methods,
+    compression_levels,
+    elements_per_chunk,
+    points_per_chunk,
+    no_contiguous,
+    count,
+    seed,
+    buffer_size_in_mb,
+    min_radius,
+    max_depth,
+    min_colatitude,
+    max_colatitude,
+):
+    subset = {
+        "min_radius": min_radius,
+        "max_depth": max_depth,
+        "min_colatitude": min_colatitude,
+        "max_colatitude": max_colatitude,
+    }
+    if any(_i is not None for _i in subset.values()):
+        if "merge" not in methods:
+            raise click.UsageError(
+                "The spatial subset options require the merge method."
+            )
+        if set(methods) != {"merge"}:
+            click.echo(
+                click.style(
+                    "Only merged layouts can be subsetted - skipping the "
+                    "other methods.",
+                    fg="yellow",
+                )
+            )
+        methods = ["merge"]
+
+    layouts = get_layouts(
+        methods=methods,
+        compression_levels=compression_levels,
+        elements_per_chunk=elements_per_chunk,
+        points_per_chunk=points_per_chunk or (None,),
+        contiguous=not no_contiguous,
+    )
+
+    if work_folder is None:
+        work_folder = tempfile.mkdtemp(prefix="instaseis_tune_layout_")
+    else:
+        os.makedirs(work_folder)
+
+    try:
+        results = tune_layout(
+            input_folder=input_folder,
+            work_folder=work_folder,
+            layouts=layouts,
+            count=count,
+            seed=seed,
+            subset=subset,
+            buffer_size_in_mb=buffer_size_in_mb,
+        )
+    finally:
+        if not keep:
+            shutil.rmtree(work_folder)
+
+    click.echo("")
+    click.echo(
+        "%-64s %9s %9s %9s %8s"
+        % ("repack_db options", "p50 [ms]", "p90 [ms]", "sm/sec", "MB")
+    )
+    for r in results:
+        click.echo(
+            "%-64s %9.3f %9.3f %9.1f %8.1f"
+            % (
+                r["options"],
+                r["latency_p50"] * 1e3,
+                r["latency_p90"] * 1e3,
+                r["throughput"],
+                r["size_in_mb"],
+            )
+        )
+    click.echo("")
+    click.echo(
+        click.style(
+            "Recommended: python -m instaseis.scripts.repack_db %s "
+            "INPUT_FOLDER OUTPUT_FOLDER" % results[0]["options"],
+            fg="green",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,108 @@ if __name__ == "__main__":
         "a single finite source for the /finite_source "
         "route.",
     )
+    parser.add_argument(
+        "--chunk_cache_auto",
+        action="store_true",
+        help="Size the HDF5 chunk cache from the chunk shape of the "
+        "database and the buffer size. Mostly useful for compressed "
+        "databases.",
+    )
+    parser.add_argument(
+        "--rdcc_nbytes",
+        type=int,
+        help="Size of the HDF5 chunk cache per file in bytes.",
+    )
+    parser.add_argument(
+        "--rdcc_nslots",
+        type=int,
+        help="Number of hash table slots of the HDF5 chunk cache.",
+    )
+    parser.add_argument(
+        "--rdcc_w0",
+        type=float,
+        help="HDF5 chunk cache eviction policy between 0 and 1.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=12,
+        help="Number of threads or processes extracting seismograms for "
+        "all routes.",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["thread", "process"],
+        default="thread",
+        help="Extract in threads or in worker processes each opening the "
+        "database. Processes scale with the number of cores but every one "
+        "of them has its own buffers.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of server processes sharing the port, each opening "
+        "the database. 0 starts one process per core.",
+    )
+    parser.add_argument(
+        "--response_cache_size_in_mb",
+        type=int,
+        default=0,
+        help="Cache complete responses of the /seismograms, "
+        "/seismograms_raw, and /greens_function routes up to this size. "
+        "0 disables the cache.",
+    )
+    parser.add_argument(
+        "--response_cache_directory",
+        type=str,
+        help="Store the cached responses in this directory instead of in "
+        "memory.",
+    )
+    parser.add_argument(
+        "--max_requests",
+        type=int,
+        help="Maximum number of time series requests processed at the same "
+        "time. Further ones wait in a queue.",
+    )
+    parser.add_argument(
+        "--max_requests_per_client",
+        type=int,
+        help="Maximum number of processed and waiting time series requests "
+        "per client address. Further ones are rejected with a 429 error.",
+    )
+    parser.add_argument(
+        "--max_cost",
+        type=int,
+        help="Maximum summed estimated cost (receivers x components x point "
+        "sources) of the time series requests processed at the same time.",
+    )
+    parser.add_argument(
+        "--max_queue_size",
+        type=int,
+        help="Maximum number of requests waiting to be processed. Further "
+        "ones are rejected with a 503 error.",
+    )
+    parser.add_argument(
+        "--queue_timeout",
+        type=float,
+        help="Reject requests waiting longer than this many seconds with a "
+        "503 error.",
+    )
+    parser.add_argument(
+        "--extraction_statistics",
+        action="store_true",
+        help="Record the bytes read and the time spent in each stage of the "
+        "extraction for the /metrics route. Adds a small overhead to every "
+        "extraction.",
+    )
+    parser.add_argument(
+        "--server_timing",
+        choices=["header", "trailer"],
+        help="Report the time spent in each stage of the extraction. "
+        "'header' sends a Server-Timing header but disables streaming, "
+        "'trailer' adds a 'server_timing.json' file to SAC zip archives.",
+    )
 
     parser.add_argument("db_path", type=str, help="Database path")
     parser.add_argument(
@@ -53,6 +155,15 @@ if __name__ == "__main__":
     args = parser.parse_args()
     db_path = os.path.abspath(args.db_path)
 
+    if args.chunk_cache_auto:
+        chunk_cache = "auto"
+    else:
+        chunk_cache = {
+            key: getattr(args, key)
+            for key in ("rdcc_nbytes", "rdcc_nslots", "rdcc_w0")
+            if getattr(args, key) is not None
+        }
+
     launch_io_loop(
         db_path=db_path,
         port=args.port,
@@ -60,4 +171,17 @@ if __name__ == "__main__":
         max_size_of_finite_sources=args.max_size_of_finite_sources,
         quiet=args.quiet,
         log_level=args.log_level,
+        chunk_cache=chunk_cache,
+        server_timing=args.server_timing,
+        workers=args.workers,
+        executor=args.executor,
+        processes=args.processes,
+        response_cache_size_in_mb=args.response_cache_size_in_mb,
+        response_cache_directory=args.response_cache_directory,
+        max_requests=args.max_requests,
+        max_requests_per_client=args.max_requests_per_client,
+        max_cost=args.max_cost,
+        max_queue_size=args.max_queue_size,
+        queue_timeout=args.queue_timeout,
+        extraction_statistics=args.extraction_statistics,
     )
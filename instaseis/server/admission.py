@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Admission control limiting the work of the time series routes.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import asyncio
+import collections
+import time
+
+import tornado.concurrent
+import tornado.web
+
+
+class _Ticket(object):
+    __slots__ = ("client", "cost", "future", "state", "created")
+
+    def __init__(self, client, cost):
+        self.client = client
+        self.cost = cost
+        self.future = tornado.concurrent.Future()
+        self.state = "waiting"
+        self.created = time.monotonic()
+
+
+class AdmissionControl(object):
+    """
+    Limits the number and the estimated cost of the requests processed at
+    the same time.
+
+    The cost of a request is the estimated number of extracted seismograms,
+    i.e. receivers x components x point sources. Requests are admitted
+    while the admitted requests stay below ``max_requests`` and their summed
+    cost below ``max_cost``. A single request more expensive than
+    ``max_cost`` is admitted once nothing else is processed. The others
+    wait in a queue in which cheaper requests may overtake more expensive
+    ones, keeping the latency of small requests predictable. Once the
+    oldest waiting request waited for ``max_overtake_time`` seconds nothing
+    is admitted before it anymore so a steady stream of cheap requests
+    cannot starve an expensive one.
+
+    Over-limit requests are rejected with a 429 if the client has too many
+    requests in flight and with a 503 if the queue is full or they waited
+    too long. Every limit is disabled if None.
+
+    All request handlers run in the thread of the IO loop so no locking is
+    required.
+
+    :param max_requests: The maximum number of admitted requests.
+    :param max_requests_per_client: The maximum number of admitted and
+        waiting requests per client address.
+    :param max_cost: The maximum summed cost of the admitted requests.
+    :param max_queue_size: The maximum number of waiting requests.
+    :param queue_timeout: The maximum time in seconds a request waits for
+        admission.
+    :param retry_after: Seconds after which rejected clients should retry.
+    :param max_overtake_time: The time in seconds after which a waiting
+        request can no longer be overtaken. None to always let cheaper
+        requests overtake.
+    """
+
+    def __init__(
+        self,
+        max_requests=None,
+        max_requests_per_client=None,
+        max_cost=None,
+        max_queue_size=None,
+        queue_timeout=None,
+        retry_after=5,
+        max_overtake_time=5.0,
+    ):
+        self.max_requests = max_requests
+        self.max_requests_per_client = max_requests_per_client
+        self.max_cost = max_cost
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.max_overtake_time = max_overtake_time
+
+        self.admitted = 0
+        self.admitted_cost = 0
+        self.clients = collections.Counter()
+        self.queue = collections.deque()
+
+    def limits(self):
+        """
+        The limits as a JSON serializable dictionary.
+        """
+        return {
+            "max_requests": self.max_requests,
+            "max_requests_per_client": self.max_requests_per_client,
+            "max_cost": self.max_cost,
+            "max_queue_size": self.max_queue_size,
+            "queue_timeout": self.queue_timeout,
+        }
+
+    def _fits(self, cost):
+        if self.max_requests is not None and (
+            self.admitted >= self.max_requests
+        ):
+            return False
+        if self.max_cost is not None and self.admitted:
+            return self.admitted_cost + cost <= self.max_cost
+        return True
+
+    def _admit(self, ticket):
+        ticket.state = "admitted"
+        self.admitted += 1
+        self.admitted_cost += ticket.cost
+        ticket.future.set_result(True)
+
+    def _head_is_due(self):
+        """
+        Whether the oldest waiting request can no longer be overtaken.
+        """
+        return (
+            self.max_overtake_time is not None
+            and bool(self.queue)
+            and time.monotonic() - self.queue[0].created
+            >= self.max_overtake_time
+        )
+
+    def _admit_waiting(self):
+        for ticket in list(self.queue):
+            if self._fits(ticket.cost):
+                self.queue.remove(ticket)
+                self._admit(ticket)
+            elif ticket is self.queue[0] and self._head_is_due():
+                break
+
+    def enqueue(self, client, cost):
+        """
+        Admit a request or put it into the queue. Returns a ticket which
+        must be passed to :meth:`release` once the request is finished.
+
+        :param client: The address of the client.
+        :param cost: The estimated cost of the request.
+        """
+        if (
+            self.max_requests_per_client is not None
+            and self.clients[client] >= self.max_requests_per_client
+        ):
+            msg = (
+                "Too many requests in flight. A maximum of %i concurrent "
+                "requests per client is allowed."
+                % self.max_requests_per_client
+            )
+            raise tornado.web.HTTPError(429, log_message=msg, reason=msg)
+
+        ticket = _Ticket(client=client, cost=cost)
+        if self._fits(cost) and not self._head_is_due():
+            self._admit(ticket)
+        elif (
+            self.max_queue_size is not None
+            and len(self.queue) >= self.max_queue_size
+        ):
+            msg = "Server is busy. Please try again later."
+            raise tornado.web.HTTPError(503, log_message=msg, reason=msg)
+        else:
+            self.queue.append(ticket)
+        self.clients[client] += 1
+        return ticket
+
+    async def wait(self, ticket):
+        """
+        Wait until the request is admitted. Returns False if it has been
+        released before being admitted.
+        """
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(ticket.future), self.queue_timeout
+            )
+        except asyncio.TimeoutError:
+            self.release(ticket)
+            msg = "Server is busy. Please try again later."
+            raise tornado.web.HTTPError(503, log_message=msg, reason=msg)
+
+    def release(self, ticket):
+        """
+        Release an admitted or a waiting request. Calling it more than once
+        does nothing.
+        """
+        if ticket.state == "released":
+            return
+        if ticket.state == "admitted":
+            self.admitted -= 1
+            self.admitted_cost -= ticket.cost
+        else:
+            self.queue.remove(ticket)
+            ticket.future.set_result(False)
+        ticket.state = "released"
+
+        self.clients[ticket.client] -= 1
+        if not self.clients[ticket.client]:
+            del self.clients[ticket.client]
+        self._admit_waiting()
@@ -9,19 +9,33 @@ Server offering a REST API for Instaseis.
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
+import atexit
+import concurrent.futures
+import glob
 import logging
+import os
+import shutil
+import signal
+import tempfile
 
-import tornado.gen
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 
 from ..database_interfaces import find_and_open_files
+from .admission import AdmissionControl
+from .cache import ResponseCache
+from .metrics import Metrics
+from .workers import get_process_pool
 
 from .routes.coordinates import CoordinatesHandler
 from .routes.events import EventHandler
 from .routes.travel_time import TravelTimeHandler
 from .routes.index import IndexHandler
 from .routes.info import InfoHandler
+from .routes.metrics import MetricsHandler
 from .routes.seismograms import SeismogramsHandler
 from .routes.seismograms_raw import RawSeismogramsHandler
 from .routes.greens import GreensFunctionHandler
@@ -32,15 +46,22 @@ from .routes.finite_source import FiniteSourceSeismogramsHandler
 # The tests will catch if this no longer works with newer tornado versions.
 tornado.web.GZipContentEncoding.CONTENT_TYPES.add("application/vnd.geo+json")
 
+# Shared by all applications not given an explicit executor, e.g. in the
+# tests.
+_DEFAULT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(12)
 
-def get_application():
+
+def get_application(executor=None):
     """
     Return the tornado application.
 
     This is a separate function to be able to get the same application
     objects for the tests.
+
+    :param executor: The executor running the extractions of all routes.
+        Defaults to a thread pool with 12 threads.
     """
-    return tornado.web.Application(
+    application = tornado.web.Application(
         [
             (r"/seismograms", SeismogramsHandler),
             (r"/seismograms_raw", RawSeismogramsHandler),
@@ -51,9 +72,87 @@ def get_application():
             (r"/coordinates", CoordinatesHandler),
             (r"/event", EventHandler),
             (r"/ttimes", TravelTimeHandler),
+            (r"/metrics", MetricsHandler),
         ],
         compress_response=True,
     )
+    application.executor = executor or _DEFAULT_EXECUTOR
+    application.metrics = Metrics()
+    application.server_timing = None
+    application.response_cache = None
+    # Futures of the responses of the requests in flight by key.
+    application.in_flight_responses = {}
+    # No limits by default.
+    application.admission = AdmissionControl()
+    return application
+
+
+def _is_running_child(pid):  # pragma: no cover
+    """
+    Whether ``pid`` is a running child of this process. Does not reap
+    exited children so Tornado still sees them.
+    """
+    try:
+        return (
+            os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+            is None
+        )
+    except ChildProcessError:
+        return False
+
+
+def _forward_signals_to_children(directory):  # pragma: no cover
+    """
+    The parent process of a pre-forked server only waits for its children.
+    Pass termination signals on to them - every child writes its metrics to
+    a file named after its process id. Files of crashed children might
+    remain so only running children of this process are signalled and not
+    some other process which reused the id.
+    """
+    parent = os.getpid()
+
+    def _forward(signum, frame):
+        for filename in glob.glob(os.path.join(directory, "*.json")):
+            pid = int(os.path.splitext(os.path.basename(filename))[0])
+            if not _is_running_child(pid):
+                continue
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _cleanup():
+        # atexit functions are inherited by the children.
+        if os.getpid() == parent:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, _forward)
+    atexit.register(_cleanup)
+
+
+def _shutdown_gracefully(
+    server, application, timeout=30.0
+):  # pragma: no cover
+    """
+    Stop accepting new connections and stop the IO loop once all requests
+    in flight are finished or after the timeout.
+    """
+    if getattr(application, "shutting_down", False):
+        return
+    application.shutting_down = True
+    server.stop()
+
+    io_loop = tornado.ioloop.IOLoop.current()
+    deadline = io_loop.time() + timeout
+
+    def _stop_when_idle():
+        if application.metrics.in_flight and io_loop.time() < deadline:
+            io_loop.call_later(0.1, _stop_when_idle)
+            return
+        io_loop.stop()
+
+    _stop_when_idle()
 
 
 def launch_io_loop(
@@ -66,6 +165,19 @@ def launch_io_loop(
     station_coordinates_callback=None,
     event_info_callback=None,
     travel_time_callback=None,
+    chunk_cache=None,
+    server_timing=None,
+    workers=12,
+    executor="thread",
+    processes=1,
+    response_cache_size_in_mb=0,
+    response_cache_directory=None,
+    max_requests=None,
+    max_requests_per_client=None,
+    max_cost=None,
+    max_queue_size=None,
+    queue_timeout=None,
+    extraction_statistics=False,
 ):  # pragma: no cover
     """
     Launch the instaseis server.
@@ -87,11 +199,77 @@ def launch_io_loop(
         information. If not given, certain requests will not be available.
     :param travel_time_callback: A callback function returning the travel
         time for certain seismic phase and a given source/receiver geometry.
+    :param chunk_cache: The HDF5 chunk cache parameters. ``None`` for the
+        HDF5 defaults, ``"auto"``, or a dictionary with any of the
+        ``rdcc_nbytes``, ``rdcc_nslots``, and ``rdcc_w0`` keys.
+    :param server_timing: Report the time spent in each stage of the
+        extraction for the time series routes. ``"header"`` sends a
+        ``Server-Timing`` header which disables streaming the response as
+        the header has to be sent first. ``"trailer"`` adds a
+        ``server_timing.json`` file to the end of SAC zip archives.
+    :param workers: The number of threads or processes extracting
+        seismograms for all routes.
+    :param executor: ``"thread"`` or ``"process"``. Worker processes each
+        open the database and are not limited by the locks of a single
+        process but every one of them has its own buffers.
+    :param processes: The number of server processes sharing the port.
+        Each process opens the database and has its own executor. ``0``
+        uses one process per core.
+    :param response_cache_size_in_mb: The size of the cache of complete
+        responses of the ``/seismograms``, ``/seismograms_raw``, and
+        ``/greens_function`` routes. ``0`` disables the cache. Every
+        server process has its own cache.
+    :param response_cache_directory: Store the cached responses in this
+        directory instead of in memory.
+    :param max_requests: The maximum number of time series requests
+        processed at the same time. Further ones wait in a queue.
+    :param max_requests_per_client: The maximum number of processed and
+        waiting time series requests per client. Further ones are rejected
+        with a 429 error.
+    :param max_cost: The maximum summed estimated cost, i.e. receivers x
+        components x point sources, of the time series requests processed
+        at the same time.
+    :param max_queue_size: The maximum number of waiting requests. Further
+        ones are rejected with a 503 error.
+    :param queue_timeout: Reject requests waiting longer than this many
+        seconds with a 503 error.
+    :param extraction_statistics: Record the bytes read and the time spent
+        in each stage of the extraction for the ``/metrics`` route. Adds a
+        small overhead to every extraction.
     """
-    application = get_application()
+    if processes != 1:
+        # Bind before forking so all processes accept connections on the
+        # same socket. Everything else must be created after the fork.
+        sockets = tornado.netutil.bind_sockets(port)
+        metrics_directory = tempfile.mkdtemp(prefix="instaseis_metrics_")
+        _forward_signals_to_children(metrics_directory)
+        tornado.process.fork_processes(processes)
+    else:
+        sockets = None
+        metrics_directory = None
+
+    if executor == "thread":
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+    elif executor == "process":
+        executor = get_process_pool(
+            db_path=db_path,
+            workers=workers,
+            buffer_size_in_mb=buffer_size_in_mb,
+            chunk_cache=chunk_cache,
+        )
+    else:
+        raise ValueError("executor must be either 'thread' or 'process'.")
+
+    application = get_application(executor=executor)
+    application.metrics.directory = metrics_directory
     application.db = find_and_open_files(
-        path=db_path, buffer_size_in_mb=buffer_size_in_mb
+        path=db_path,
+        buffer_size_in_mb=buffer_size_in_mb,
+        chunk_cache=chunk_cache,
     )
+    # Timings and counters for the /metrics route.
+    if extraction_statistics:
+        application.db.stats.enable()
     application.station_coordinates_callback = station_coordinates_callback
     application.event_info_callback = event_info_callback
 
@@ -105,6 +283,22 @@ def launch_io_loop(
     # might take very long then so be aware!
     application.max_size_of_finite_sources = int(max_size_of_finite_sources)
 
+    application.server_timing = server_timing
+
+    application.admission = AdmissionControl(
+        max_requests=max_requests,
+        max_requests_per_client=max_requests_per_client,
+        max_cost=max_cost,
+        max_queue_size=max_queue_size,
+        queue_timeout=queue_timeout,
+    )
+
+    if response_cache_size_in_mb:
+        application.response_cache = ResponseCache(
+            max_size_in_bytes=response_cache_size_in_mb * 1024 ** 2,
+            directory=response_cache_directory,
+        )
+
     if not quiet:
         # Get all tornado loggers.
         access_log = logging.getLogger("tornado.access")
@@ -129,5 +323,30 @@ def launch_io_loop(
         app_log.info("Successfully opened DB")
         app_log.info(str(application.db))
 
-    application.listen(port)
-    tornado.ioloop.IOLoop.instance().start()
+    if sockets is None:
+        server = application.listen(port)
+    else:
+        server = tornado.httpserver.HTTPServer(application)
+        server.add_sockets(sockets)
+
+    io_loop = tornado.ioloop.IOLoop.current()
+    executors = {"extraction": application.executor}
+
+    if metrics_directory is not None:
+        application.metrics.write_snapshot(application.db, executors)
+        atexit.register(application.metrics.remove_snapshot)
+        tornado.ioloop.PeriodicCallback(
+            lambda: application.metrics.write_snapshot(
+                application.db, executors
+            ),
+            1000,
+        ).start()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        io_loop.asyncio_loop.add_signal_handler(
+            signum, _shutdown_gracefully, server, application
+        )
+
+    io_loop.start()
+
+    application.executor.shutdown()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache of complete responses of the deterministic time series routes.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import collections
+import hashlib
+import os
+
+from .. import __version__
+
+
+def database_fingerprint(db):
+    """
+    String changing whenever any of the files of the database or the
+    Instaseis version change.
+
+    :param db: An open instaseis database.
+    """
+    parts = [__version__, os.path.abspath(db.info.directory)]
+    for mesh in db.meshes:
+        if not mesh:
+            continue
+        stat = os.stat(mesh.filename)
+        parts.append(
+            "%s:%i:%i" % (mesh.filename, stat.st_size, stat.st_mtime_ns)
+        )
+    return "\n".join(parts)
+
+
+def cache_key(fingerprint, route, args):
+    """
+    Key of a response.
+
+    :param fingerprint: The fingerprint of the database.
+    :param route: The route, e.g. ``"/seismograms"``.
+    :param args: The parsed and validated arguments of the request.
+    """
+    # The arguments are already converted to their types so equivalent
+    # queries, e.g. with differently formatted floats, share a key.
+    canonical = repr(sorted(args.items()))
+    return hashlib.sha256(
+        "\n".join([fingerprint, route, canonical]).encode()
+    ).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    Least recently used cache of response bodies and headers limited by the
+    total size of the bodies.
+
+    All request handlers run in the thread of the IO loop so no locking is
+    required.
+
+    :param max_size_in_bytes: The maximum summed size of all bodies.
+        Responses larger than this are not cached.
+    :param directory: Store the bodies in this directory instead of in
+        memory. The index is always kept in memory so the cache is empty
+        after a restart.
+    """
+
+    def __init__(self, max_size_in_bytes, directory=None):
+        self.max_size_in_bytes = int(max_size_in_bytes)
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        # key -> (size, headers, body or None if stored on disc)
+        self._entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+        Return ``(headers, body)`` or None if the key is not cached.
+        """
+        try:
+            size, headers, body = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if self.directory is not None:
+            try:
+                with open(self._filename(key), "rb") as fh:
+                    body = fh.read()
+            except OSError:  # pragma: no cover
+                self._remove(key)
+                self.misses += 1
+                return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return headers, body
+
+    def set(self, key, headers, body):
+        """
+        Cache a response, evicting the least recently used ones if
+        necessary.
+
+        :param key: The key.
+        :param headers: Dictionary of headers to send with the body.
+        :param body: The body as bytes.
+        """
+        if len(body) > self.max_size_in_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        while self.size + len(body) > self.max_size_in_bytes:
+            self._remove(next(iter(self._entries)))
+
+        if self.directory is not None:
+            # Write and rename so readers never see partial files. The
+            # directory might be shared by several server processes.
+            temp = "%s.%i.tmp" % (self._filename(key), os.getpid())
+            with open(temp, "wb") as fh:
+                fh.write(body)
+            os.replace(temp, self._filename(key))
+            self._entries[key] = (len(body), headers, None)
+        else:
+            self._entries[key] = (len(body), headers, body)
+        self.size += len(body)
+
+    def _remove(self, key):
+        size, _, _ = self._entries.pop(key)
+        self.size -= size
+        if self.directory is not None:
+            try:
+                os.remove(self._filename(key))
+            except OSError:  # pragma: no cover
+                pass
+
+    def __len__(self):
+        return len(self._entries)
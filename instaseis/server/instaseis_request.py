@@ -10,36 +10,406 @@ Base Instaseis Request handler currently only settings default headers.
     (http://www.gnu.org/copyleft/lgpl.html)
 """
 from abc import ABCMeta, abstractmethod
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import json
+import timeit
+
 import obspy
 import tornado
+import tornado.concurrent
+import tornado.escape
+import tornado.ioloop
 from ..database_interfaces.base_instaseis_db import _get_seismogram_times
+from ..database_interfaces.cancellation import CancellationToken
 from .. import Receiver, FiniteSource
 
 from .. import __version__
+from .cache import cache_key, database_fingerprint
+from .workers import call_with_db
+
+# Responses shared with identical concurrent requests are kept in memory up
+# to this size.
+MAX_SHARED_RESPONSE_SIZE_IN_BYTES = 256 * 1024 ** 2
+
+
+def _no_timings(func, **kwargs):
+    return func(**kwargs), None
+
+
+def _collect_timings(func, db, **kwargs):
+    """
+    Call func and additionally return the time spent in each stage of the
+    extraction.
+    """
+    with db.stats.collect() as times:
+        result = func(db=db, **kwargs)
+    return result, times
+
+
+class _SharedResponse(object):
+    """
+    Response of a request in flight shared with the identical requests
+    waiting for it.
+    """
+
+    __slots__ = ("future", "waiters")
+
+    def __init__(self):
+        self.future = tornado.concurrent.Future()
+        self.waiters = 0
 
 
 class InstaseisRequestHandler(tornado.web.RequestHandler):
+    _in_flight = False
+
     def set_default_headers(self):
         self.set_header("Access-Control-Allow-Origin", "*")
         self.set_header("Server", "InstaseisServer/%s" % __version__)
 
+    def prepare(self):
+        self._in_flight = True
+        self.application.metrics.request_started()
+
+    def on_finish(self):
+        self._record_request(code=self.get_status())
+
+    def on_connection_close(self):  # pragma: no cover
+        tornado.web.RequestHandler.on_connection_close(self)
+        # Use the nginx code for requests closed by the client.
+        self._record_request(code=499)
+
+    def run_in_executor(self, func, **kwargs):
+        """
+        Run the function with the keyword arguments in the executor of the
+        application. Returns an awaitable future.
+        """
+        return tornado.ioloop.IOLoop.current().run_in_executor(
+            self.application.executor, functools.partial(func, **kwargs)
+        )
+
+    def extract(self, func, **kwargs):
+        """
+        Run ``func(db=db, **kwargs)`` in the executor of the application.
+        Returns an awaitable future.
+
+        Worker processes use their own database so the function, its
+        arguments, and its return value must be picklable in that case.
+        """
+        if isinstance(
+            self.application.executor, concurrent.futures.ProcessPoolExecutor
+        ):
+            # Cancellation tokens only work within a process.
+            if "cancellation_token" in kwargs:
+                kwargs["cancellation_token"] = None
+            return self.run_in_executor(
+                functools.partial(call_with_db, func), **kwargs
+            )
+        return self.run_in_executor(func, db=self.application.db, **kwargs)
+
+    def _record_request(self, code):
+        # Only record each request once.
+        if not self._in_flight:
+            return
+        self._in_flight = False
+        self.application.metrics.request_finished(
+            route=self.request.path,
+            method=self.request.method,
+            code=code,
+            duration=self.request.request_time(),
+        )
+
 
 class InstaseisTimeSeriesHandler(InstaseisRequestHandler, metaclass=ABCMeta):
     arguments = None
     connection_closed = False
     default_label = ""
     default_origin_time = obspy.UTCDateTime(0)
+    # Time per stage summed over all receivers if the server is launched
+    # with server timing enabled.
+    server_timing = None
+    # Key and written chunks of a response to be stored in the response
+    # cache or shared with identical requests.
+    _response_key = None
+    _chunks = None
+    _shared_response = None
+    # Set once an error occurred. The status code cannot be changed anymore
+    # if parts of the response have already been sent.
+    _errored = False
+    # Headers stored with cached and shared responses. The content type and
+    # disposition are set from the arguments.
+    shared_headers = ("Instaseis-Mu",)
+    # Ticket of the admission control.
+    _ticket = None
+    # Cancelled once the client is gone to stop the running extractions.
+    cancellation_token = None
 
     def __init__(self, *args, **kwargs):
         super(InstaseisTimeSeriesHandler, self).__init__(*args, **kwargs)
 
+    def prepare(self):
+        InstaseisRequestHandler.prepare(self)
+        self.cancellation_token = CancellationToken()
+        if self.application.server_timing:
+            self.server_timing = collections.defaultdict(float)
+
+    def on_finish(self):
+        InstaseisRequestHandler.on_finish(self)
+        self._release_admission()
+
+    def send_error(self, status_code=500, **kwargs):
+        self._errored = True
+        InstaseisRequestHandler.send_error(self, status_code, **kwargs)
+
+    def write_error(self, status_code, **kwargs):
+        # Rejected by the admission control.
+        if status_code in (429, 503):
+            self.set_header(
+                "Retry-After", "%i" % self.application.admission.retry_after
+            )
+        InstaseisRequestHandler.write_error(self, status_code, **kwargs)
+
+    async def admit(self, cost):
+        """
+        Wait until the admission control admits the request. Raises a 429 or
+        503 error if it is rejected.
+
+        :param cost: The estimated cost of the request, i.e. receivers x
+            components x point sources.
+        """
+        admission = self.application.admission
+        self._ticket = admission.enqueue(
+            client=self.request.remote_ip, cost=cost
+        )
+        if not await admission.wait(self._ticket):
+            # The client is gone.
+            raise tornado.web.Finish()
+
+    def _release_admission(self):
+        ticket, self._ticket = self._ticket, None
+        if ticket is not None:
+            self.application.admission.release(ticket)
+
+    def finish(self, chunk=None):
+        # The header can only be added if nothing has been sent yet.
+        if (
+            self.server_timing is not None
+            and self.application.server_timing == "header"
+            and not self._headers_written
+        ):
+            self.set_header(
+                "Server-Timing",
+                ", ".join(
+                    "%s;dur=%.3f" % (name, value * 1000.0)
+                    for name, value in self.get_server_timing().items()
+                ),
+            )
+        future = InstaseisRequestHandler.finish(self, chunk)
+        self._share_response()
+        return future
+
+    def write(self, chunk):
+        if self._chunks is not None:
+            chunk = tornado.escape.utf8(chunk)
+            self._chunks_size += len(chunk)
+            shared = self._shared_response
+            # Don't keep huge responses or responses nobody is going to use
+            # in memory.
+            if self._chunks_size > self._max_chunks_size or (
+                self.application.response_cache is None
+                and (shared is None or not shared.waiters)
+            ):
+                self._chunks = None
+                # Identical requests waiting for it continue on their own.
+                self._release_shared_response(False)
+            else:
+                self._chunks.append(chunk)
+        return InstaseisRequestHandler.write(self, chunk)
+
+    async def reuse_response(self, args):
+        """
+        Set the strong ETag of the response and answer the request with a
+        304, from the response cache, or with the response of an identical
+        request currently in flight if possible. Returns True if the request
+        has been answered in which case the route must not do anything else.
+        Call right after parsing the arguments.
+
+        The responses of GET requests only depend on the arguments and the
+        database, assuming the station, event, and travel time callbacks
+        always return the same.
+        """
+        # Uploaded source time functions are not part of the arguments and
+        # the timings change with every request.
+        if self.request.method != "GET" or self.application.server_timing:
+            return False
+
+        key = cache_key(
+            fingerprint=database_fingerprint(self.application.db),
+            route=self.request.path,
+            args=args,
+        )
+        self.set_header("Etag", '"%s"' % key)
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return True
+
+        cache = self.application.response_cache
+        response = cache.get(key) if cache is not None else None
+
+        # Wait for an identical request already being processed. If it
+        # fails, the first waiter takes over and the others wait for it.
+        # Continue on our own if the response is too large to share.
+        in_flight = self.application.in_flight_responses
+        while response is None and key in in_flight:
+            shared = in_flight[key]
+            shared.waiters += 1
+            response = await shared.future
+        too_large = response is False
+        if too_large:
+            response = None
+
+        if response is not None:
+            headers, body = response
+            self.set_headers(args)
+            for name, value in headers.items():
+                self.set_header(name, value)
+            self.finish(body)
+            return True
+
+        self._response_key = key
+        self._chunks = []
+        self._chunks_size = 0
+        self._max_chunks_size = cache.max_size_in_bytes if cache else 0
+        if key not in in_flight and not too_large:
+            self._shared_response = _SharedResponse()
+            in_flight[key] = self._shared_response
+            self._max_chunks_size = max(
+                self._max_chunks_size, MAX_SHARED_RESPONSE_SIZE_IN_BYTES
+            )
+        return False
+
+    def _share_response(self):
+        """
+        Store the response in the cache and pass it to the identical
+        requests waiting for it.
+        """
+        chunks, self._chunks = self._chunks, None
+        # Don't share errors, including those occurring after parts of the
+        # response have been sent, and responses cut short by the client.
+        if (
+            chunks is None
+            or self.get_status() != 200
+            or self._errored
+            or self.connection_closed
+        ):
+            response = None
+        else:
+            response = (
+                {
+                    name: self._headers[name]
+                    for name in self.shared_headers
+                    if name in self._headers
+                },
+                b"".join(chunks),
+            )
+            if self.application.response_cache is not None:
+                self.application.response_cache.set(
+                    self._response_key, *response
+                )
+        self._release_shared_response(response)
+
+    def _release_shared_response(self, response):
+        """
+        Pass the response to the waiting identical requests. None makes
+        them retry and False lets them continue on their own.
+        """
+        shared, self._shared_response = self._shared_response, None
+        if shared is None:
+            return
+        del self.application.in_flight_responses[self._response_key]
+        shared.future.set_result(response)
+
+    def flush_stream(self):
+        """
+        Flush everything written so far to the client. Does nothing if the
+        Server-Timing header has to be sent which is only possible once the
+        whole response is known.
+        """
+        if self.application.server_timing != "header":
+            self.flush()
+
+    def timed(self, func):
+        """
+        Wrap a function extracting seismograms so that it additionally
+        returns the time spent in each stage or None if server timing is
+        disabled. Can be called in any thread.
+        """
+        if self.server_timing is None:
+            return functools.partial(_no_timings, func)
+        return functools.partial(_collect_timings, func)
+
+    def add_server_timing(self, times):
+        """
+        Add the times as returned from a function wrapped with timed().
+        """
+        if times is None:
+            return
+        for stage, value in times.items():
+            self.server_timing[stage] += value
+
+    @contextlib.contextmanager
+    def timing(self, stage):
+        """
+        Add the time spent in the context to the given stage.
+        """
+        if self.server_timing is None:
+            yield
+            return
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.server_timing[stage] += timeit.default_timer() - start
+
+    def get_server_timing(self):
+        """
+        Time per stage in seconds, and the total time of the request so far.
+        """
+        times = dict(self.server_timing)
+        times["total"] = self.request.request_time()
+        return times
+
+    def write_server_timing_trailer(self, zip_file):
+        """
+        Add the server timing as a JSON file to the end of a SAC zip archive
+        if requested.
+        """
+        if self.application.server_timing != "trailer":
+            return
+        zip_file.writestr(
+            "server_timing.json",
+            json.dumps(self.get_server_timing(), indent=4, sort_keys=True),
+        )
+
     def on_connection_close(self):  # pragma: no cover
         """
         Called when the client cancels the connection. Then the loop
-        requesting seismograms will stop.
+        requesting seismograms will stop and the running extractions stop
+        before extracting their next seismogram or point source.
         """
         InstaseisRequestHandler.on_connection_close(self)
-        self.__connection_closed = True
+        self.connection_closed = True
+        if self.cancellation_token is not None:
+            self.cancellation_token.cancel()
+        # Waiting requests must not wait for a response never finishing.
+        self._release_shared_response(None)
+        # Don't admit requests whose client is gone. Admitted requests are
+        # released once they finish.
+        if self._ticket is not None and self._ticket.state == "waiting":
+            self._release_admission()
 
     def parse_arguments(self):
         # Make sure that no additional arguments are passed.
@@ -142,8 +512,8 @@ class InstaseisTimeSeriesHandler(InstaseisRequestHandler, metaclass=ABCMeta):
         # Make sure the output format is valid.
         if "format" in self.arguments:
             args.format = args.format.lower()
-            if args.format not in ("miniseed", "saczip"):
-                msg = "Format must either be 'miniseed' or 'saczip'."
+            if args.format not in ("miniseed", "saczip", "binary"):
+                msg = "Format must be 'miniseed', 'saczip', or 'binary'."
                 raise tornado.web.HTTPError(400, log_message=msg, reason=msg)
 
         # If its essentially equal to the internal sampling rate just set it
@@ -277,9 +647,15 @@ class InstaseisTimeSeriesHandler(InstaseisRequestHandler, metaclass=ABCMeta):
             content_type = "application/vnd.fdsn.mseed"
         elif format == "saczip":
             content_type = "application/zip"
+        elif format == "binary":
+            content_type = "application/octet-stream"
         self.set_header("Content-Type", content_type)
 
-        file_endings_map = {"miniseed": "mseed", "saczip": "zip"}
+        file_endings_map = {
+            "miniseed": "mseed",
+            "saczip": "zip",
+            "binary": "bin",
+        }
 
         if "label" in args and args.label:
             label = args.label
@@ -313,16 +689,17 @@ class InstaseisTimeSeriesHandler(InstaseisRequestHandler, metaclass=ABCMeta):
             src_depth_in_m = source.depth_in_m
 
         try:
-            tt = self.application.travel_time_callback(
-                sourcelatitude=src_latitude,
-                sourcelongitude=src_longitude,
-                sourcedepthinmeters=src_depth_in_m,
-                receiverlatitude=receiver.latitude,
-                receiverlongitude=receiver.longitude,
-                receiverdepthinmeters=receiver.depth_in_m,
-                phase_name=phase,
-                db_info=self.application.db.info,
-            )
+            with self.timing("travel_time"):
+                tt = self.application.travel_time_callback(
+                    sourcelatitude=src_latitude,
+                    sourcelongitude=src_longitude,
+                    sourcedepthinmeters=src_depth_in_m,
+                    receiverlatitude=receiver.latitude,
+                    receiverlongitude=receiver.longitude,
+                    receiverdepthinmeters=receiver.depth_in_m,
+                    phase_name=phase,
+                    db_info=self.application.db.info,
+                )
         except ValueError as e:
             err_msg = str(e)
             if err_msg.lower().startswith("invalid phase name"):
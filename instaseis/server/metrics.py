@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Server metrics in the Prometheus text exposition format.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import bisect
+import collections
+import glob
+import json
+import os
+import time
+
+# Upper bounds of the request latency histogram buckets in seconds.
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# Snapshots are written every second. Older ones belong to processes which
+# died without removing them.
+MAX_SNAPSHOT_AGE = 10.0
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _queue_depth(executor):
+    # There is no public API to get the queue size.
+    if hasattr(executor, "_work_queue"):
+        return executor._work_queue.qsize()
+    # Process pools keep all submitted but unfinished work items.
+    return len(executor._pending_work_items)
+
+
+def format_metric(name, metric_type, help, samples):
+    """
+    A single metric in the text exposition format.
+
+    :param name: The name of the metric.
+    :param metric_type: ``"counter"``, ``"gauge"``, or ``"histogram"``.
+    :param help: The help text.
+    :param samples: List of ``(suffix, labels, value)`` tuples.
+    """
+    lines = [
+        "# HELP %s %s" % (name, help),
+        "# TYPE %s %s" % (name, metric_type),
+    ]
+    for suffix, labels, value in samples:
+        if labels:
+            labels = "{%s}" % ",".join(
+                '%s="%s"' % (key, _escape(value))
+                for key, value in labels.items()
+            )
+        else:
+            labels = ""
+        lines.append(
+            "%s%s%s %s" % (name, suffix, labels, _format_value(value))
+        )
+    return "\n".join(lines)
+
+
+class Histogram(object):
+    """
+    A histogram with fixed buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        return {"counts": list(self.counts), "sum": self.sum}
+
+
+def _histogram_samples(histogram, labels):
+    samples = []
+    cumulative = 0
+    for le, count in zip(
+        LATENCY_BUCKETS + (float("inf"),), histogram["counts"]
+    ):
+        cumulative += count
+        samples.append(
+            ("_bucket", dict(labels, le=_format_value(le)), cumulative)
+        )
+    samples.append(("_sum", labels, histogram["sum"]))
+    samples.append(("_count", labels, cumulative))
+    return samples
+
+
+def merge_snapshots(snapshots):
+    """
+    Sum the snapshots of several processes.
+
+    :param snapshots: List of snapshots as returned by
+        :meth:`Metrics.snapshot`.
+    """
+    merged = {
+        "requests": collections.Counter(),
+        "latencies": {},
+        "in_flight": 0,
+        "queue_depth": collections.Counter(),
+        "buffers": {},
+        "bytes_read": 0,
+        "stage_seconds": collections.Counter(),
+        "stage_calls": collections.Counter(),
+    }
+    for snapshot in snapshots:
+        for route, method, code, value in snapshot["requests"]:
+            merged["requests"][(route, method, code)] += value
+        for route, h in snapshot["latencies"].items():
+            m = merged["latencies"].setdefault(
+                route, {"counts": [0] * len(h["counts"]), "sum": 0.0}
+            )
+            m["counts"] = [a + b for a, b in zip(m["counts"], h["counts"])]
+            m["sum"] += h["sum"]
+        merged["in_flight"] += snapshot["in_flight"]
+        merged["queue_depth"].update(snapshot["queue_depth"])
+        for name, b in snapshot["buffers"].items():
+            m = merged["buffers"].setdefault(
+                name, {"size": 0, "hits": 0, "misses": 0}
+            )
+            for key in m:
+                m[key] += b[key]
+        merged["bytes_read"] += snapshot["bytes_read"]
+        merged["stage_seconds"].update(snapshot["stage_seconds"])
+        merged["stage_calls"].update(snapshot["stage_calls"])
+
+    merged["requests"] = [
+        [r, m, c, v] for (r, m, c), v in sorted(merged["requests"].items())
+    ]
+    for key in ("queue_depth", "stage_seconds", "stage_calls"):
+        merged[key] = dict(merged[key])
+    return merged
+
+
+def format_snapshot(snapshot):
+    """
+    A snapshot in the text exposition format.
+    """
+    buffers = sorted(snapshot["buffers"].items())
+    stages = sorted(snapshot["stage_seconds"])
+    metrics = [
+        format_metric(
+            "instaseis_requests_total",
+            "counter",
+            "Number of finished requests.",
+            [
+                ("", {"route": r, "method": m, "code": c}, v)
+                for r, m, c, v in sorted(snapshot["requests"])
+            ],
+        ),
+        format_metric(
+            "instaseis_request_duration_seconds",
+            "histogram",
+            "Request latency.",
+            [
+                _s
+                for route, h in sorted(snapshot["latencies"].items())
+                for _s in _histogram_samples(h, {"route": route})
+            ],
+        ),
+        format_metric(
+            "instaseis_requests_in_flight",
+            "gauge",
+            "Number of requests currently being processed.",
+            [("", {}, snapshot["in_flight"])],
+        ),
+        format_metric(
+            "instaseis_executor_queue_depth",
+            "gauge",
+            "Number of tasks waiting for a thread or submitted to the "
+            "processes of the executor.",
+            [
+                ("", {"executor": name}, value)
+                for name, value in sorted(snapshot["queue_depth"].items())
+            ],
+        ),
+        format_metric(
+            "instaseis_buffer_size_bytes",
+            "gauge",
+            "Memory used by the buffer.",
+            [("", {"buffer": n}, b["size"]) for n, b in buffers],
+        ),
+        format_metric(
+            "instaseis_buffer_hits_total",
+            "counter",
+            "Number of buffer lookups finding the item.",
+            [("", {"buffer": n}, b["hits"]) for n, b in buffers],
+        ),
+        format_metric(
+            "instaseis_buffer_misses_total",
+            "counter",
+            "Number of buffer lookups not finding the item.",
+            [("", {"buffer": n}, b["misses"]) for n, b in buffers],
+        ),
+        format_metric(
+            "instaseis_buffer_hit_ratio",
+            "gauge",
+            "Fraction of buffer lookups finding the item.",
+            [
+                (
+                    "",
+                    {"buffer": n},
+                    float(b["hits"]) / (b["hits"] + b["misses"])
+                    if b["hits"] + b["misses"]
+                    else 0.0,
+                )
+                for n, b in buffers
+            ],
+        ),
+        format_metric(
+            "instaseis_read_bytes_total",
+            "counter",
+            "Uncompressed bytes read from the database files.",
+            [("", {}, snapshot["bytes_read"])],
+        ),
+        format_metric(
+            "instaseis_stage_seconds_total",
+            "counter",
+            "Time spent in the stages of the seismogram extraction.",
+            [("", {"stage": s}, snapshot["stage_seconds"][s]) for s in stages],
+        ),
+        format_metric(
+            "instaseis_stage_calls_total",
+            "counter",
+            "Number of calls of the stages of the seismogram extraction.",
+            [("", {"stage": s}, snapshot["stage_calls"][s]) for s in stages],
+        ),
+    ]
+    return "\n".join(metrics) + "\n"
+
+
+def _is_stale(filename):
+    """
+    Whether a snapshot file belongs to a process that is gone. A process
+    that was killed might leave its file behind and its id might later be
+    reused by an unrelated process, so the age of the file is checked as
+    well.
+    """
+    pid = int(os.path.splitext(os.path.basename(filename))[0])
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:  # pragma: no cover
+        pass
+    try:
+        return time.time() - os.path.getmtime(filename) > MAX_SNAPSHOT_AGE
+    except OSError:  # pragma: no cover
+        return True
+
+
+class Metrics(object):
+    """
+    Request metrics of the server.
+
+    All request handlers run in the thread of the IO loop so no locking is
+    required.
+
+    :param directory: Directory shared by all processes of a pre-forked
+        server. Each process regularly writes its snapshot to it and the
+        exposition sums the snapshots of all running processes.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.in_flight = 0
+        self.requests = collections.Counter()
+        self.latencies = collections.defaultdict(Histogram)
+
+    def request_started(self):
+        self.in_flight += 1
+
+    def request_finished(self, route, method, code, duration):
+        """
+        :param route: The route, e.g. ``"/seismograms"``.
+        :param method: The HTTP method.
+        :param code: The HTTP status code.
+        :param duration: The duration of the request in seconds.
+        """
+        self.in_flight -= 1
+        self.requests[(route, method, code)] += 1
+        self.latencies[route].observe(duration)
+
+    def snapshot(self, db, executors):
+        """
+        The current values of all metrics of this process as a JSON
+        serializable dictionary.
+
+        :param db: The database of the server.
+        :param executors: Dictionary of executors by name.
+        """
+        stats = db.stats.as_dict()
+        return {
+            "requests": [
+                [r, m, c, v] for (r, m, c), v in sorted(self.requests.items())
+            ],
+            "latencies": {
+                route: h.as_dict() for route, h in self.latencies.items()
+            },
+            "in_flight": self.in_flight,
+            "queue_depth": {
+                name: _queue_depth(e) for name, e in executors.items()
+            },
+            "buffers": {
+                name: {
+                    "size": int(b.get_size_mb() * 1024 ** 2),
+                    "hits": b.hits,
+                    "misses": b.misses,
+                }
+                for name, b in db._get_buffers().items()
+            },
+            "bytes_read": stats["bytes_read"],
+            "stage_seconds": {
+                stage: s["time"] for stage, s in stats["stages"].items()
+            },
+            "stage_calls": {
+                stage: s["count"] for stage, s in stats["stages"].items()
+            },
+        }
+
+    @property
+    def _filename(self):
+        return os.path.join(self.directory, "%i.json" % os.getpid())
+
+    def write_snapshot(self, db, executors):
+        """
+        Write the snapshot of this process to the shared directory.
+        """
+        # Write and rename so other processes never see partial files.
+        temp = self._filename + ".tmp"
+        with open(temp, "wt") as fh:
+            json.dump(self.snapshot(db=db, executors=executors), fh)
+        os.replace(temp, self._filename)
+
+    def remove_snapshot(self):
+        """
+        Remove the snapshot of this process from the shared directory.
+        """
+        try:
+            os.remove(self._filename)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    def exposition(self, db, executors):
+        """
+        All metrics in the text exposition format.
+
+        :param db: The database of the server.
+        :param executors: Dictionary of executors by name.
+        """
+        snapshots = [self.snapshot(db=db, executors=executors)]
+        if self.directory is not None:
+            for filename in glob.glob(os.path.join(self.directory, "*.json")):
+                if filename == self._filename:
+                    continue
+                if _is_stale(filename):
+                    try:
+                        os.remove(filename)
+                    except FileNotFoundError:  # pragma: no cover
+                        pass
+                    continue
+                # Processes might vanish at any time.
+                try:
+                    with open(filename, "rt") as fh:
+                        snapshots.append(json.load(fh))
+                except (OSError, ValueError):  # pragma: no cover
+                    continue
+        return format_snapshot(merge_snapshots(snapshots))
@@ -7,18 +7,21 @@
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
-import concurrent.futures
 import io
 import math
 import numpy as np
 import zipfile
 
 import obspy
-import tornado.gen
 import tornado.web
 
 from ... import FiniteSource
-from ..util import IOQueue, _validtimesetting, _validate_and_write_waveforms
+from ..util import (
+    IOQueue,
+    _validtimesetting,
+    _validate_and_write_waveforms,
+    _write_to_zip,
+)
 from ..instaseis_request import InstaseisTimeSeriesHandler
 from ...source import USGSParamFileParsingException
 
@@ -30,9 +33,6 @@ from ...database_interfaces.base_instaseis_db import (
 )
 
 
-executor = concurrent.futures.ThreadPoolExecutor(12)
-
-
 def _get_finite_source(
     db,
     finite_source,
@@ -48,6 +48,7 @@ def _get_finite_source(
     format,
     label,
     sacheader,
+    cancellation_token=None,
 ):
     """
     Extract a seismogram from the passed db and write it either to a MiniSEED
@@ -64,10 +65,13 @@ def _get_finite_source(
     :param starttime: The desired start time of the seismogram.
     :param endtime: The desired end time of the seismogram.
     :param time_of_first_sample: The time of the first sample.
-    :param format: The output format. Either "miniseed" or "saczip".
+    :param format: The output format. Either "miniseed", "saczip", or
+        "binary".
     :param label: Prefix for the filename within the SAC zip file.
     :param sacheader: Indicates if the SAC header should be populated with
         geodetic or geocentric latitudes.
+    :param cancellation_token: Stops the extraction once the client is
+        gone.
     """
     try:
         st = db.get_seismograms_finite_source(
@@ -77,6 +81,7 @@ def _get_finite_source(
             # Effectively results in nothing happening so we can perform the
             # differentiation here.
             kind=INV_KIND_MAP[STF_MAP[db.info.stf]],
+            cancellation_token=cancellation_token,
         )
     except Exception:
         msg = (
@@ -118,23 +123,24 @@ def _get_finite_source(
             )
             tr.data = data_summed["A"]
 
-    return _validate_and_write_waveforms(
-        st=st,
-        scale=scale,
-        starttime=starttime,
-        endtime=endtime,
-        source=finite_source,
-        receiver=receiver,
-        db=db,
-        label=label,
-        format=format,
-        sacheader=sacheader,
-    )
+    with db.stats.timer("serialization"):
+        return _validate_and_write_waveforms(
+            st=st,
+            scale=scale,
+            starttime=starttime,
+            endtime=endtime,
+            source=finite_source,
+            receiver=receiver,
+            db=db,
+            label=label,
+            format=format,
+            sacheader=sacheader,
+        )
 
 
-def _parse_and_resample_finite_source(request, db_info, max_size):
+def _parse_and_resample_finite_source(body, db_info, max_size):
     try:
-        with io.BytesIO(request.body) as buf:
+        with io.BytesIO(body) as buf:
             # We get 10.000 samples for each source sampled at 10 Hz. This is
             # more than enough to capture a minimal possible rise time of 1
             # second. The maximum possible time shift for any source is
@@ -382,17 +388,16 @@ class FiniteSourceSeismogramsHandler(InstaseisTimeSeriesHandler):
 
         return time_of_first_sample, earliest_starttime, latest_endtime
 
-    @tornado.gen.coroutine
-    def post(self):
+    async def post(self):
         # Parse the arguments. This will also perform a number of sanity
         # checks.
         args = self.parse_arguments()
         self.set_headers(args)
 
         # Coroutine + thread as potentially pretty expensive.
-        response = yield executor.submit(
+        response = await self.run_in_executor(
             _parse_and_resample_finite_source,
-            request=self.request,
+            body=self.request.body,
             max_size=self.application.max_size_of_finite_sources,
             db_info=self.application.db.info,
         )
@@ -414,6 +419,10 @@ class FiniteSourceSeismogramsHandler(InstaseisTimeSeriesHandler):
         # send the seismograms will dominate.
         receivers = self.get_receivers(args)
 
+        await self.admit(
+            cost=len(receivers) * len(args.components) * len(finite_source)
+        )
+
         # If a zip file is requested, initialize it here and write to custom
         # buffer object.
         if args.format == "saczip":
@@ -425,6 +434,8 @@ class FiniteSourceSeismogramsHandler(InstaseisTimeSeriesHandler):
         # we would like to raise an error.
         count = 0
 
+        get_finite_source = self.timed(_get_finite_source)
+
         # Loop over each receiver, get the synthetics and stream it to the
         # user.
         for receiver in receivers:
@@ -455,11 +466,10 @@ class FiniteSourceSeismogramsHandler(InstaseisTimeSeriesHandler):
             # Validate the source-receiver geometry.
             self.validate_geometry(source=finite_source, receiver=receiver)
 
-            # Yield from the task. This enables a context switch and thus
-            # async behaviour.
-            response, _ = yield executor.submit(
-                _get_finite_source,
-                db=self.application.db,
+            # Await the task. This enables a context switch and thus async
+            # behaviour.
+            (response, _), times = await self.extract(
+                get_finite_source,
                 finite_source=finite_source,
                 receiver=receiver,
                 components=list(args.components),
@@ -473,8 +483,11 @@ class FiniteSourceSeismogramsHandler(InstaseisTimeSeriesHandler):
                 format=args.format,
                 label=args.label,
                 sacheader=args.sacheader,
+                cancellation_token=self.cancellation_token,
             )
 
+            self.add_server_timing(times)
+
             # Check connection once again.
             if self.connection_closed:  # pragma: no cover
                 self.flush()
@@ -489,14 +502,14 @@ class FiniteSourceSeismogramsHandler(InstaseisTimeSeriesHandler):
             elif isinstance(response, list):
                 assert args.format == "saczip"
                 for filename, content in response:
-                    zip_file.writestr(filename, content)
+                    _write_to_zip(zip_file, filename, content)
                 for data in buf:
                     self.write(data)
-            # Otherwise it contain MiniSEED which can just directly be
-            # streamed.
+            # Otherwise it contains MiniSEED or a binary record which can
+            # just directly be streamed.
             else:
                 self.write(response)
-            self.flush()
+            self.flush_stream()
 
             count += 1
 
@@ -515,6 +528,7 @@ class FiniteSourceSeismogramsHandler(InstaseisTimeSeriesHandler):
 
         # Write the end of the zipfile in case necessary.
         if args.format == "saczip":
+            self.write_server_timing_trailer(zip_file)
             zip_file.close()
             for data in buf:
                 self.write(data)
@@ -8,22 +8,21 @@
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
-import concurrent.futures
 import io
 import zipfile
 
 import obspy
-import tornado.gen
 import tornado.web
 
 from ... import Source, Receiver, ForceSource
-from ..util import _validtimesetting, _validate_and_write_waveforms
+from ..util import (
+    _validtimesetting,
+    _validate_and_write_waveforms,
+    _write_to_zip,
+)
 from ..instaseis_request import InstaseisTimeSeriesHandler
 
 
-executor = concurrent.futures.ThreadPoolExecutor(12)
-
-
 def _get_greens(
     db,
     epicentral_distance_degree,
@@ -37,6 +36,7 @@ def _get_greens(
     format,
     label,
     sacheader,
+    cancellation_token=None,
 ):
     """
     Extract a Green's function from the passed db and write it either to a
@@ -51,10 +51,13 @@ def _get_greens(
     :param origintime: Origin time of the source.
     :param starttime: The desired start time of the seismogram.
     :param endtime: The desired end time of the seismogram.
-    :param format: The output format. Either "miniseed" or "saczip".
+    :param format: The output format. Either "miniseed", "saczip", or
+        "binary".
     :param label: Prefix for the filename within the SAC zip file.
     :param sacheader: Indicates if the SAC header should be populated with
         geodetic or geocentric latitudes.
+    :param cancellation_token: Stops the extraction once the client is
+        gone.
     """
     try:
         st = db.get_greens_function(
@@ -66,6 +69,7 @@ def _get_greens(
             dt=dt,
             kernelwidth=kernelwidth,
             definition="seiscomp",
+            cancellation_token=cancellation_token,
         )
     except Exception:
         msg = (
@@ -92,18 +96,19 @@ def _get_greens(
         tr.stats.network = "XX"
         tr.stats.station = "GF001"
 
-    return _validate_and_write_waveforms(
-        st=st,
-        starttime=starttime,
-        endtime=endtime,
-        scale=1.0,
-        source=source,
-        receiver=receiver,
-        db=db,
-        label=label,
-        format=format,
-        sacheader=sacheader,
-    )
+    with db.stats.timer("serialization"):
+        return _validate_and_write_waveforms(
+            st=st,
+            starttime=starttime,
+            endtime=endtime,
+            scale=1.0,
+            source=source,
+            receiver=receiver,
+            db=db,
+            label=label,
+            format=format,
+            sacheader=sacheader,
+        )
 
 
 class GreensFunctionHandler(InstaseisTimeSeriesHandler):
@@ -181,11 +186,12 @@ class GreensFunctionHandler(InstaseisTimeSeriesHandler):
             )
             raise tornado.web.HTTPError(400, log_message=msg, reason=msg)
 
-    @tornado.gen.coroutine
-    def get(self):
+    async def get(self):
         # Parse the arguments. This will also perform a number of sanity
         # checks.
         args = self.parse_arguments()
+        if await self.reuse_response(args):
+            return
 
         min_starttime, max_endtime = self.parse_time_settings(args)
 
@@ -222,11 +228,13 @@ class GreensFunctionHandler(InstaseisTimeSeriesHandler):
 
         starttime, endtime = time_values
 
-        # Yield from the task. This enables a context switch and thus
-        # async behaviour.
-        response, mu = yield executor.submit(
+        # All ten Green's functions are extracted.
+        await self.admit(cost=10)
+
+        # Await the task. This enables a context switch and thus async
+        # behaviour.
+        response, mu = await self.extract(
             _get_greens,
-            db=self.application.db,
             epicentral_distance_degree=args.sourcedistanceindegrees,
             source_depth_in_m=args.sourcedepthinmeters,
             units=args.units,
@@ -238,8 +246,13 @@ class GreensFunctionHandler(InstaseisTimeSeriesHandler):
             format=args.format,
             label=args.label,
             sacheader=args.sacheader,
+            cancellation_token=self.cancellation_token,
         )
 
+        if self.connection_closed:  # pragma: no cover
+            self.finish()
+            return
+
         # If an exception is returned from the task, re-raise it here.
         if isinstance(response, Exception):
             raise response
@@ -247,7 +260,7 @@ class GreensFunctionHandler(InstaseisTimeSeriesHandler):
         # Set and thus send the mu header.
         self.set_header("Instaseis-Mu", "%f" % mu)
 
-        if args.format == "miniseed":
+        if args.format in ("miniseed", "binary"):
             self.write(response)
         else:
             assert args.format == "saczip"
@@ -256,7 +269,7 @@ class GreensFunctionHandler(InstaseisTimeSeriesHandler):
             with io.BytesIO() as buf:
                 zip_file = zipfile.ZipFile(buf, mode="w")
                 for filename, content in response:
-                    zip_file.writestr(filename, content)
+                    _write_to_zip(zip_file, filename, content)
                 zip_file.close()
                 buf.seek(0, 0)
                 self.write(buf.read())
@@ -22,4 +22,16 @@ class InfoHandler(InstaseisRequestHandler):
         # Clear the directory to avoid leaking any more system information then
         # necessary.
         info["directory"] = ""
-        self.write(dict(info))
+        info = dict(info)
+        # Limits of the server which are not part of the database
+        # information.
+        info["limits"] = dict(
+            self.application.admission.limits(),
+            max_size_of_finite_sources=(
+                self.application.max_size_of_finite_sources
+            ),
+        )
+        # Output formats of the time series routes so clients can tell
+        # newer servers apart.
+        info["formats"] = ["miniseed", "saczip", "binary"]
+        self.write(info)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+from ..instaseis_request import InstaseisRequestHandler
+from ..metrics import CONTENT_TYPE
+
+
+class MetricsHandler(InstaseisRequestHandler):
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(
+            self.application.metrics.exposition(
+                db=self.application.db,
+                executors={"extraction": self.application.executor},
+            )
+        )
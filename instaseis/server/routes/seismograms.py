@@ -7,7 +7,7 @@
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
-import concurrent.futures
+import collections
 import inspect
 import io
 import json
@@ -20,7 +20,6 @@ from jsonschema import ValidationError as JSONValidationError
 import numpy as np
 import obspy
 from obspy.signal.interpolation import lanczos_interpolation
-import tornado.gen
 import tornado.web
 
 from ... import Source, ForceSource, Receiver
@@ -28,12 +27,14 @@ from ..util import (
     IOQueue,
     _validtimesetting,
     _validate_and_write_waveforms,
+    _write_to_zip,
     get_gaussian_source_time_function,
 )
 from ..instaseis_request import InstaseisTimeSeriesHandler
 
 
-executor = concurrent.futures.ThreadPoolExecutor(12)
+# Maximum number of receivers of a single request extracted in parallel.
+MAX_PENDING_EXTRACTIONS = 8
 
 
 # Load the JSON schema once.
@@ -63,6 +64,7 @@ def _get_seismogram(
     sacheader,
     label,
     format,
+    cancellation_token=None,
 ):
     """
     Extract a seismogram from the passed db and write it either to a MiniSEED
@@ -80,8 +82,11 @@ def _get_seismogram(
     :param endtime: The desired end time of the seismogram.
     :param scale: A scalar factor which the seismograms will be multiplied
         with.
-    :param format: The output format. Either "miniseed" or "saczip".
+    :param format: The output format. Either "miniseed", "saczip", or
+        "binary".
     :param label: Prefix for the filename within the SAC zip file.
+    :param cancellation_token: Stops the extraction once the client is
+        gone.
     """
     if source.sliprate is not None:
         reconvolve_stf = True
@@ -99,6 +104,7 @@ def _get_seismogram(
             return_obspy_stream=True,
             dt=dt,
             kernelwidth=kernelwidth,
+            cancellation_token=cancellation_token,
         )
     except Exception:
         msg = (
@@ -107,28 +113,29 @@ def _get_seismogram(
         )
         return tornado.web.HTTPError(400, log_message=msg, reason=msg), None
 
-    return _validate_and_write_waveforms(
-        st=st,
-        starttime=starttime,
-        endtime=endtime,
-        scale=scale,
-        source=source,
-        receiver=receiver,
-        db=db,
-        label=label,
-        format=format,
-        sacheader=sacheader,
-    )
+    with db.stats.timer("serialization"):
+        return _validate_and_write_waveforms(
+            st=st,
+            starttime=starttime,
+            endtime=endtime,
+            scale=scale,
+            source=source,
+            receiver=receiver,
+            db=db,
+            label=label,
+            format=format,
+            sacheader=sacheader,
+        )
 
 
-def _parse_validate_and_resample_stf(request, db_info):
+def _parse_validate_and_resample_stf(body, db_info):
     """
     Parses the JSON based STF, validates it, and resamples it.
 
-    :param request: The request.
+    :param body: The body of the request.
     :param db_info: Information about the current database.
     """
-    if not request.body:
+    if not body:
         msg = (
             "The source time function must be given in the body of the "
             "POST request."
@@ -136,7 +143,7 @@ def _parse_validate_and_resample_stf(request, db_info):
         return tornado.web.HTTPError(400, log_message=msg, reason=msg)
 
     # Try to parse it as a JSON file.
-    with io.BytesIO(request.body) as buf:
+    with io.BytesIO(body) as buf:
         try:
             j = json.loads(buf.read().decode())
         except Exception:
@@ -581,36 +588,57 @@ class SeismogramsHandler(InstaseisTimeSeriesHandler):
                     )
         return receivers
 
-    @tornado.gen.coroutine
-    def post(self):
+    def write_seismogram(self, result, args, zip_file, buf, is_first):
+        """
+        Write the result of a single extraction to the client.
+        """
+        (response, mu), times = result
+        self.add_server_timing(times)
+
+        # Set mu just from the first station.
+        if is_first and not isinstance(response, Exception):
+            self.set_header("Instaseis-Mu", "%f" % mu)
+
+        # If an exception is returned from the task, re-raise it here.
+        if isinstance(response, Exception):
+            raise response
+        # It might return a list, in that case each item is a bytestring
+        # of SAC file.
+        elif isinstance(response, list):
+            assert args.format == "saczip"
+            for filename, content in response:
+                _write_to_zip(zip_file, filename, content)
+            for data in buf:
+                self.write(data)
+        # Otherwise it contains MiniSEED or a binary record which can just
+        # directly be streamed.
+        else:
+            self.write(response)
+        self.flush_stream()
+
+    async def post(self):
         if "sourcewidth" in self.request.arguments.keys():
             msg = "Parameter 'sourcewidth' is not allowed for POST requests."
             raise tornado.web.HTTPError(400, log_message=msg, reason=msg)
 
         # Coroutine + thread as potentially pretty expensive.
-        response = yield executor.submit(
+        response = await self.run_in_executor(
             _parse_validate_and_resample_stf,
-            request=self.request,
+            body=self.request.body,
             db_info=self.application.db.info,
         )
 
         if isinstance(response, Exception):
             raise response
 
-        yield executor.submit(
-            self.get, custom_stf=response, nested_executor=True
-        )
+        await self.get(custom_stf=response)
 
-    @tornado.gen.coroutine
-    def get(self, custom_stf=None, nested_executor=False):
-        """
-        :param nested_exectuor: Will not launch another executor, if true.
-            Somehow tornado >= 5.0 does not like nested threads. Might be a
-            good idea performance wise in any case.
-        """
+    async def get(self, custom_stf=None):
         # Parse the arguments. This will also perform a number of sanity
         # checks.
         args = self.parse_arguments()
+        if await self.reuse_response(args):
+            return
 
         # We'll piggyback the sourcewidth on the implementation of the custom
         # STF. This is not super clean to be honest but its simple and it
@@ -673,69 +701,59 @@ class SeismogramsHandler(InstaseisTimeSeriesHandler):
         # send the seismograms will dominate.
         receivers = self.get_receivers(args)
 
+        await self.admit(cost=len(receivers) * len(args.components))
+
         # If a zip file is requested, initialize it here and write to custom
         # buffer object.
         if args.format == "saczip":
             buf = IOQueue()
             zip_file = zipfile.ZipFile(buf, mode="w")
+        else:
+            buf = zip_file = None
 
         # Count the number of successful extractions. Phase relative offsets
         # could result in no actually calculated seismograms. In that case
         # we would like to raise an error.
         count = 0
 
-        # Loop over each receiver, get the synthetics and stream it to the
-        # user.
-        for receiver in receivers:
-
-            # Check if the connection is still open. The connection_closed
-            # flag is set by the on_connection_close() method. This is
-            # pretty manual right now. Maybe there is a better way? This
-            # enables to server to stop serving if the connection has been
-            # cancelled on the client side.
-            if self.connection_closed:  # pragma: no cover
-                self.flush()
-                self.finish()
-                return
-
-            # Check if start- or end time are phase relative. If yes
-            # calculate the new start- and/or end time.
-            time_values = self.get_phase_relative_times(
-                args=args,
-                source=source,
-                receiver=receiver,
-                min_starttime=min_starttime,
-                max_endtime=max_endtime,
-            )
-            if time_values is None:
-                continue
-            starttime, endtime = time_values
-
-            # Validate the source-receiver geometry.
-            self.validate_geometry(source=source, receiver=receiver)
-
-            # Yield from the task. This enables a context switch and thus
-            # async behaviour.
-            if not nested_executor:
-                response, mu = yield executor.submit(
-                    _get_seismogram,
-                    db=self.application.db,
+        get_seismogram = self.timed(_get_seismogram)
+
+        # Extractions submitted to the executor but not yet written, in the
+        # order of the receivers.
+        pending = collections.deque()
+
+        try:
+            # Loop over each receiver, get the synthetics and stream it to
+            # the user.
+            for receiver in receivers:
+
+                # Check if the connection is still open. The
+                # connection_closed flag is set by the on_connection_close()
+                # method. This is pretty manual right now. Maybe there is a
+                # better way? This enables to server to stop serving if the
+                # connection has been cancelled on the client side.
+                if self.connection_closed:  # pragma: no cover
+                    self.flush()
+                    self.finish()
+                    return
+
+                # Check if start- or end time are phase relative. If yes
+                # calculate the new start- and/or end time.
+                time_values = self.get_phase_relative_times(
+                    args=args,
                     source=source,
                     receiver=receiver,
-                    components=list(args.components),
-                    units=args.units,
-                    dt=args.dt,
-                    kernelwidth=args.kernelwidth,
-                    starttime=starttime,
-                    endtime=endtime,
-                    scale=args.scale,
-                    format=args.format,
-                    label=args.label,
-                    sacheader=args.sacheader,
+                    min_starttime=min_starttime,
+                    max_endtime=max_endtime,
                 )
-            else:
-                response, mu = _get_seismogram(
-                    db=self.application.db,
+                if time_values is None:
+                    continue
+                starttime, endtime = time_values
+
+                # Validate the source-receiver geometry.
+                self.validate_geometry(source=source, receiver=receiver)
+
+                kwargs = dict(
                     source=source,
                     receiver=receiver,
                     components=list(args.components),
@@ -748,36 +766,55 @@ class SeismogramsHandler(InstaseisTimeSeriesHandler):
                     format=args.format,
                     label=args.label,
                     sacheader=args.sacheader,
+                    cancellation_token=self.cancellation_token,
                 )
 
-            # Check connection once again.
-            if self.connection_closed:  # pragma: no cover
-                self.flush()
-                self.finish()
-                return
-
-            # Set mu just from the first station.
-            if count == 0 and not isinstance(response, Exception):
-                self.set_header("Instaseis-Mu", "%f" % mu)
-
-            # If an exception is returned from the task, re-raise it here.
-            if isinstance(response, Exception):
-                raise response
-            # It might return a list, in that case each item is a bytestring
-            # of SAC file.
-            elif isinstance(response, list):
-                assert args.format == "saczip"
-                for filename, content in response:
-                    zip_file.writestr(filename, content)
-                for data in buf:
-                    self.write(data)
-            # Otherwise it contain MiniSEED which can just directly be
-            # streamed.
-            else:
-                self.write(response)
-            self.flush()
-
-            count += 1
+                # Extract a couple of receivers in parallel but write them
+                # in order. The window keeps the memory bounded.
+                pending.append(self.extract(get_seismogram, **kwargs))
+                if len(pending) < MAX_PENDING_EXTRACTIONS:
+                    continue
+
+                # Await the task. This enables a context switch and thus
+                # async behaviour.
+                result = await pending.popleft()
+
+                # Check connection once again.
+                if self.connection_closed:  # pragma: no cover
+                    self.flush()
+                    self.finish()
+                    return
+
+                self.write_seismogram(
+                    result=result,
+                    args=args,
+                    zip_file=zip_file,
+                    buf=buf,
+                    is_first=not count,
+                )
+                count += 1
+
+            while pending:
+                result = await pending.popleft()
+
+                if self.connection_closed:  # pragma: no cover
+                    self.flush()
+                    self.finish()
+                    return
+
+                self.write_seismogram(
+                    result=result,
+                    args=args,
+                    zip_file=zip_file,
+                    buf=buf,
+                    is_first=not count,
+                )
+                count += 1
+        finally:
+            # Don't extract anything else in case of errors or closed
+            # connections.
+            for future in pending:
+                future.cancel()
 
         # If nothing is written, raise an error. This should really only
         # happen with phase relative offsets with phases not coinciding with
@@ -794,6 +831,7 @@ class SeismogramsHandler(InstaseisTimeSeriesHandler):
 
         # Write the end of the zipfile in case necessary.
         if args.format == "saczip":
+            self.write_server_timing_trailer(zip_file)
             zip_file.close()
             for data in buf:
                 self.write(data)
@@ -7,29 +7,26 @@
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
-import concurrent.futures
 import io
 
 import numpy as np
 import obspy
 import tornado.web
 
-from ... import Source, ForceSource, Receiver
+from ... import binary_format, Source, ForceSource, Receiver
 from ..instaseis_request import InstaseisTimeSeriesHandler
 
-executor = concurrent.futures.ThreadPoolExecutor(12)
 
-
-def _get_seismogram(db, source, receiver, components):
+def _get_seismogram(db, source, receiver, components, format="miniseed"):
     """
     Extract a seismogram from the passed db and write it either to a MiniSEED
-    or a SACZIP file.
+    file or a binary record.
 
     :param db: An open instaseis database.
     :param source: An instaseis source.
     :param receiver: An instaseis receiver.
     :param components: The components.
-    :param callback: callback function of the coroutine.
+    :param format: The output format. Either "miniseed" or "binary".
     """
     # Get the most barebones seismograms possible.
     try:
@@ -69,11 +66,15 @@ def _get_seismogram(db, source, receiver, components):
     for tr in st:
         tr.data = np.require(tr.data, dtype=np.float32)
 
+    mu = st[0].stats.instaseis.mu
+    if format == "binary":
+        return binary_format.write_record(st, mu), mu
+
     with io.BytesIO() as fh:
         st.write(fh, format="mseed")
         fh.seek(0, 0)
         binary_data = fh.read()
-    return binary_data, st[0].stats.instaseis.mu
+    return binary_data, mu
 
 
 class RawSeismogramsHandler(InstaseisTimeSeriesHandler):
@@ -83,6 +84,7 @@ class RawSeismogramsHandler(InstaseisTimeSeriesHandler):
         # what the database supports. Default argument will be set later when
         # the database is known.
         "components": {"type": str},
+        "format": {"type": str, "default": "miniseed"},
         # Source parameters.
         "sourcelatitude": {"type": float, "required": True},
         "sourcelongitude": {"type": float, "required": True},
@@ -120,7 +122,9 @@ class RawSeismogramsHandler(InstaseisTimeSeriesHandler):
     default_sacheader = "geodetic"
 
     def validate_parameters(self, args):
-        pass
+        if args.format == "saczip":
+            msg = "Format must be 'miniseed' or 'binary'."
+            raise tornado.web.HTTPError(400, log_message=msg, reason=msg)
 
     def __init__(self, *args, **kwargs):
         super(RawSeismogramsHandler, self).__init__(*args, **kwargs)
@@ -129,9 +133,10 @@ class RawSeismogramsHandler(InstaseisTimeSeriesHandler):
             self.application.db.default_components
         )
 
-    @tornado.gen.coroutine
-    def get(self):
+    async def get(self):
         args = self.parse_arguments()
+        if await self.reuse_response(args):
+            return
 
         # Figure out the type of source and construct the source object.
         src_params = {
@@ -234,12 +239,14 @@ class RawSeismogramsHandler(InstaseisTimeSeriesHandler):
             )
             raise tornado.web.HTTPError(400, log_message=msg, reason=msg)
 
-        response = yield executor.submit(
+        await self.admit(cost=len(components))
+
+        response = await self.extract(
             _get_seismogram,
-            db=self.application.db,
             source=source,
             receiver=receiver,
             components=components,
+            format=args.format,
         )
 
         # If an exception is returned from the task, re-raise it here.
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Minimal writer of binary SAC files for the ``saczip`` responses.
+
+It produces the same files as ObsPy's SAC writer but packs the header
+directly into arrays which can be prepared once per receiver and reused for
+all its components.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import numpy as np
+from obspy.io.sac.header import FLOATHDRS, FNULL, INTHDRS, INULL, STRHDRS
+from obspy.io.sac.util import utcdatetime_to_sac_nztimes
+
+SNULL = b"-12345  "
+
+_FLOAT_INDEX = {name: _i for _i, name in enumerate(FLOATHDRS)}
+_INT_INDEX = {name: _i for _i, name in enumerate(INTHDRS)}
+# kevnm spans two fields and is not supported.
+_STRING_INDEX = {
+    name: _i for _i, name in enumerate(STRHDRS) if name != "kevnm"
+}
+
+
+class SACHeader(object):
+    """
+    Header of a binary little endian SAC file.
+
+    Unset values are null except for the logical values which default to
+    false and ``lcalda`` which defaults to true, just like in ObsPy.
+
+    :param values: Initial header values by name.
+    """
+
+    def __init__(self, **values):
+        self.floats = np.full(len(FLOATHDRS), FNULL, dtype="<f4")
+        self.ints = np.full(len(INTHDRS), INULL, dtype="<i4")
+        for name, _i in _INT_INDEX.items():
+            if name.startswith("l"):
+                self.ints[_i] = 0
+        self.ints[_INT_INDEX["lcalda"]] = 1
+        self.strings = np.full(len(STRHDRS), SNULL, dtype="S8")
+        self.update(**values)
+
+    def update(self, **values):
+        """
+        Set header values by name. Strings are truncated to eight
+        characters.
+        """
+        for name, value in values.items():
+            if name in _FLOAT_INDEX:
+                self.floats[_FLOAT_INDEX[name]] = value
+            elif name in _INT_INDEX:
+                self.ints[_INT_INDEX[name]] = value
+            elif name in _STRING_INDEX:
+                self.strings[_STRING_INDEX[name]] = value.encode(
+                    "ascii"
+                ).ljust(8)
+            else:
+                raise ValueError("Unknown SAC header '%s'." % name)
+
+    def copy(self):
+        header = SACHeader.__new__(SACHeader)
+        header.floats = self.floats.copy()
+        header.ints = self.ints.copy()
+        header.strings = self.strings.copy()
+        return header
+
+    def tobytes(self):
+        return b"".join(
+            [
+                self.floats.tobytes(),
+                self.ints.tobytes(),
+                self.strings.tobytes(),
+            ]
+        )
+
+
+def write_sac(trace, header):
+    """
+    Binary SAC file of a trace as bytes.
+
+    The reference time is the start time of the trace. The time, data, and
+    identifier headers are set from the trace, all others are taken from
+    ``header`` which is not modified.
+
+    :param trace: The trace.
+    :type trace: :class:`obspy.core.trace.Trace`
+    :param header: The remaining headers.
+    :type header: :class:`SACHeader`
+    """
+    data = np.require(trace.data, dtype="<f4", requirements="C")
+    stats = trace.stats
+    nztimes, microsecond = utcdatetime_to_sac_nztimes(stats.starttime)
+    # Compute e from the single precision values stored in the file.
+    b = float(np.float32(microsecond * 1e-6))
+    delta = float(np.float32(stats.delta))
+
+    header = header.copy()
+    header.update(
+        npts=len(data),
+        delta=delta,
+        b=b,
+        e=b + (len(data) - 1) * delta if len(data) else b,
+        depmin=data.min() if len(data) else FNULL,
+        depmax=data.max() if len(data) else FNULL,
+        depmen=data.mean() if len(data) else FNULL,
+        nvhdr=6,
+        leven=1,
+        lovrok=1,
+        iftype=1,
+        **nztimes,
+    )
+    for name, key in (
+        ("kstnm", "station"),
+        ("knetwk", "network"),
+        ("kcmpnm", "channel"),
+        ("khole", "location"),
+    ):
+        if stats[key]:
+            header.update(**{name: stats[key]})
+    # Avoid copying the data once more.
+    return b"".join([header.tobytes(), memoryview(data)])
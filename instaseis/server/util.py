@@ -10,6 +10,7 @@
 import io
 import math
 import re
+import zipfile
 
 # This is needed for the gps2dist_azimuth() function to always be stable. We
 # thus enforce an import here.
@@ -18,12 +19,12 @@ import geographiclib  # noqa
 import numpy as np
 import obspy
 from obspy.geodetics import gps2dist_azimuth, locations2degrees
-from obspy.io.sac.util import utcdatetime_to_sac_nztimes
 import tornado.web
 
-from .. import ForceSource, FiniteSource
+from .. import binary_format, ForceSource, FiniteSource
 from ..helpers import geocentric_to_elliptic_latitude
 from .. import __version__
+from .sac import SACHeader, write_sac
 
 
 # Valid phase offset pattern including capture groups.
@@ -60,6 +61,17 @@ class IOQueue(object):
         self.data = []
 
 
+def _write_to_zip(zip_file, filename, content):
+    """
+    Add a file to a zip archive with a fixed modification time so identical
+    requests result in byte-identical archives.
+    """
+    info = zipfile.ZipInfo(filename, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zip_file.compression
+    info.external_attr = 0o600 << 16
+    zip_file.writestr(info, content)
+
+
 def _validtimesetting(value):
     try:
         return obspy.UTCDateTime(value)
@@ -146,7 +158,7 @@ def _validate_and_write_waveforms(
     st.trim(starttime, endtime, pad=True, fill_value=0.0, nearest_sample=False)
 
     # Checked in another function and just a sanity check.
-    assert format in ("miniseed", "saczip")
+    assert format in ("miniseed", "saczip", "binary")
 
     if format == "miniseed":
         with io.BytesIO() as fh:
@@ -154,90 +166,24 @@ def _validate_and_write_waveforms(
             fh.seek(0, 0)
             binary_data = fh.read()
         return binary_data, mu
+    # A single record of the binary format.
+    elif format == "binary":
+        return binary_format.write_record(st, mu), mu
     # Write a number of SAC files into an archive.
     elif format == "saczip":
         assert sacheader in ("geodetic", "geocentric")
+        # All headers but the component orientations are the same for all
+        # traces of a receiver.
+        header, baz = _get_sac_header(
+            starttime=starttime,
+            scale=scale,
+            source=source,
+            receiver=receiver,
+            db=db,
+            sacheader=sacheader,
+        )
         byte_strings = []
         for tr in st:
-            # Write SAC headers.
-            tr.stats.sac = obspy.core.AttribDict()
-            # Write WGS84 coordinates to the SAC files (for the Earth models
-            # only).
-            tr.stats.sac.stla = receiver.latitude
-            if sacheader == "geodetic":
-                tr.stats.sac.stla = geocentric_to_elliptic_latitude(
-                    receiver.latitude
-                )
-            tr.stats.sac.stlo = receiver.longitude
-            tr.stats.sac.stdp = receiver.depth_in_m
-            tr.stats.sac.stel = 0.0
-            if isinstance(source, FiniteSource):
-                tr.stats.sac.evla = source.hypocenter_latitude
-                if sacheader == "geodetic":
-                    tr.stats.sac.evla = geocentric_to_elliptic_latitude(
-                        source.hypocenter_latitude
-                    )
-                tr.stats.sac.evlo = source.hypocenter_longitude
-                tr.stats.sac.evdp = source.hypocenter_depth_in_m
-                # Force source has no magnitude.
-                if not isinstance(source, ForceSource):
-                    tr.stats.sac.mag = source.moment_magnitude
-                src_lat = source.hypocenter_latitude
-                src_lng = source.hypocenter_longitude
-            else:
-                tr.stats.sac.evla = source.latitude
-                if sacheader == "geodetic":
-                    tr.stats.sac.evla = geocentric_to_elliptic_latitude(
-                        source.latitude
-                    )
-                tr.stats.sac.evlo = source.longitude
-                tr.stats.sac.evdp = source.depth_in_m
-                # Force source has no magnitude.
-                if not isinstance(source, ForceSource):
-                    tr.stats.sac.mag = source.moment_magnitude
-                src_lat = source.latitude
-                src_lng = source.longitude
-            # Thats what SPECFEM uses for a moment magnitude....
-            tr.stats.sac.imagtyp = 55
-            # The event origin time relative to the reference which I'll
-            # just assume to be the starttime here?
-            tr.stats.sac.o = source.origin_time - starttime
-
-            # For the Earth models, Sac coordinates are elliptical thus it
-            # only makes sense to have elliptical distances.
-            if sacheader != "geocentric":
-                dist_in_m, az, baz = gps2dist_azimuth(
-                    lat1=tr.stats.sac.evla,
-                    lon1=tr.stats.sac.evlo,
-                    lat2=tr.stats.sac.stla,
-                    lon2=tr.stats.sac.stlo,
-                )
-            else:
-                dist_in_m, az, baz = gps2dist_azimuth(
-                    lat1=tr.stats.sac.evla,
-                    lon1=tr.stats.sac.evlo,
-                    lat2=tr.stats.sac.stla,
-                    lon2=tr.stats.sac.stlo,
-                    a=float(db.info.planet_radius),
-                    f=0.0,
-                )
-            tr.stats.sac.dist = dist_in_m / 1000.0
-            tr.stats.sac.az = az
-            tr.stats.sac.baz = baz
-
-            # XXX: Is this correct? Maybe better use some function in
-            # geographiclib?
-            tr.stats.sac.gcarc = locations2degrees(
-                lat1=src_lat,
-                long1=src_lng,
-                lat2=receiver.latitude,
-                long2=receiver.longitude,
-            )
-
-            # Set two more headers. See #45.
-            tr.stats.sac.lpspol = 1
-            tr.stats.sac.lcalda = 0
-
             # Add cmpinc and cmpaz headers.
             #
             # From the SAC format manual:
@@ -253,49 +199,110 @@ def _validate_and_write_waveforms(
             # Special case handling for the green's function route. Don't
             # assign it here as we don't operate in geographical coordinates.
             if len(st) == 10:
-                pass
+                trace_header = header
             elif _c == "Z":
-                tr.stats.sac.cmpinc = 0.0
                 # Zero seems reasonable.
-                tr.stats.sac.cmpaz = 0.0
+                trace_header = header.copy()
+                trace_header.update(cmpinc=0.0, cmpaz=0.0)
             # Explicitly handle the other cases to not run into surprises.
             elif _c in ["E", "N", "R", "T"]:
-                tr.stats.sac.cmpinc = 90.0
                 if _c == "E":
-                    tr.stats.sac.cmpaz = 90.0
+                    cmpaz = 90.0
                 elif _c == "N":
-                    tr.stats.sac.cmpaz = 0.0
+                    cmpaz = 0.0
                 elif _c == "R":
-                    tr.stats.sac.cmpaz = (baz - 180.0) % 360.0
+                    cmpaz = (baz - 180.0) % 360.0
                 elif _c == "T":
-                    tr.stats.sac.cmpaz = (baz - 90.0) % 360.0
+                    cmpaz = (baz - 90.0) % 360.0
                 # Cannot really happen
                 else:  # pragma: no cover
                     raise NotImplementedError
+                trace_header = header.copy()
+                trace_header.update(cmpinc=90.0, cmpaz=cmpaz)
             else:  # pragma: no cover
                 raise NotImplementedError
 
-            # Some provenance.
-            tr.stats.sac.kuser0 = "InstSeis"
-            tr.stats.sac.kuser1 = db.info.velocity_model[:8]
-            tr.stats.sac.user0 = scale
-            # Prefix version numbers to identify them at a glance.
-            tr.stats.sac.kt7 = "A" + db.info.axisem_version[:7]
-            tr.stats.sac.kt8 = "I" + __version__[:7]
-
-            # Times have to be set by hand.
-            t, _ = utcdatetime_to_sac_nztimes(tr.stats.starttime)
-            for key, value in t.items():
-                tr.stats.sac[key] = value
-
-            with io.BytesIO() as temp:
-                tr.write(temp, format="sac")
-                temp.seek(0, 0)
-                filename = "%s%s.sac" % (label, tr.id)
-                byte_strings.append((filename, temp.read()))
+            filename = "%s%s.sac" % (label, tr.id)
+            byte_strings.append((filename, write_sac(tr, trace_header)))
         return byte_strings, mu
 
 
+def _get_sac_header(starttime, scale, source, receiver, db, sacheader):
+    """
+    SAC header shared by all traces of a receiver and the back azimuth.
+    """
+    header = SACHeader()
+    # Write WGS84 coordinates to the SAC files (for the Earth models
+    # only).
+    stla = receiver.latitude
+    if sacheader == "geodetic":
+        stla = geocentric_to_elliptic_latitude(receiver.latitude)
+    header.update(
+        stla=stla, stlo=receiver.longitude, stdp=receiver.depth_in_m, stel=0.0
+    )
+    if isinstance(source, FiniteSource):
+        src_lat = source.hypocenter_latitude
+        src_lng = source.hypocenter_longitude
+        evdp = source.hypocenter_depth_in_m
+    else:
+        src_lat = source.latitude
+        src_lng = source.longitude
+        evdp = source.depth_in_m
+    evla = src_lat
+    if sacheader == "geodetic":
+        evla = geocentric_to_elliptic_latitude(src_lat)
+    header.update(evla=evla, evlo=src_lng, evdp=evdp)
+    # Force source has no magnitude.
+    if not isinstance(source, ForceSource):
+        header.update(mag=source.moment_magnitude)
+    # Thats what SPECFEM uses for a moment magnitude....
+    # The event origin time relative to the reference which I'll
+    # just assume to be the starttime here?
+    header.update(imagtyp=55, o=source.origin_time - starttime)
+
+    # For the Earth models, Sac coordinates are elliptical thus it
+    # only makes sense to have elliptical distances.
+    if sacheader != "geocentric":
+        dist_in_m, az, baz = gps2dist_azimuth(
+            lat1=evla, lon1=src_lng, lat2=stla, lon2=receiver.longitude
+        )
+    else:
+        dist_in_m, az, baz = gps2dist_azimuth(
+            lat1=evla,
+            lon1=src_lng,
+            lat2=stla,
+            lon2=receiver.longitude,
+            a=float(db.info.planet_radius),
+            f=0.0,
+        )
+    header.update(dist=dist_in_m / 1000.0, az=az, baz=baz)
+
+    # XXX: Is this correct? Maybe better use some function in
+    # geographiclib?
+    header.update(
+        gcarc=locations2degrees(
+            lat1=src_lat,
+            long1=src_lng,
+            lat2=receiver.latitude,
+            long2=receiver.longitude,
+        )
+    )
+
+    # Set two more headers. See #45.
+    header.update(lpspol=1, lcalda=0)
+
+    # Some provenance.
+    header.update(
+        kuser0="InstSeis",
+        kuser1=db.info.velocity_model[:8],
+        user0=scale,
+        # Prefix version numbers to identify them at a glance.
+        kt7="A" + db.info.axisem_version[:7],
+        kt8="I" + __version__[:7],
+    )
+    return header, baz
+
+
 def get_gaussian_source_time_function(source_width, dt):
     """
     Returns a gaussian source time function.
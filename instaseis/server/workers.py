@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Process pool backend of the server: every worker process opens the database
+on its own so the extractions are not limited by the global interpreter and
+HDF5 locks of a single process.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import concurrent.futures
+import multiprocessing
+
+from ..database_interfaces import find_and_open_files
+
+# The database of the current worker process.
+_db = None
+
+
+def _initialize_worker(db_path, buffer_size_in_mb, chunk_cache):
+    global _db
+    _db = find_and_open_files(
+        path=db_path,
+        buffer_size_in_mb=buffer_size_in_mb,
+        chunk_cache=chunk_cache,
+    )
+
+
+def call_with_db(func, **kwargs):
+    """
+    Call ``func(db=db, **kwargs)`` with the database of the worker process.
+    """
+    return func(db=_db, **kwargs)
+
+
+def get_process_pool(db_path, workers, buffer_size_in_mb, chunk_cache=None):
+    """
+    Process pool whose workers each open the database.
+
+    The workers are started with the ``"spawn"`` method as forking a process
+    running the IO loop and other threads is not safe.
+
+    :param db_path: Path to the database on disc.
+    :param workers: The number of worker processes.
+    :param buffer_size_in_mb: The buffer size in MB per buffer of each
+        worker.
+    :param chunk_cache: The HDF5 chunk cache parameters of each worker.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_initialize_worker,
+        initargs=(db_path, buffer_size_in_mb, chunk_cache),
+    )
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the benchmarks.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import functools
+import os
+import urllib.parse
+
+from obspy.geodetics import locations2degrees
+import pytest
+
+from .tornado_testing_fixtures import *  # NOQA
+from .tornado_testing_fixtures import DATA, DBS
+
+from instaseis import open_db, Receiver, Source
+from instaseis.benchmark.server import (
+    RequestGenerator,
+    _summarize,
+    parse_mix,
+    run_load,
+)
+from instaseis.benchmark.util import (
+    compare_to_baseline,
+    get_buffer_efficiency,
+    get_stages,
+)
+
+
+def test_parse_mix():
+    assert list(parse_mix("seismograms:4, greens_function").items()) == [
+        ("seismograms", 4.0),
+        ("greens_function", 1.0),
+    ]
+
+    with pytest.raises(ValueError) as err:
+        parse_mix("seismograms:1,stations:1")
+    assert err.value.args[0].startswith("Unknown route 'stations'.")
+    with pytest.raises(ValueError) as err:
+        parse_mix("seismograms:-1")
+    assert err.value.args[0] == "Weights must not be negative."
+    with pytest.raises(ValueError) as err:
+        parse_mix("seismograms:0")
+    assert err.value.args[0] == "At least one route needs a positive weight."
+
+
+@pytest.mark.parametrize("path", list(DBS.values()))
+def test_request_generator(path):
+    """
+    Sources and receivers are within the distance range of the database.
+    """
+    info = open_db(path).info
+    with open(os.path.join(DATA, "nepal.param"), "rb") as fh:
+        finite_source = fh.read()
+    weights = parse_mix(
+        "seismograms:1,seismograms_raw:1,greens_function:1,finite_source:1"
+    )
+    generator = RequestGenerator(
+        info=info, weights=weights, seed=12345, finite_source=finite_source
+    )
+
+    routes = set()
+    for _ in range(200):
+        route, method, url, body = generator()
+        routes.add(route)
+        assert url.startswith("/%s?" % route)
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+
+        if route == "finite_source":
+            assert (method, body) == ("POST", finite_source)
+        else:
+            assert (method, body) == ("GET", None)
+
+        if route == "greens_function":
+            distance = float(params["sourcedistanceindegrees"])
+        else:
+            if route == "finite_source":
+                source = generator._hypocenter
+            else:
+                source = (
+                    float(params["sourcelatitude"]),
+                    float(params["sourcelongitude"]),
+                )
+            distance = locations2degrees(
+                source[0],
+                source[1],
+                float(params["receiverlatitude"]),
+                float(params["receiverlongitude"]),
+            )
+        assert info.min_d <= distance <= info.max_d
+    assert routes == set(weights)
+
+    # Reproducible with a seed.
+    weights = parse_mix("seismograms:1,seismograms_raw:1")
+    a = RequestGenerator(info=info, weights=weights, seed=1)
+    b = RequestGenerator(info=info, weights=weights, seed=1)
+    for _ in range(10):
+        assert a() == b()
+
+
+def test_summarize():
+    records = [
+        ("seismograms", 0.1, 1000, 200),
+        ("seismograms", 0.3, 3000, 200),
+        ("seismograms", 0.2, 0, 400),
+    ]
+    results = _summarize(records, total_time=2.0)
+    assert results["count"] == 3
+    assert results["errors"] == 1
+    assert results["throughput"] == 1.5
+    assert results["bytes_per_second"] == 2000.0
+    assert results["latency_p50"] == pytest.approx(0.2)
+    assert results["latency_p90"] == pytest.approx(0.28)
+    assert results["latency_p99"] == pytest.approx(0.298)
+
+
+def test_run_load(all_clients, io_loop):
+    """
+    Drive the server of the tests with a couple of requests.
+    """
+    client = all_clients
+    mix = "seismograms:2,seismograms_raw:1"
+    if (
+        client.info.is_reciprocal
+        and client.info.components == "vertical and horizontal"
+    ):
+        mix += ",greens_function:1"
+    generator = RequestGenerator(
+        info=client.info, weights=parse_mix(mix), seed=12345, format="miniseed"
+    )
+
+    # The clients block so run them outside of the IO loop of the server.
+    results = io_loop.run_sync(
+        lambda: io_loop.run_in_executor(
+            None,
+            functools.partial(
+                run_load,
+                "http://127.0.0.1:%i" % client.port,
+                generator,
+                concurrency=3,
+                count=12,
+            ),
+        ),
+        timeout=60,
+    )
+
+    assert results["total"]["count"] == 12
+    assert results["total"]["errors"] == 0
+    assert results["total"]["bytes_per_second"] > 0
+    assert (
+        sum(
+            results[route]["count"]
+            for route in generator.routes
+            if route in results
+        )
+        == 12
+    )
+    for r in results.values():
+        assert r["latency_p50"] <= r["latency_p90"] <= r["latency_p99"]
+
+
+def test_compare_to_baseline():
+    baseline = {
+        "a": {
+            "throughput": 100.0,
+            "latency_p50": 0.01,
+            "latency_p90": 0.02,
+            "latency_p99": 0.04,
+        },
+        "b": {"throughput": 10.0, "latency_p50": 0.1},
+        "c": {"throughput": 0.0, "latency_p50": 0.1},
+        "only_in_baseline": {"throughput": 1.0},
+    }
+    results = {
+        # Faster, within the threshold, and slower.
+        "a": {
+            "throughput": 95.0,
+            "latency_p50": 0.005,
+            "latency_p90": 0.0215,
+            "latency_p99": 0.05,
+        },
+        # Less throughput - missing metrics are ignored.
+        "b": {"throughput": 8.0},
+        # Zero baselines are ignored.
+        "c": {"throughput": 5.0, "latency_p50": 0.1},
+        "only_in_results": {"throughput": 1.0},
+    }
+
+    regressions = compare_to_baseline(results, baseline, threshold=0.1)
+    assert [_i[:4] for _i in regressions] == [
+        ("a", "latency_p99", 0.04, 0.05),
+        ("b", "throughput", 10.0, 8.0),
+    ]
+    assert [_i[4] for _i in regressions] == [
+        pytest.approx(0.25),
+        pytest.approx(-0.2),
+    ]
+
+    # Stricter thresholds find more regressions.
+    assert [
+        _i[:2] for _i in compare_to_baseline(results, baseline, threshold=0.0)
+    ] == [
+        ("a", "throughput"),
+        ("a", "latency_p90"),
+        ("a", "latency_p99"),
+        ("b", "throughput"),
+    ]
+    assert compare_to_baseline(baseline, baseline, threshold=0.0) == []
+
+
+@pytest.mark.parametrize("path", list(DBS.values()))
+def test_get_buffer_efficiency(path):
+    db = open_db(path, buffer_size_in_mb=10)
+    efficiency = get_buffer_efficiency(db)
+    meshes = {k for k, v in db.meshes._asdict().items() if v is not None}
+    assert set(efficiency) == meshes
+    for e in efficiency.values():
+        assert e["strain_buffer"] == e["displ_buffer"] == 0.0
+        assert e["strain_buffer_size_in_mb"] == 0
+        assert e["displ_buffer_size_in_mb"] == 0
+
+    if db.info.is_reciprocal:
+        src = Source(latitude=4.0, longitude=3.0, depth_in_m=0, m_rr=1e20)
+    else:
+        src = Source(
+            latitude=4.0,
+            longitude=3.0,
+            depth_in_m=db.info.source_depth * 1000,
+            m_rr=1e20,
+        )
+    rec = Receiver(latitude=10.0, longitude=20.0)
+    for _ in range(3):
+        db.get_seismograms(source=src, receiver=rec)
+    efficiency = get_buffer_efficiency(db)
+    # The same data is read from the buffers the second time.
+    assert any(
+        e["strain_buffer"] > 0 or e["displ_buffer"] > 0
+        for e in efficiency.values()
+    )
+    for e in efficiency.values():
+        assert e["strain_buffer_size_in_mb"] <= 10
+        assert e["displ_buffer_size_in_mb"] <= 10
+    assert any(
+        e["strain_buffer_size_in_mb"] > 0 or e["displ_buffer_size_in_mb"] > 0
+        for e in efficiency.values()
+    )
+
+    # Remote databases have no buffers.
+    assert get_buffer_efficiency(object()) == {}
+
+
+def test_get_stages():
+    stats = {
+        "stages": {
+            "read": {"count": 4, "time": 1.0},
+            "obspy_conversion": {"count": 2, "time": 0.1},
+            "serialization": {"count": 2, "time": 0.5},
+            "reorder": {"count": 4, "time": 0.2},
+            "extraction": {"count": 2, "time": 3.0},
+            "post_processing": {"count": 2, "time": 1.0},
+        },
+        "bytes_read": 0,
+        "buffers": {},
+    }
+    stages = get_stages(stats, total_time=5.0, count=2)
+    assert list(stages) == [
+        "extraction",
+        "read",
+        "reorder",
+        "post_processing",
+        "obspy_conversion",
+        "serialization",
+        "other",
+    ]
+    assert stages["read"] == {"calls": 4, "total_time": 1.0}
+    assert stages["other"] == {"calls": 2, "total_time": 1.0}
+
+    assert (
+        get_stages(
+            {"stages": {}, "bytes_read": 0, "buffers": {}},
+            total_time=1.0,
+            count=3,
+        )
+        == {"other": {"calls": 3, "total_time": 1.0}}
+    )
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the database comparison script.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import inspect
+import os
+
+import numpy as np
+import pytest
+
+from instaseis import open_db
+
+netCDF4 = pytest.importorskip("netCDF4")
+click = pytest.importorskip("click")
+
+from click.testing import CliRunner  # NOQA
+
+from instaseis.scripts.compare_dbs import (  # NOQA
+    _rel_l2_misfit,
+    compare,
+    compare_dbs,
+    get_random_geometries,
+)
+from instaseis.scripts.repack_db import merge_files  # NOQA
+
+
+# Most generic way to get the data folder path.
+DATA = os.path.join(
+    os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))),
+    "data",
+)
+
+BWD_DB = os.path.join(DATA, "100s_db_bwd_displ_only")
+BWD_FILES = [
+    os.path.join(BWD_DB, "PX", "Data", "ordered_output.nc4"),
+    os.path.join(BWD_DB, "PZ", "Data", "ordered_output.nc4"),
+]
+FWD_DB = os.path.join(DATA, "100s_db_fwd")
+
+
+@pytest.fixture(scope="module")
+def merged_dbs(tmpdir_factory):
+    """
+    An exact and a lossy merged version of the backwards database.
+    """
+    dbs = {}
+    for name, quantization in [("exact", None), ("lossy", "int8")]:
+        folder = tmpdir_factory.mktemp(name).strpath
+        merge_files(
+            filenames=BWD_FILES,
+            output_folder=folder,
+            contiguous=False,
+            compression_level=2,
+            quiet=True,
+            quantization=quantization,
+        )
+        dbs[name] = folder
+    return dbs
+
+
+@pytest.mark.parametrize("path", [BWD_DB, FWD_DB])
+def test_random_geometries_stay_within_the_database(path):
+    db = open_db(path)
+    subset = {"max_depth": 100.0, "min_colatitude": 20.0}
+    geometries = get_random_geometries(
+        db.info, count=50, seed=12345, subset=subset
+    )
+    assert len(geometries) == 50
+    for source, receiver in geometries:
+        if db.info.is_reciprocal:
+            assert 0 <= source.depth_in_m <= 100e3
+        # Raises if outside of the database.
+        db.get_seismograms(
+            source=source, receiver=receiver, return_obspy_stream=False
+        )
+
+
+def test_rel_l2_misfit():
+    np.testing.assert_equal(
+        _rel_l2_misfit([4.0, 0.0, 0.0, 1.0], [16.0, 4.0, 0.0, 0.0]),
+        [0.5, 0.0, 0.0, np.inf],
+    )
+    # Zero references only pass if the difference is zero as well.
+    assert _rel_l2_misfit(1e-30, 0.0) > 0.5
+    assert _rel_l2_misfit(0.0, 0.0) < 0.5
+
+
+def test_compare_identical_databases(merged_dbs):
+    summary, failures = compare(
+        [BWD_DB, merged_dbs["exact"]], count=12, seed=1, processes=2
+    )
+    assert failures == {merged_dbs["exact"]: []}
+    assert list(summary[merged_dbs["exact"]].keys()) == list("ZNERT")
+    for s in summary[merged_dbs["exact"]].values():
+        assert s["max_abs_error"] == 0.0
+        assert s["rel_l2_misfit"] == 0.0
+        assert s["within_tolerance"] == 12
+
+
+def test_compare_lossy_database(merged_dbs):
+    dbs = [BWD_DB, merged_dbs["exact"], merged_dbs["lossy"]]
+
+    # Exact comparison.
+    summary, failures = compare(dbs, count=8, seed=2, processes=2)
+    assert failures[merged_dbs["exact"]] == []
+    assert len(failures[merged_dbs["lossy"]]) == 8
+    for s in summary[merged_dbs["lossy"]].values():
+        assert 0 < s["rel_l2_misfit"] < 0.5
+        assert 0 < s["max_abs_error"]
+        assert s["max_abs_error"] / s["max_rel_error"] > s["max_abs_error"]
+
+    # Misfit based.
+    _, failures = compare(dbs, count=8, seed=2, max_misfit=0.5, processes=2)
+    assert failures[merged_dbs["lossy"]] == []
+
+    # Tolerance based.
+    summary, failures = compare(dbs, count=8, seed=2, atol=1.0, processes=2)
+    assert failures[merged_dbs["lossy"]] == []
+    summary, failures = compare(
+        dbs, count=8, seed=2, atol=1e-20, rtol=1e-6, processes=2
+    )
+    assert len(failures[merged_dbs["lossy"]]) == 8
+    assert failures[merged_dbs["exact"]] == []
+
+
+def test_compare_dbs_exit_code(merged_dbs):
+    runner = CliRunner()
+    result = runner.invoke(
+        compare_dbs,
+        ["--count", "4", "--seed", "3", BWD_DB, merged_dbs["exact"]],
+    )
+    assert result.exit_code == 0, result.output
+    assert "All geometries passed." in result.output
+
+    result = runner.invoke(
+        compare_dbs,
+        ["--count", "4", "--seed", "3", BWD_DB, merged_dbs["lossy"]],
+    )
+    assert result.exit_code == 1
+    assert "4 of 4 geometries failed" in result.output
+
+    result = runner.invoke(compare_dbs, [BWD_DB])
+    assert result.exit_code == 2
@@ -18,10 +18,17 @@ import obspy
 import os
 import pytest
 import shutil
+import threading
 
 import instaseis
-from instaseis import InstaseisError, InstaseisNotFoundError
+from instaseis import (
+    InstaseisCancelledError,
+    InstaseisError,
+    InstaseisNotFoundError,
+)
 from instaseis.database_interfaces import find_and_open_files
+from instaseis.database_interfaces.cancellation import CancellationToken
+from instaseis.database_interfaces.statistics import Statistics
 from instaseis.database_interfaces.base_instaseis_db import (
     _get_seismogram_times,
 )
@@ -2228,6 +2235,91 @@ def test_read_on_demand(database_folder, read_on_demand):
     )
 
 
+@pytest.mark.parametrize("database_folder", DBS)
+def test_element_geometry_read_on_demand(database_folder):
+    """
+    The batched element geometry reads in read on demand mode must return
+    the same as the in-memory arrays and be buffered.
+    """
+    db_a = find_and_open_files(database_folder, read_on_demand=True)
+    db_b = find_and_open_files(database_folder, read_on_demand=False)
+    mesh_a = db_a.parsed_mesh
+    mesh_b = db_b.parsed_mesh
+
+    # Unsorted and with duplicates.
+    ids = np.array([17, 3, 100, 3, 0, 191])
+    geom_a = mesh_a.get_element_geometry(ids)
+    geom_b = mesh_b.get_element_geometry(ids)
+    assert len(geom_a) == len(geom_b) == len(ids)
+    for a, b in zip(geom_a, geom_b):
+        np.testing.assert_equal(a.corner_points, b.corner_points)
+        np.testing.assert_equal(a.gll_point_ids, b.gll_point_ids)
+        assert a.eltype == b.eltype
+        assert a.axis == b.axis
+
+    assert len(mesh_a.geometry_buffer._buffer) == 5
+    # Only buffered in read on demand mode.
+    assert len(mesh_b.geometry_buffer._buffer) == 0
+
+    # Second access is fully served from the buffer.
+    mesh_a.get_element_geometry(ids)
+    assert mesh_a.geometry_buffer._hits == len(ids)
+
+
+@pytest.mark.parametrize("database_folder", DBS)
+def test_chunk_cache(database_folder, tmpdir):
+    """
+    Tests setting the HDF5 chunk cache parameters.
+    """
+    # HDF5 shares already open files including their chunk cache settings
+    # so work on a copy.
+    folder = os.path.join(tmpdir.strpath, "db")
+    shutil.copytree(database_folder, folder)
+
+    db = find_and_open_files(
+        folder,
+        chunk_cache={
+            "rdcc_nbytes": 4 * 1024 ** 2,
+            "rdcc_nslots": 1009,
+            "rdcc_w0": 0.5,
+        },
+    )
+    _, nslots, nbytes, w0 = db.parsed_mesh.f.id.get_access_plist().get_cache()
+    assert nslots == 1009
+    assert nbytes == 4 * 1024 ** 2
+    assert w0 == 0.5
+    for m in db.meshes:
+        if m:
+            m.f.close()
+
+    # Auto mode holds a number of chunks of the wavefield datasets.
+    db = find_and_open_files(folder, chunk_cache="auto", buffer_size_in_mb=0)
+    m = db.parsed_mesh
+    if "MergedSnapshots" in m.f:
+        ds = m.f["MergedSnapshots"]
+    else:
+        ds = m.f["Snapshots"][
+            [_i for _i in m.f["Snapshots"].keys() if "stf" not in _i][0]
+        ]
+    if ds.chunks is None:
+        assert m.chunk_cache == {}
+    else:
+        chunk_nbytes = int(np.prod(ds.chunks)) * ds.dtype.itemsize
+        assert m.chunk_cache["rdcc_nbytes"] >= 16 * chunk_nbytes
+        _, nslots, nbytes, _ = m.f.id.get_access_plist().get_cache()
+        assert nbytes == m.chunk_cache["rdcc_nbytes"]
+        assert nslots == m.chunk_cache["rdcc_nslots"]
+    for m in db.meshes:
+        if m:
+            m.f.close()
+
+    with pytest.raises(ValueError) as err:
+        find_and_open_files(folder, chunk_cache={"nbytes": 1})
+    assert err.value.args[0].startswith(
+        "Unknown chunk cache parameter(s): nbytes."
+    )
+
+
 @pytest.mark.skipif(
     "merged_100s_db_fwd" not in _CONFIG_DBS["databases"],
     reason="requires generated tests databases.",
@@ -2587,3 +2679,171 @@ def test_exception_when_using_a_finite_source_instead_of_a_normal_source(db):
         "Please use the `get_seismograms_finite_source()` method to compute "
         "seisomgrams with finite sources."
     )
+
+
+@pytest.mark.parametrize("db", DBS)
+def test_extraction_statistics(db):
+    """
+    Tests the optional timings and counters of the seismogram extraction.
+    """
+    db = find_and_open_files(db, buffer_size_in_mb=10)
+    if db.info.is_reciprocal:
+        src = Source(latitude=4.0, longitude=3.0, depth_in_m=0, m_rr=1e20)
+    else:
+        src = Source(
+            latitude=4.0,
+            longitude=3.0,
+            depth_in_m=db.info.source_depth * 1000,
+            m_rr=1e20,
+        )
+    rec = Receiver(latitude=10.0, longitude=20.0)
+
+    assert db.stats.enabled is False
+    db.stats.enable()
+    st = db.get_seismograms(source=src, receiver=rec)
+    db.get_seismograms(source=src, receiver=rec)
+
+    stats = db.stats.as_dict()
+    for stage in [
+        "extraction",
+        "rotation",
+        "element_location",
+        "kd_tree",
+        "post_processing",
+        "obspy_conversion",
+    ]:
+        assert stats["stages"][stage]["count"] == 2
+        assert stats["stages"][stage]["time"] > 0
+    if db.info.dump_type == "displ_only":
+        assert stats["stages"]["inside_element"]["count"] == 2
+    assert stats["stages"]["interpolation"]["count"] >= 2
+    # The data is read once, the second time it comes from the buffers.
+    assert stats["stages"]["read"]["count"] >= 1
+    assert stats["stages"]["reorder"]["count"] >= 1
+    assert "resampling" not in stats["stages"]
+    assert stats["bytes_read"] > 0
+    hits = sum(_i["hits"] for _i in stats["buffers"].values())
+    misses = sum(_i["misses"] for _i in stats["buffers"].values())
+    assert hits > 0
+    assert misses > 0
+    assert "element_location" in str(db.stats)
+
+    db.get_seismograms(source=src, receiver=rec, dt=db.info.dt / 2.0)
+    assert db.stats.as_dict()["stages"]["resampling"]["count"] >= 1
+
+    # Stages failing half-way are recorded as well.
+    with pytest.raises(ValueError) as err:
+        db.get_seismograms(
+            source=src,
+            receiver=rec,
+            reconvolve_stf=True,
+            remove_source_shift=False,
+        )
+    assert err.value.args[0] == "source has no source time function"
+    stats = db.stats.as_dict()
+    assert stats["stages"]["post_processing"]["count"] == 4
+    assert stats["stages"]["stf_convolution"]["count"] == 1
+
+    db.stats.reset()
+    assert db.stats.as_dict() == {
+        "stages": {},
+        "bytes_read": 0,
+        "buffers": {
+            _k: {"hits": 0, "misses": 0} for _k in stats["buffers"].keys()
+        },
+    }
+
+    # Nothing is recorded when disabled and the results do not change.
+    db.stats.disable()
+    db.get_seismograms(source=src, receiver=rec)
+    assert db.stats.as_dict()["stages"] == {}
+    assert db.stats.bytes_read == 0
+    db = find_and_open_files(db.db_path, buffer_size_in_mb=10)
+    assert db.get_seismograms(source=src, receiver=rec) == st
+    assert db.stats.as_dict()["stages"] == {}
+
+
+def test_extraction_statistics_from_several_threads():
+    """
+    The statistics can be read while other threads record new stages.
+    """
+    stats = Statistics()
+    stats.enable()
+    done = threading.Event()
+
+    def _record():
+        for _i in range(20000):
+            with stats.timer("stage_%i" % _i):
+                pass
+            stats.add_bytes_read(np.zeros(1))
+        done.set()
+
+    thread = threading.Thread(target=_record)
+    thread.start()
+    try:
+        while not done.is_set():
+            stats.as_dict()
+            str(stats)
+    finally:
+        thread.join()
+
+    result = stats.as_dict()
+    assert len(result["stages"]) == 20000
+    assert result["stages"]["stage_12"]["count"] == 1
+    assert result["bytes_read"] == 20000 * 8
+
+
+@pytest.mark.parametrize("bwd_db", BW_DISPL_DBS)
+def test_cancellation_token(bwd_db):
+    """
+    Cancelled extractions raise before extracting anything else.
+    """
+    db = find_and_open_files(bwd_db)
+    db.stats.enable()
+    rec = Receiver(latitude=10.0, longitude=20.0)
+    sources = [
+        Source(latitude=89.91, longitude=0.0, depth_in_m=12000, m_rr=1e15)
+        for _ in range(3)
+    ]
+    for src in sources:
+        src.set_sliprate_dirac(dt=db.info.dt, nsamp=10)
+
+    # Does not change anything while not cancelled.
+    token = CancellationToken()
+    assert not token.cancelled
+    st = db.get_seismograms(source=sources[0], receiver=rec)
+    assert (
+        db.get_seismograms(
+            source=sources[0], receiver=rec, cancellation_token=token
+        )
+        == st
+    )
+
+    # Cancel after the second point source.
+    def progress_callback(current, total):
+        if current == 2:
+            token.cancel()
+
+    db.stats.reset()
+    with pytest.raises(InstaseisCancelledError):
+        db.get_seismograms_finite_source(
+            sources=sources,
+            receiver=rec,
+            progress_callback=progress_callback,
+            cancellation_token=token,
+        )
+    assert token.cancelled
+    assert db.stats.counts["extraction"] == 2
+
+    db.stats.reset()
+    with pytest.raises(InstaseisCancelledError):
+        db.get_seismograms(
+            source=sources[0], receiver=rec, cancellation_token=token
+        )
+    with pytest.raises(InstaseisCancelledError):
+        db.get_greens_function(
+            epicentral_distance_in_degree=20,
+            source_depth_in_m=12000,
+            cancellation_token=token,
+        )
+    assert db.stats.counts["extraction"] == 0
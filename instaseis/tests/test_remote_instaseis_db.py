@@ -10,12 +10,15 @@ Tests for the instaseis remote database.
     (http://www.gnu.org/copyleft/lgpl.html)
 """
 import copy
+import io
 import numpy as np
+import obspy
 import responses
 import warnings
 import pytest
 
 import instaseis
+from instaseis import binary_format
 from .tornado_testing_fixtures import *  # NOQA
 from .tornado_testing_fixtures import _add_callback
 
@@ -275,3 +278,66 @@ def test_source_depth_error_handling(all_remote_dbs):
         "6381000.0 meters. The database supports source radii from "
         "6000000.0 to 6371000.0 meters."
     )
+
+
+@pytest.mark.parametrize("formats", [None, ["miniseed", "saczip", "binary"]])
+def test_seismograms_format_depends_on_server(formats):
+    """
+    The binary format is only requested from servers announcing it. Older
+    servers reject the format parameter and still get MiniSEED requests.
+    """
+    info = {
+        "datetime": "2001-01-01",
+        "slip": [0.0, 1.0],
+        "sliprate": [1.0, 0.0],
+    }
+    if formats is not None:
+        info["formats"] = formats
+    root = {
+        "type": "Instaseis Remote Server",
+        "version": instaseis.__version__,
+    }
+
+    with mock.patch(
+        "instaseis.database_interfaces.remote_instaseis_db"
+        ".RemoteInstaseisDB._download_url"
+    ) as p:
+        p.side_effect = lambda url: copy.deepcopy(
+            info if url.endswith("/info") else root
+        )
+        db = instaseis.open_db("http://localhost:8765432")
+
+    st = obspy.Stream(
+        [
+            obspy.Trace(
+                data=np.arange(10, dtype=np.float32) * (_i + 1),
+                header={"channel": "LX" + _c},
+            )
+            for _i, _c in enumerate("ZNE")
+        ]
+    )
+    response = mock.Mock(status_code=200)
+    if formats is None:
+        with io.BytesIO() as buf:
+            st.write(buf, format="mseed")
+            response.content = buf.getvalue()
+        response.headers = {"Instaseis-Mu": "2.5"}
+    else:
+        response.content = binary_format.write_record(st, mu=2.5)
+        response.headers = {}
+
+    with mock.patch(
+        "instaseis.database_interfaces.remote_instaseis_db.requests.get"
+    ) as p:
+        p.return_value = response
+        data = db._get_seismograms(
+            source=instaseis.Source(latitude=1.0, longitude=2.0, m_rr=1e20),
+            receiver=instaseis.Receiver(latitude=3.0, longitude=4.0),
+            components="ZNE",
+        )
+
+    url = p.call_args[0][0]
+    assert ("format=binary" in url) == (formats is not None)
+    assert data["mu"] == 2.5
+    for tr in st:
+        np.testing.assert_array_equal(data[tr.stats.channel[-1]], tr.data)
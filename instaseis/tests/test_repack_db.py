@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the more specialized options of the database repacking script.
+
+The standard layouts are created and tested over the whole test suite in
+``conftest.py``.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import inspect
+import os
+
+import h5py
+import numpy as np
+import pytest
+import scipy.signal
+
+from instaseis import open_db, Receiver, Source
+
+netCDF4 = pytest.importorskip("netCDF4")
+click = pytest.importorskip("click")
+
+from instaseis.scripts import repack_db  # NOQA
+from instaseis.scripts.repack_db import (  # NOQA
+    get_element_order,
+    hilbert_index,
+    merge_files,
+    zorder_index,
+)
+
+
+# Most generic way to get the data folder path.
+DATA = os.path.join(
+    os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))),
+    "data",
+)
+
+BWD_DB = os.path.join(DATA, "100s_db_bwd_displ_only")
+BWD_FILES = [
+    os.path.join(BWD_DB, "PX", "Data", "ordered_output.nc4"),
+    os.path.join(BWD_DB, "PZ", "Data", "ordered_output.nc4"),
+]
+FWD_DB = os.path.join(DATA, "100s_db_fwd")
+FWD_FILES = [
+    os.path.join(FWD_DB, _i, "Data", "ordered_output.nc4")
+    for _i in ("MZZ", "MXX_P_MYY", "MXZ_MYZ", "MXY_MXX_M_MYY")
+]
+
+
+def _get_seismograms(db, **kwargs):
+    receiver = Receiver(latitude=42.6390, longitude=74.4940)
+    source = Source(
+        latitude=89.91,
+        longitude=0.0,
+        depth_in_m=12000 if db.info.is_reciprocal else None,
+        m_rr=4.710000e24 / 1e7,
+        m_tt=3.810000e22 / 1e7,
+        m_pp=-4.740000e24 / 1e7,
+        m_rt=3.990000e23 / 1e7,
+        m_rp=-8.050000e23 / 1e7,
+        m_tp=-1.230000e24 / 1e7,
+    )
+    return db.get_seismograms(
+        source=source, receiver=receiver, components="ZNERT", **kwargs
+    )
+
+
+def _misfit(st_ref, st):
+    diff = sum(np.sum((a.data - b.data) ** 2) for a, b in zip(st_ref, st))
+    norm = sum(np.sum(a.data ** 2) for a in st_ref)
+    return np.sqrt(diff / norm)
+
+
+@pytest.mark.parametrize(
+    "quantization, max_misfit", [("int16", 1e-3), ("int8", 0.25)]
+)
+@pytest.mark.parametrize(
+    "reference, filenames", [(BWD_DB, BWD_FILES), (FWD_DB, FWD_FILES)]
+)
+def test_quantized_merged_database(
+    tmpdir, quantization, max_misfit, reference, filenames
+):
+    """
+    Quantized merged databases are transparently dequantized when reading.
+    """
+    misfit = merge_files(
+        filenames=filenames,
+        output_folder=tmpdir.strpath,
+        contiguous=False,
+        compression_level=2,
+        quiet=True,
+        quantization=quantization,
+    )
+    assert 0 < misfit < max_misfit
+
+    with h5py.File(
+        os.path.join(tmpdir.strpath, "merged_output.nc4"), "r"
+    ) as f:
+        assert f["MergedSnapshots"].dtype == np.dtype(quantization)
+        assert (
+            f["MergedSnapshotsScale"].shape == f["MergedSnapshots"].shape[:2]
+        )
+
+    st_ref = _get_seismograms(open_db(reference))
+    st = _get_seismograms(open_db(tmpdir.strpath))
+    assert _misfit(st_ref, st) < max_misfit
+
+
+@pytest.mark.parametrize(
+    "reference, filenames", [(BWD_DB, BWD_FILES), (FWD_DB, FWD_FILES)]
+)
+def test_decimated_and_truncated_merged_database(tmpdir, reference, filenames):
+    """
+    Decimation and truncation commute with the seismogram extraction as
+    long as no further processing is applied.
+    """
+    merge_files(
+        filenames=filenames,
+        output_folder=tmpdir.strpath,
+        contiguous=False,
+        compression_level=2,
+        quiet=True,
+        decimation_factor=2,
+        max_length=1000.0,
+    )
+
+    db_ref = open_db(reference)
+    db = open_db(tmpdir.strpath)
+
+    # The test databases have a source shift of 7 samples so the first
+    # sample is dropped to keep the source on a sample.
+    assert db_ref.info.src_shift_samples == 7
+    assert db.info.src_shift_samples == 3
+    assert db.info.dt == pytest.approx(2 * db_ref.info.dt, rel=1e-6)
+    assert db.info.src_shift == pytest.approx(
+        db_ref.info.src_shift - db_ref.info.dt, rel=1e-6
+    )
+    # 1000 seconds after the origin time.
+    assert db.info.npts == 3 + 1000.0 // db.info.dt + 1
+    assert len(db.info.slip) == db.info.npts
+    assert len(db.info.sliprate) == db.info.npts
+
+    st_ref = _get_seismograms(db_ref, remove_source_shift=False)
+    st = _get_seismograms(db, remove_source_shift=False)
+    for tr_ref, tr in zip(st_ref, st):
+        expected = scipy.signal.decimate(
+            tr_ref.data[1:], 2, ftype="fir", zero_phase=True
+        )[: db.info.npts]
+        np.testing.assert_allclose(
+            tr.data, expected, rtol=1e-5, atol=1e-5 * np.abs(expected).max()
+        )
+
+    # The first sample is one original sample later.
+    assert st[0].stats.starttime == st_ref[0].stats.starttime + db_ref.info.dt
+
+    # Also works with the shift removed.
+    origin_time = st_ref[0].stats.starttime + db_ref.info.src_shift
+    st = _get_seismograms(db)
+    assert abs(st[0].stats.starttime - origin_time) < 1e-3
+    assert st[0].stats.npts == db.info.npts - 3
+
+
+@pytest.mark.parametrize(
+    "reference, filenames", [(BWD_DB, BWD_FILES), (FWD_DB, FWD_FILES)]
+)
+def test_spatially_subsetted_merged_database(tmpdir, reference, filenames):
+    """
+    Subsetted databases return the same seismograms within the kept region
+    and refuse to compute anything outside of it.
+    """
+    merge_files(
+        filenames=filenames,
+        output_folder=tmpdir.strpath,
+        contiguous=False,
+        compression_level=2,
+        quiet=True,
+        max_depth=150.0,
+        min_colatitude=30.0,
+        max_colatitude=60.0,
+    )
+
+    db_ref = open_db(reference)
+    db = open_db(tmpdir.strpath)
+
+    assert db.info.min_radius == 6221000.0
+    assert db.info.max_radius == db_ref.info.max_radius
+    assert db.info.min_d == 30.0
+    assert db.info.max_d == 60.0
+    assert db.parsed_mesh.npoints < db_ref.parsed_mesh.npoints
+    with h5py.File(
+        os.path.join(tmpdir.strpath, "merged_output.nc4"), "r"
+    ) as f:
+        nelem = f.attrs["nelem_kwf_global"][0]
+        assert nelem < db_ref.parsed_mesh.f.attrs["nelem_kwf_global"][0]
+        assert f["MergedSnapshots"].shape[0] == nelem
+        assert f["Mesh"]["sem_mesh"][:].max() < db.parsed_mesh.npoints
+
+    def _geometry(distance, depth):
+        # The database's pole is either at the source or at the receiver.
+        if db.info.is_reciprocal:
+            source = Source(
+                latitude=90.0 - distance,
+                longitude=10.0,
+                depth_in_m=depth,
+                m_rr=1e20,
+                m_tt=-2e20,
+                m_pp=1e20,
+                m_rt=3e19,
+            )
+            receiver = Receiver(latitude=90.0, longitude=0.0)
+        else:
+            source = Source(latitude=90.0, longitude=0.0, m_rr=1e20, m_tp=1e19)
+            receiver = Receiver(latitude=90.0 - distance, longitude=10.0)
+        return {"source": source, "receiver": receiver, "components": "ZNE"}
+
+    depths = [0.0, 75000.0, 149000.0] if db.info.is_reciprocal else [None]
+    for distance in (30.5, 45.0, 59.5):
+        for depth in depths:
+            st_ref = db_ref.get_seismograms(**_geometry(distance, depth))
+            st = db.get_seismograms(**_geometry(distance, depth))
+            for tr_ref, tr in zip(st_ref, st):
+                np.testing.assert_array_equal(tr.data, tr_ref.data)
+
+    # Outside of the kept region.
+    with pytest.raises(ValueError):
+        db.get_seismograms(**_geometry(75.0, depths[0]))
+    if db.info.is_reciprocal:
+        with pytest.raises(ValueError):
+            db.get_seismograms(**_geometry(45.0, 200000.0))
+
+
+def test_interrupted_merge_can_be_resumed(tmpdir, monkeypatch):
+    """
+    An interrupted merge resumes from its last checkpoint and results in
+    the same database as an uninterrupted one.
+    """
+    kwargs = {
+        "filenames": BWD_FILES,
+        "contiguous": False,
+        "compression_level": 2,
+        "quiet": True,
+        "quantization": "int16",
+        # Small batches of a couple of elements.
+        "max_memory_in_mb": 1,
+    }
+    reference = tmpdir.mkdir("reference").strpath
+    misfit_ref = merge_files(output_folder=reference, **kwargs)
+
+    class Interrupt(Exception):
+        pass
+
+    # The two source time functions and three batches are processed.
+    calls = []
+    decimate_snapshots = repack_db.decimate_snapshots
+
+    def interrupted_decimate(*args, **kwargs):
+        calls.append(1)
+        if len(calls) > 5:
+            raise Interrupt
+        return decimate_snapshots(*args, **kwargs)
+
+    output = tmpdir.mkdir("output").strpath
+    filename = os.path.join(output, "merged_output.nc4")
+    monkeypatch.setattr(repack_db, "decimate_snapshots", interrupted_decimate)
+    with pytest.raises(Interrupt):
+        merge_files(output_folder=output, **kwargs)
+    monkeypatch.undo()
+
+    with h5py.File(filename, "r") as f:
+        done = f.attrs[repack_db.CHECKPOINT_ATTRIBUTE][0]
+        assert 0 < done < f["MergedSnapshots"].shape[0]
+
+    # Does not silently overwrite an existing file.
+    with pytest.raises(AssertionError):
+        merge_files(output_folder=output, **kwargs)
+
+    # Nor resume it with different parameters - here only the order of the
+    # elements differs.
+    get_element_order = repack_db.get_element_order
+    monkeypatch.setattr(
+        repack_db,
+        "get_element_order",
+        lambda *args, **kwargs: get_element_order(*args, **kwargs)[::-1],
+    )
+    with pytest.raises(ValueError) as err:
+        merge_files(output_folder=output, resume=True, **kwargs)
+    assert "different settings" in err.value.args[0]
+    monkeypatch.undo()
+    with h5py.File(filename, "r") as f:
+        assert f.attrs[repack_db.CHECKPOINT_ATTRIBUTE][0] == done
+
+    misfit = merge_files(
+        output_folder=output, resume=True, workers=4, **kwargs
+    )
+    assert misfit == pytest.approx(misfit_ref)
+
+    with h5py.File(filename, "r") as f, h5py.File(
+        os.path.join(reference, "merged_output.nc4"), "r"
+    ) as f_ref:
+        assert repack_db.CHECKPOINT_ATTRIBUTE not in f.attrs
+        assert repack_db.PARAMETERS_ATTRIBUTE not in f.attrs
+        for name in ("MergedSnapshots", "MergedSnapshotsScale"):
+            np.testing.assert_array_equal(f[name][:], f_ref[name][:])
+
+    # A complete database cannot be resumed.
+    with pytest.raises(ValueError):
+        merge_files(output_folder=output, resume=True, **kwargs)
+
+
+def test_space_filling_curves():
+    """
+    Consecutive cells along a Hilbert curve are neighbours, a Z-order curve
+    interleaves the bits.
+    """
+    order = 3
+    x, y = np.meshgrid(np.arange(2 ** order), np.arange(2 ** order))
+    x = x.ravel()
+    y = y.ravel()
+
+    d = hilbert_index(x, y, order=order)
+    assert sorted(d) == list(range(4 ** order))
+    idx = np.argsort(d)
+    steps = np.abs(np.diff(x[idx])) + np.abs(np.diff(y[idx]))
+    assert np.all(steps == 1)
+
+    d = zorder_index(x, y, order=order)
+    assert sorted(d) == list(range(4 ** order))
+    assert list(
+        zorder_index(
+            np.array([0, 1, 0, 1, 2]), np.array([0, 0, 1, 1, 0]), order=order
+        )
+    ) == [0, 1, 2, 3, 4]
+
+
+def test_access_element_order():
+    """
+    Elements accessed after each other end up next to each other.
+    """
+    s = np.arange(10, dtype=np.float64)
+    z = np.zeros(10)
+    log = np.array([[0.0, 0.0], [9.0, 0.0]] * 5 + [[4.0, 0.0], [2.0, 0.0]])
+    order = get_element_order(s, z, element_order="access", access_log=log)
+    assert sorted(order) == list(range(10))
+    # Most often accessed elements first, then the rest along the curve.
+    assert list(order[:2]) == [0, 9] or list(order[:2]) == [9, 0]
+    assert list(order[2:4]) in ([4, 2], [2, 4])
+    assert list(order[4:]) == [1, 3, 5, 6, 7, 8]
+
+    with pytest.raises(ValueError):
+        get_element_order(s, z, element_order="access")
+    with pytest.raises(ValueError):
+        get_element_order(s, z, element_order="random")
+
+
+@pytest.mark.parametrize("element_order", ["hilbert", "zorder", "access"])
+def test_element_order_of_merged_database(tmpdir, element_order):
+    """
+    The element order is recorded and does not change the seismograms.
+    """
+    access_log = None
+    if element_order == "access":
+        access_log = tmpdir.join("access_log.txt").strpath
+        np.savetxt(
+            access_log,
+            [[1e6, 6e6], [3e6, 5e6], [1e6, 6e6], [5e6, 3e6], [3e6, 5e6]],
+        )
+    output = tmpdir.mkdir("output").strpath
+    merge_files(
+        filenames=BWD_FILES,
+        output_folder=output,
+        contiguous=False,
+        compression_level=2,
+        quiet=True,
+        element_order=element_order,
+        access_log=access_log,
+    )
+
+    with h5py.File(os.path.join(output, "merged_output.nc4"), "r") as f:
+        assert f.attrs[repack_db.ELEMENT_ORDER_ATTRIBUTE] == element_order
+
+    st_ref = _get_seismograms(open_db(BWD_DB))
+    st = _get_seismograms(open_db(output))
+    for tr_ref, tr in zip(st_ref, st):
+        np.testing.assert_array_equal(tr.data, tr_ref.data)
+
+
+def test_multiple_elements_per_chunk(tmpdir):
+    """
+    Chunks with multiple elements do not change the seismograms.
+    """
+    merge_files(
+        filenames=BWD_FILES,
+        output_folder=tmpdir.strpath,
+        contiguous=False,
+        compression_level=2,
+        quiet=True,
+        elements_per_chunk=4,
+        # Batches that do not align with the chunks.
+        max_memory_in_mb=1,
+    )
+
+    with h5py.File(
+        os.path.join(tmpdir.strpath, "merged_output.nc4"), "r"
+    ) as f:
+        assert f["MergedSnapshots"].chunks[0] == 4
+
+    st_ref = _get_seismograms(open_db(BWD_DB))
+    st = _get_seismograms(open_db(tmpdir.strpath))
+    for tr_ref, tr in zip(st_ref, st):
+        np.testing.assert_array_equal(tr.data, tr_ref.data)
@@ -9,21 +9,34 @@ Tests for the Instaseis server.
     GNU Lesser General Public License, Version 3 [non-commercial/academic use]
     (http://www.gnu.org/copyleft/lgpl.html)
 """
+import asyncio
+import concurrent.futures
 import copy
 import io
 import json
+import os
+import threading
+import time
 import zipfile
 
 import obspy
 import numpy as np
+from obspy.io.sac.util import utcdatetime_to_sac_nztimes
 from scipy.integrate import simps
 import pytest
+import tornado.simple_httpclient
 from .tornado_testing_fixtures import *  # NOQA
-from .tornado_testing_fixtures import _assemble_url
+from .tornado_testing_fixtures import _assemble_url, create_async_client, DBS
 
 import instaseis
+from instaseis import binary_format
 from instaseis.helpers import geocentric_to_elliptic_latitude
+from instaseis.server import cache
+from instaseis.server.admission import AdmissionControl
+from instaseis.server import sac
 from instaseis.server import util
+from instaseis.server import workers
+from instaseis.server.routes import seismograms
 
 # Conditionally import mock either from the stdlib or as a separate library.
 import sys
@@ -88,6 +101,16 @@ def test_info_route(all_clients):
     assert request.code == 200
     assert request.headers["Content-Type"] == "application/json; charset=UTF-8"
     result = json.loads(str(request.body.decode("utf8")))
+    # The limits of the server are not part of the database information.
+    assert result.pop("limits") == {
+        "max_requests": None,
+        "max_requests_per_client": None,
+        "max_cost": None,
+        "max_queue_size": None,
+        "queue_timeout": None,
+        "max_size_of_finite_sources": 1000,
+    }
+    assert result.pop("formats") == ["miniseed", "saczip", "binary"]
     # Convert list to arrays.
     client_slip = np.array(result["slip"])
     client_sliprate = np.array(result["sliprate"])
@@ -3873,7 +3896,9 @@ def test_multiple_seismograms_retrieval_invalid_format(
 
     request = fetch_sync(client, _assemble_url("seismograms", **params))
     assert request.code == 400
-    assert request.reason == "Format must either be 'miniseed' or 'saczip'."
+    assert request.reason == (
+        "Format must be 'miniseed', 'saczip', or 'binary'."
+    )
 
 
 def test_multiple_seismograms_retrieval_no_stations(
@@ -6430,3 +6455,1157 @@ def test_cache_is_not_modified(all_clients):
     params["kernelwidth"] = "2"
     params["units"] = "ACCELERATION"
     request_multiple_times("seismograms", params)
+
+
+def test_metrics_route(all_clients):
+    """
+    Tests the metrics in the Prometheus text exposition format.
+    """
+    client = all_clients
+    client.application.db.stats.enable()
+
+    request = fetch_sync(client, "/metrics")
+    assert request.code == 200
+    assert request.headers["Content-Type"] == (
+        "text/plain; version=0.0.4; charset=utf-8"
+    )
+
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "format": "miniseed",
+        "sourcemomenttensor": "1E15,1E15,1E15,1E15,1E15,1E15",
+    }
+    for _ in range(2):
+        request = fetch_sync(client, _assemble_url("seismograms", **params))
+        assert request.code == 200
+    request = fetch_sync(client, _assemble_url("seismograms", unknown=1))
+    assert request.code == 400
+
+    request = fetch_sync(client, "/metrics")
+    assert request.code == 200
+    body = request.body.decode()
+    samples = {}
+    for line in body.splitlines():
+        if line.startswith("#"):
+            assert line.startswith("# HELP ") or line.startswith("# TYPE ")
+            continue
+        name, value = line.rsplit(" ", 1)
+        samples[name] = float(value)
+
+    assert "# TYPE instaseis_requests_total counter" in body
+    assert "# TYPE instaseis_request_duration_seconds histogram" in body
+    assert (
+        samples[
+            'instaseis_requests_total{route="/seismograms",method="GET",'
+            'code="200"}'
+        ]
+        == 2
+    )
+    assert (
+        samples[
+            'instaseis_requests_total{route="/seismograms",method="GET",'
+            'code="400"}'
+        ]
+        == 1
+    )
+    assert (
+        samples[
+            'instaseis_requests_total{route="/metrics",method="GET",'
+            'code="200"}'
+        ]
+        == 1
+    )
+    assert (
+        samples[
+            'instaseis_request_duration_seconds_bucket{route="/seismograms",'
+            'le="+Inf"}'
+        ]
+        == 3
+    )
+    assert (
+        samples[
+            'instaseis_request_duration_seconds_count{route="/seismograms"}'
+        ]
+        == 3
+    )
+    # The metrics request itself.
+    assert samples["instaseis_requests_in_flight"] == 1
+    assert (
+        samples['instaseis_executor_queue_depth{executor="extraction"}'] == 0
+    )
+    assert samples["instaseis_read_bytes_total"] > 0
+    assert samples['instaseis_stage_calls_total{stage="extraction"}'] == 2
+    assert samples['instaseis_stage_seconds_total{stage="extraction"}'] > 0
+
+    hits = sum(
+        v for k, v in samples.items() if k.startswith("instaseis_buffer_hits")
+    )
+    misses = sum(
+        v
+        for k, v in samples.items()
+        if k.startswith("instaseis_buffer_misses")
+    )
+    assert hits > 0
+    assert misses > 0
+    assert any(
+        k.startswith("instaseis_buffer_size_bytes") and v > 0
+        for k, v in samples.items()
+    )
+
+
+def test_server_timing(all_clients_ttimes_callback):
+    """
+    Tests the optional Server-Timing header and the JSON trailer.
+    """
+    client = all_clients_ttimes_callback
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "sourcemomenttensor": "1E15,1E15,1E15,1E15,1E15,1E15",
+        "sourcewidth": 200.0,
+        "starttime": "P%2D10",
+        "format": "saczip",
+    }
+    assert client.application.server_timing is None
+
+    # The first request reads from disc and fills the buffers.
+    client.application.server_timing = "header"
+    request = fetch_sync(client, _assemble_url("seismograms", **params))
+    assert request.code == 200
+    timings = {}
+    for metric in request.headers["Server-Timing"].split(", "):
+        name, duration = metric.split(";dur=")
+        timings[name] = float(duration)
+    for stage in (
+        "element_location",
+        "read",
+        "stf_convolution",
+        "serialization",
+        "travel_time",
+        "total",
+    ):
+        assert timings[stage] > 0
+    assert timings["total"] >= timings["extraction"]
+    with zipfile.ZipFile(io.BytesIO(request.body)) as zf:
+        assert "server_timing.json" not in zf.namelist()
+
+    client.application.server_timing = None
+    request = fetch_sync(client, _assemble_url("seismograms", **params))
+    assert request.code == 200
+    assert "Server-Timing" not in request.headers
+    with zipfile.ZipFile(io.BytesIO(request.body)) as zf:
+        assert "server_timing.json" not in zf.namelist()
+
+    client.application.server_timing = "trailer"
+    request = fetch_sync(client, _assemble_url("seismograms", **params))
+    assert request.code == 200
+    assert "Server-Timing" not in request.headers
+    with zipfile.ZipFile(io.BytesIO(request.body)) as zf:
+        assert zf.namelist()[-1] == "server_timing.json"
+        trailer = json.loads(zf.read("server_timing.json").decode())
+    # Everything is buffered now.
+    assert "read" not in trailer
+    assert trailer["total"] > trailer["extraction"] > 0
+
+
+def test_parallel_extraction_keeps_receiver_order(all_clients):
+    """
+    Receivers are extracted in parallel but must be written in order.
+    """
+    client = all_clients
+    db = instaseis.open_db(client.filepath)
+
+    coordinates = [
+        {
+            "latitude": -40.0 + 4.0 * i,
+            "longitude": 3.0 * i,
+            "network": "XX",
+            "station": "S%03i" % i,
+        }
+        for i in range(20)
+    ]
+    assert len(coordinates) > seismograms.MAX_PENDING_EXTRACTIONS
+
+    def station_coordinates_callback(networks, stations):
+        return coordinates
+
+    client.application.station_coordinates_callback = (
+        station_coordinates_callback
+    )
+
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "sourcemomenttensor": "1E15,1E15,1E15,1E15,1E15,1E15",
+        "network": "XX",
+        "station": "*",
+        "format": "miniseed",
+    }
+    request = fetch_sync(client, _assemble_url("seismograms", **params))
+    assert request.code == 200
+    st = obspy.read(request.buffer)
+    n = len(db.default_components)
+    assert [tr.stats.station for tr in st] == [
+        c["station"] for c in coordinates for _ in range(n)
+    ]
+
+    source = instaseis.Source(
+        latitude=10,
+        longitude=10,
+        depth_in_m=client.source_depth,
+        origin_time=obspy.UTCDateTime(1900, 1, 1),
+        m_rr=1e15,
+        m_tt=1e15,
+        m_pp=1e15,
+        m_rt=1e15,
+        m_rp=1e15,
+        m_tp=1e15,
+    )
+    for i in (0, 9, 19):
+        st_db = db.get_seismograms(
+            source=source,
+            receiver=instaseis.Receiver(
+                latitude=coordinates[i]["latitude"],
+                longitude=coordinates[i]["longitude"],
+            ),
+        )
+        st_server = st.select(station=coordinates[i]["station"])
+        for tr_server, tr_db in zip(st_server, st_db):
+            np.testing.assert_allclose(
+                tr_server.data, tr_db.data, atol=1e-6 * tr_db.data.ptp()
+            )
+
+
+@pytest.mark.parametrize(
+    "path", [DBS["db_bwd_displ_only"], DBS["db_fwd"]], ids=["bwd", "fwd"]
+)
+def test_process_pool_executor(io_loop, request, path):
+    """
+    Worker processes open the database themselves and return the same
+    results as the default threads.
+    """
+    client = create_async_client(io_loop, request, path)
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "sourcemomenttensor": "1E15,1E15,1E15,1E15,1E15,1E15",
+        "format": "miniseed",
+    }
+    raw_params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "mrr": 1e15,
+        "mtt": 1e15,
+        "mpp": 1e15,
+        "mrt": 1e15,
+        "mrp": 1e15,
+        "mtp": 1e15,
+    }
+
+    urls = [
+        _assemble_url("seismograms", **params),
+        _assemble_url("seismograms", sourcewidth=200.0, **params),
+        _assemble_url("seismograms_raw", **raw_params),
+    ]
+    expected = []
+    for url in urls:
+        r = fetch_sync(client, url)
+        assert r.code == 200
+        expected.append(obspy.read(r.buffer))
+
+    executor = workers.get_process_pool(
+        db_path=path, workers=2, buffer_size_in_mb=10
+    )
+    request.addfinalizer(executor.shutdown)
+    client.application.executor = executor
+
+    for url, st_expected in zip(urls, expected):
+        # Starting the worker processes is slow on busy machines.
+        r = fetch_sync(client, url, request_timeout=120)
+        assert r.code == 200
+        st = obspy.read(r.buffer)
+        assert len(st) == len(st_expected)
+        for tr, tr_expected in zip(st, st_expected):
+            assert tr.stats.station == tr_expected.stats.station
+            np.testing.assert_allclose(tr.data, tr_expected.data)
+
+    # Errors are returned from the workers.
+    r = fetch_sync(
+        client, _assemble_url("seismograms", **dict(params, components="X"))
+    )
+    assert r.code == 400
+    assert r.reason.startswith("Could not extract seismogram.")
+
+
+def test_metrics_of_several_processes(all_clients, tmpdir):
+    """
+    The processes of a pre-forked server share their metrics through a
+    directory.
+    """
+    client = all_clients
+    client.application.db.stats.enable()
+    executors = {"extraction": client.application.executor}
+
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "format": "miniseed",
+        "sourcemomenttensor": "1E15,1E15,1E15,1E15,1E15,1E15",
+    }
+    request = fetch_sync(client, _assemble_url("seismograms", **params))
+    assert request.code == 200
+
+    metrics = client.application.metrics
+    snapshot = metrics.snapshot(client.application.db, executors)
+    single = metrics.exposition(client.application.db, executors)
+
+    # Pretend the same happened in another process.
+    metrics.directory = str(tmpdir)
+    with open(os.path.join(str(tmpdir), "1.json"), "wt") as fh:
+        json.dump(snapshot, fh)
+    metrics.write_snapshot(client.application.db, executors)
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        ["1.json", "%i.json" % os.getpid()]
+    )
+
+    def _parse(body):
+        return dict(
+            line.rsplit(" ", 1)
+            for line in body.splitlines()
+            if not line.startswith("#")
+        )
+
+    single = _parse(single)
+    double = _parse(metrics.exposition(client.application.db, executors))
+    assert sorted(single) == sorted(double)
+    for key in (
+        'instaseis_requests_total{route="/seismograms",method="GET",'
+        'code="200"}',
+        'instaseis_request_duration_seconds_count{route="/seismograms"}',
+        'instaseis_stage_calls_total{stage="extraction"}',
+        "instaseis_read_bytes_total",
+    ):
+        assert float(double[key]) == 2 * float(single[key])
+    for key in single:
+        if key.startswith("instaseis_buffer_hit_ratio"):
+            assert float(double[key]) == float(single[key])
+
+    # Snapshots of processes which died without removing them are ignored
+    # and deleted - be it that the process is gone or that its id has been
+    # reused by another process.
+    metrics.write_snapshot(client.application.db, executors)
+    for pid in (99999999, os.getppid()):
+        filename = os.path.join(str(tmpdir), "%i.json" % pid)
+        with open(filename, "wt") as fh:
+            json.dump(snapshot, fh)
+    os.utime(filename, (time.time() - 60, time.time() - 60))
+    assert double == _parse(
+        metrics.exposition(client.application.db, executors)
+    )
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        ["1.json", "%i.json" % os.getpid()]
+    )
+
+    # Processes remove their own snapshot when shutting down.
+    metrics.remove_snapshot()
+    assert os.listdir(str(tmpdir)) == ["1.json"]
+
+
+def test_response_cache_and_etags(all_clients, tmpdir):
+    """
+    Identical GET requests have the same strong ETag, the same body, and are
+    served from the response cache if enabled.
+    """
+    client = all_clients
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "sourcemomenttensor": "1E15,1E15,1E15,1E15,1E15,1E15",
+        "format": "saczip",
+    }
+    url = _assemble_url("seismograms", **params)
+    assert client.application.response_cache is None
+
+    # Works without the cache.
+    first = fetch_sync(client, url)
+    assert first.code == 200
+    etag = first.headers["Etag"]
+    second = fetch_sync(client, url)
+    assert second.headers["Etag"] == etag
+    assert second.body == first.body
+
+    # Equivalent arguments result in the same key.
+    other = dict(params, sourcelatitude="10.0", format="SACZIP")
+    request = fetch_sync(client, _assemble_url("seismograms", **other))
+    assert request.headers["Etag"] == etag
+
+    request = fetch_sync(client, url, headers={"If-None-Match": etag})
+    assert request.code == 304
+    assert not request.body
+
+    # A different query has a different tag.
+    other = dict(params, receiverlatitude=-11)
+    request = fetch_sync(client, _assemble_url("seismograms", **other))
+    assert request.headers["Etag"] != etag
+
+    raw_params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "mrr": 1e15,
+        "mtt": 1e15,
+        "mpp": 1e15,
+        "mrt": 1e15,
+        "mrp": 1e15,
+        "mtp": 1e15,
+    }
+    raw_url = _assemble_url("seismograms_raw", **raw_params)
+    raw = fetch_sync(client, raw_url)
+    assert raw.code == 200
+
+    try:
+        for directory in (None, str(tmpdir)):
+            response_cache = cache.ResponseCache(
+                max_size_in_bytes=10 * 1024 ** 2, directory=directory
+            )
+            client.application.response_cache = response_cache
+
+            for u, reference in ((url, first), (raw_url, raw)):
+                for _ in range(2):
+                    request = fetch_sync(client, u)
+                    assert request.code == 200
+                    assert request.body == reference.body
+                    assert request.headers["Etag"] == reference.headers["Etag"]
+                    assert (
+                        request.headers["Instaseis-Mu"]
+                        == reference.headers["Instaseis-Mu"]
+                    )
+                    assert (
+                        request.headers["Content-Type"]
+                        == reference.headers["Content-Type"]
+                    )
+            assert len(response_cache) == 2
+            assert response_cache.misses == 2
+            assert response_cache.hits == 2
+            if directory is not None:
+                assert len(os.listdir(directory)) == 2
+
+            # Errors are not cached.
+            fetch_sync(client, _assemble_url("seismograms", format="saczip"))
+            assert len(response_cache) == 2
+
+            # Too small for both responses - the least recently used one is
+            # evicted.
+            response_cache.max_size_in_bytes = response_cache.size - 1
+            fetch_sync(client, _assemble_url("seismograms", **other))
+            assert len(response_cache) == 1
+            if directory is not None:
+                assert len(os.listdir(directory)) == 1
+    finally:
+        client.application.response_cache = None
+
+
+def test_failures_while_streaming_are_not_cached(
+    all_clients, tmpdir, monkeypatch
+):
+    """
+    Errors after parts of the response have been sent cannot change the
+    status code anymore. Such truncated responses must not be cached.
+    """
+    client = all_clients
+    coordinates = [
+        {
+            "latitude": -10.0 - i,
+            "longitude": -10.0,
+            "network": "XX",
+            "station": "S%03i" % i,
+        }
+        for i in range(2)
+    ]
+
+    def station_coordinates_callback(networks, stations):
+        return coordinates
+
+    client.application.station_coordinates_callback = (
+        station_coordinates_callback
+    )
+
+    url = _assemble_url(
+        "seismograms",
+        sourcelatitude=10,
+        sourcelongitude=10,
+        sourcedepthinmeters=client.source_depth,
+        sourcemomenttensor="1E15,1E15,1E15,1E15,1E15,1E15",
+        network="XX",
+        station="*",
+        format="miniseed",
+    )
+    reference = fetch_sync(client, url)
+    assert reference.code == 200
+
+    # Write the first receiver before the second one fails.
+    get_seismogram = seismograms._get_seismogram
+    calls = []
+
+    def failing_get_seismogram(*args, **kwargs):
+        calls.append(None)
+        if len(calls) > 1:
+            raise ValueError("Failure while streaming.")
+        return get_seismogram(*args, **kwargs)
+
+    response_cache = cache.ResponseCache(
+        max_size_in_bytes=10 * 1024 ** 2, directory=str(tmpdir)
+    )
+    client.application.response_cache = response_cache
+    try:
+        with monkeypatch.context() as m:
+            m.setattr(seismograms, "MAX_PENDING_EXTRACTIONS", 1)
+            m.setattr(seismograms, "_get_seismogram", failing_get_seismogram)
+            request = fetch_sync(client, url)
+        assert len(calls) == 2
+        # Too late for another status code.
+        assert request.code == 200
+        assert 0 < len(request.body) < len(reference.body)
+        assert len(response_cache) == 0
+        assert not os.listdir(str(tmpdir))
+        assert not client.application.in_flight_responses
+
+        request = fetch_sync(client, url)
+        assert request.code == 200
+        assert request.body == reference.body
+        assert len(response_cache) == 1
+    finally:
+        client.application.response_cache = None
+
+
+def test_identical_concurrent_requests_are_coalesced(all_clients):
+    """
+    Identical requests arriving while the first one is processed wait for
+    and share its response.
+    """
+    client = all_clients
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "sourcemomenttensor": "1E15,1E15,1E15,1E15,1E15,1E15",
+        "format": "miniseed",
+    }
+    url = "http://localhost:%i%s" % (
+        client.port,
+        _assemble_url("seismograms", **params),
+    )
+
+    # Block the only thread until all requests arrived.
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    event = threading.Event()
+    executor.submit(event.wait)
+
+    async def f():
+        futures = [client.fetch(url) for _ in range(5)]
+        while client.application.metrics.in_flight < 5:
+            await asyncio.sleep(0.01)
+        event.set()
+        return await asyncio.gather(*futures)
+
+    stats = client.application.db.stats
+    original_executor = client.application.executor
+    client.application.executor = executor
+    stats.reset()
+    stats.enable()
+    try:
+        responses = client.io_loop.run_sync(f)
+    finally:
+        stats.disable()
+        client.application.executor = original_executor
+        executor.shutdown()
+
+    assert stats.counts["extraction"] == 1
+    assert not client.application.in_flight_responses
+    for response in responses:
+        assert response.code == 200
+        assert response.body == responses[0].body
+        assert response.headers["Etag"] == responses[0].headers["Etag"]
+        assert (
+            response.headers["Instaseis-Mu"]
+            == responses[0].headers["Instaseis-Mu"]
+        )
+
+
+def test_admission_control_costs(io_loop):
+    """
+    Cheaper requests overtake more expensive ones and a single request more
+    expensive than the limit runs alone.
+    """
+    admission = AdmissionControl(max_cost=10)
+
+    async def f():
+        first = admission.enqueue(client="a", cost=8)
+        assert first.state == "admitted"
+        large = admission.enqueue(client="b", cost=30)
+        small = admission.enqueue(client="c", cost=2)
+        other = admission.enqueue(client="c", cost=3)
+        assert [large.state, small.state, other.state] == [
+            "waiting",
+            "admitted",
+            "waiting",
+        ]
+        assert admission.clients == {"a": 1, "b": 1, "c": 2}
+
+        admission.release(first)
+        assert [large.state, other.state] == ["waiting", "admitted"]
+        assert await admission.wait(other)
+        assert admission.admitted_cost == 5
+
+        admission.release(small)
+        admission.release(other)
+        admission.release(other)
+        assert await admission.wait(large)
+        assert admission.admitted == 1
+        admission.release(large)
+        assert admission.admitted == admission.admitted_cost == 0
+        assert not admission.clients
+
+    io_loop.run_sync(f)
+
+
+def test_admission_control_does_not_starve_expensive_requests(io_loop):
+    """
+    Cheap requests stop overtaking an expensive one once it waited for
+    too long.
+    """
+    admission = AdmissionControl(max_cost=10, max_overtake_time=0.2)
+
+    async def f():
+        cheap = [admission.enqueue(client="a", cost=2) for _ in range(3)]
+        expensive = admission.enqueue(client="b", cost=9)
+        assert expensive.state == "waiting"
+
+        # A steady stream of cheap requests, one finishing whenever the
+        # next one arrives.
+        for _i in range(100):
+            admission.release(
+                [_t for _t in cheap if _t.state == "admitted"][0]
+            )
+            cheap.append(admission.enqueue(client="a", cost=2))
+            if expensive.state == "admitted":
+                break
+            if not _i:
+                # Initially they overtake the expensive request.
+                assert cheap[-1].state == "admitted"
+            await asyncio.sleep(0.01)
+
+        assert expensive.state == "admitted"
+        assert await admission.wait(expensive)
+        assert admission.admitted_cost == 9
+        # Everything else waits for it to finish.
+        assert cheap[-1].state == "waiting"
+        admission.release(expensive)
+        assert cheap[-1].state == "admitted"
+        for ticket in cheap:
+            admission.release(ticket)
+        assert admission.admitted == admission.admitted_cost == 0
+        assert not admission.queue
+
+    io_loop.run_sync(f)
+
+
+def test_admission_control_rejections(all_clients):
+    """
+    Requests over the limits are rejected with a 429 or 503 and a
+    Retry-After header.
+    """
+    client = all_clients
+
+    def url(latitude):
+        return "http://localhost:%i%s" % (
+            client.port,
+            _assemble_url(
+                "seismograms",
+                sourcelatitude=10,
+                sourcelongitude=10,
+                sourcedepthinmeters=client.source_depth,
+                receiverlatitude=latitude,
+                receiverlongitude=-10,
+                sourcemomenttensor="1E15,1E15,1E15,1E15,1E15,1E15",
+            ),
+        )
+
+    async def f(count):
+        # Block the only thread - the first request is admitted and
+        # waits for it.
+        event = threading.Event()
+        client.application.executor.submit(event.wait)
+        futures = [client.fetch(url(-10), raise_error=False)]
+        while not client.application.admission.admitted:
+            await asyncio.sleep(0.01)
+        for i in range(1, count):
+            futures.append(client.fetch(url(-10 - i), raise_error=False))
+            await asyncio.sleep(0.05)
+        rejected = await futures[-1]
+        event.set()
+        return await asyncio.gather(*futures[:-1]), rejected
+
+    original_executor = client.application.executor
+    client.application.executor = concurrent.futures.ThreadPoolExecutor(1)
+    try:
+        client.application.admission = AdmissionControl(
+            max_requests_per_client=2
+        )
+        (first, second), rejected = client.io_loop.run_sync(lambda: f(3))
+        assert first.code == second.code == 200
+        assert rejected.code == 429
+        assert rejected.headers["Retry-After"] == "5"
+
+        client.application.admission = AdmissionControl(
+            max_requests=1, max_queue_size=1
+        )
+        (first, second), rejected = client.io_loop.run_sync(lambda: f(3))
+        assert first.code == second.code == 200
+        assert rejected.code == 503
+        assert rejected.headers["Retry-After"] == "5"
+
+        client.application.admission = AdmissionControl(
+            max_requests=1, queue_timeout=0.01, retry_after=2
+        )
+        (first,), rejected = client.io_loop.run_sync(lambda: f(2))
+        assert first.code == 200
+        assert rejected.code == 503
+        assert rejected.headers["Retry-After"] == "2"
+
+        admission = client.application.admission
+        assert admission.admitted == 0
+        assert not admission.queue
+        assert not admission.clients
+
+        request = fetch_sync(client, "/info")
+        assert json.loads(request.body.decode())["limits"] == {
+            "max_requests": 1,
+            "max_requests_per_client": None,
+            "max_cost": None,
+            "max_queue_size": None,
+            "queue_timeout": 0.01,
+            "max_size_of_finite_sources": 1000,
+        }
+    finally:
+        client.application.executor.shutdown()
+        client.application.executor = original_executor
+        client.application.admission = AdmissionControl()
+
+
+def test_extractions_stop_once_the_client_is_gone(all_clients):
+    """
+    Closing the connection cancels the extractions that are already
+    waiting for a thread.
+    """
+    client = all_clients
+    url = "http://localhost:%i%s" % (
+        client.port,
+        _assemble_url(
+            "seismograms",
+            sourcelatitude=10,
+            sourcelongitude=10,
+            sourcedepthinmeters=client.source_depth,
+            receiverlatitude=-10,
+            receiverlongitude=-10,
+            sourcemomenttensor="1E15,1E15,1E15,1E15,1E15,1E15",
+        ),
+    )
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    event = threading.Event()
+    executor.submit(event.wait)
+
+    async def f():
+        # The client gives up while the extraction waits for the thread.
+        with pytest.raises(tornado.simple_httpclient.HTTPTimeoutError):
+            await client.fetch(url, request_timeout=0.5)
+        for _ in range(100):
+            if not client.application.metrics.in_flight:
+                break
+            await asyncio.sleep(0.01)
+        event.set()
+        # Wait for all previously submitted tasks.
+        await client.io_loop.run_in_executor(executor, int)
+
+    stats = client.application.db.stats
+    original_executor = client.application.executor
+    client.application.executor = executor
+    stats.reset()
+    stats.enable()
+    try:
+        client.io_loop.run_sync(f)
+    finally:
+        event.set()
+        stats.disable()
+        client.application.executor = original_executor
+        executor.shutdown()
+
+    assert client.application.metrics.requests[("/seismograms", "GET", 499)]
+    assert stats.counts["extraction"] == 0
+
+
+def test_sac_writer_matches_obspy():
+    """
+    The SAC writer of the server produces the same files as ObsPy.
+    """
+    tr = obspy.read()[0]
+    tr.data = np.require(tr.data, dtype=np.float32)
+    tr.stats.location = "00"
+    tr.stats.starttime += 0.0123456
+    values = {
+        "stla": 1.5,
+        "evdp": 1000.0,
+        "gcarc": 12.3,
+        "imagtyp": 55,
+        "lpspol": 1,
+        "lcalda": 0,
+        "kuser0": "InstSeis",
+        "kt7": "A1234567",
+    }
+    header = sac.SACHeader(**values)
+
+    tr.stats.sac = obspy.core.AttribDict(values)
+    t, _ = utcdatetime_to_sac_nztimes(tr.stats.starttime)
+    tr.stats.sac.update(t)
+    with io.BytesIO() as buf:
+        tr.write(buf, format="sac")
+        expected = buf.getvalue()
+
+    assert bytes(sac.write_sac(tr, header)) == expected
+    # The header is not modified.
+    assert header.ints[sac._INT_INDEX["npts"]] == sac.INULL
+
+    with pytest.raises(ValueError):
+        header.update(unknown=1.0)
+
+
+def test_binary_format(all_clients_station_coordinates_callback):
+    """
+    The binary format contains the same data as MiniSEED, one record per
+    receiver.
+    """
+    client = all_clients_station_coordinates_callback
+
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "sourcedepthinmeters": client.source_depth,
+        "sourcemomenttensor": "100000,100000,100000,100000,100000,100000",
+        # This will return two stations.
+        "network": "IU,B*",
+        "station": "ANT*,ANM?",
+    }
+
+    request = fetch_sync(
+        client, _assemble_url("seismograms", format="miniseed", **params)
+    )
+    assert request.code == 200
+    st_mseed = obspy.read(request.buffer)
+
+    request = fetch_sync(
+        client, _assemble_url("seismograms", format="binary", **params)
+    )
+    assert request.code == 200
+    assert request.headers["Content-Type"] == "application/octet-stream"
+    assert request.headers["Content-Disposition"].endswith(".bin")
+    data = request.buffer.read()
+
+    records = list(binary_format.iter_records(data))
+    assert sorted((_i["network"], _i["station"]) for _i, _ in records) == [
+        ("IU", "ANMO"),
+        ("IU", "ANTO"),
+    ]
+    for header, arrays in records:
+        assert header["version"] == 1
+        assert header["mu"] == pytest.approx(
+            float(request.headers["Instaseis-Mu"])
+        )
+        assert len(arrays) == len(header["channels"])
+        for array in arrays:
+            assert array.dtype == np.float32
+            assert len(array) == header["npts"]
+
+    st_binary = binary_format.read(data)
+    assert len(st_binary) == len(st_mseed)
+    for tr_binary, tr_mseed in zip(st_binary, st_mseed):
+        assert tr_binary.id == tr_mseed.id
+        assert tr_binary.stats.starttime == tr_mseed.stats.starttime
+        # MiniSEED stores the sampling rate less precisely.
+        assert tr_binary.stats.delta == pytest.approx(tr_mseed.stats.delta)
+        np.testing.assert_array_equal(tr_binary.data, tr_mseed.data)
+
+    # The raw route also supports it, but not SAC files.
+    params = {
+        "sourcelatitude": 10,
+        "sourcelongitude": 10,
+        "receiverlatitude": -10,
+        "receiverlongitude": -10,
+        "mtt": "100000",
+        "mpp": "200000",
+        "mrr": "300000",
+        "mrt": "400000",
+        "mrp": "500000",
+        "mtp": "600000",
+    }
+    request = fetch_sync(client, _assemble_url("seismograms_raw", **params))
+    assert request.code == 200
+    st_mseed = obspy.read(request.buffer)
+
+    request = fetch_sync(
+        client, _assemble_url("seismograms_raw", format="binary", **params)
+    )
+    assert request.code == 200
+    st_binary = binary_format.read(request.buffer.read())
+    assert len(st_binary) == len(st_mseed)
+    for tr_binary, tr_mseed in zip(st_binary, st_mseed):
+        assert tr_binary.id == tr_mseed.id
+        np.testing.assert_array_equal(tr_binary.data, tr_mseed.data)
+
+    request = fetch_sync(
+        client, _assemble_url("seismograms_raw", format="saczip", **params)
+    )
+    assert request.code == 400
+    assert request.reason == "Format must be 'miniseed' or 'binary'."
+
+    with pytest.raises(instaseis.InstaseisError):
+        list(binary_format.iter_records(b"bogus data"))
+
+
+def test_coalesced_requests_elect_a_single_new_leader(all_clients):
+    """
+    If the request processing a response is cancelled, only one of the
+    identical requests waiting for it extracts the seismograms again.
+    """
+    client = all_clients
+    url = "http://localhost:%i%s" % (
+        client.port,
+        _assemble_url(
+            "seismograms",
+            sourcelatitude=10,
+            sourcelongitude=10,
+            sourcedepthinmeters=client.source_depth,
+            receiverlatitude=-10,
+            receiverlongitude=-10,
+            sourcemomenttensor="1E15,1E15,1E15,1E15,1E15,1E15",
+            format="miniseed",
+        ),
+    )
+    metrics = client.application.metrics
+
+    # Block the only thread until all requests arrived.
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    event = threading.Event()
+    executor.submit(event.wait)
+
+    async def f():
+        # The first request gives up while the others wait for it.
+        leader = client.fetch(url, request_timeout=0.5)
+        while metrics.in_flight < 1:
+            await asyncio.sleep(0.01)
+        futures = [client.fetch(url) for _ in range(4)]
+        while metrics.in_flight < 5:
+            await asyncio.sleep(0.01)
+        with pytest.raises(tornado.simple_httpclient.HTTPTimeoutError):
+            await leader
+        while metrics.in_flight > 4:
+            await asyncio.sleep(0.01)
+        event.set()
+        return await asyncio.gather(*futures)
+
+    stats = client.application.db.stats
+    original_executor = client.application.executor
+    client.application.executor = executor
+    stats.reset()
+    stats.enable()
+    try:
+        responses = client.io_loop.run_sync(f)
+    finally:
+        event.set()
+        stats.disable()
+        client.application.executor = original_executor
+        executor.shutdown()
+
+    assert stats.counts["extraction"] == 1
+    assert not client.application.in_flight_responses
+    for response in responses:
+        assert response.code == 200
+        assert response.body == responses[0].body
+
+
+def test_coalesced_requests_take_over_if_the_leader_fails(
+    all_clients, monkeypatch
+):
+    """
+    If the request processing a response fails after parts of it have been
+    sent, the identical requests waiting for it don't get the truncated
+    response but one of them extracts the seismograms again.
+    """
+    client = all_clients
+    coordinates = [
+        {
+            "latitude": -10.0 - i,
+            "longitude": -10.0,
+            "network": "XX",
+            "station": "S%03i" % i,
+        }
+        for i in range(2)
+    ]
+
+    def station_coordinates_callback(networks, stations):
+        return coordinates
+
+    client.application.station_coordinates_callback = (
+        station_coordinates_callback
+    )
+
+    url = "http://localhost:%i%s" % (
+        client.port,
+        _assemble_url(
+            "seismograms",
+            sourcelatitude=10,
+            sourcelongitude=10,
+            sourcedepthinmeters=client.source_depth,
+            sourcemomenttensor="1E15,1E15,1E15,1E15,1E15,1E15",
+            network="XX",
+            station="*",
+            format="miniseed",
+        ),
+    )
+    reference = client.io_loop.run_sync(lambda: client.fetch(url))
+    assert reference.code == 200
+    metrics = client.application.metrics
+
+    # The leader writes the first receiver before the second one fails.
+    get_seismogram = seismograms._get_seismogram
+    calls = []
+
+    def failing_get_seismogram(*args, **kwargs):
+        calls.append(None)
+        if len(calls) == 2:
+            raise ValueError("Failure while streaming.")
+        return get_seismogram(*args, **kwargs)
+
+    monkeypatch.setattr(seismograms, "MAX_PENDING_EXTRACTIONS", 1)
+    monkeypatch.setattr(seismograms, "_get_seismogram", failing_get_seismogram)
+
+    # Block the only thread until all requests arrived.
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    event = threading.Event()
+    executor.submit(event.wait)
+
+    async def f():
+        leader = client.fetch(url)
+        while metrics.in_flight < 1:
+            await asyncio.sleep(0.01)
+        futures = [client.fetch(url) for _ in range(4)]
+        while metrics.in_flight < 5:
+            await asyncio.sleep(0.01)
+        event.set()
+        return await asyncio.gather(leader, *futures)
+
+    original_executor = client.application.executor
+    client.application.executor = executor
+    try:
+        leader, *responses = client.io_loop.run_sync(f)
+    finally:
+        event.set()
+        client.application.executor = original_executor
+        executor.shutdown()
+
+    # Once for the failed leader and once for the new one.
+    assert len(calls) == 4
+    assert not client.application.in_flight_responses
+    assert leader.code == 200
+    assert len(leader.body) < len(reference.body)
+    for response in responses:
+        assert response.code == 200
+        assert response.body == reference.body
+
+
+def test_responses_are_only_buffered_for_the_cache_or_waiters(
+    all_clients, tmpdir, monkeypatch
+):
+    """
+    Without a response cache and without identical requests waiting for it,
+    a response is not kept in memory once streaming started.
+    """
+    client = all_clients
+    coordinates = [
+        {
+            "latitude": -10.0 - i,
+            "longitude": -10.0,
+            "network": "XX",
+            "station": "S%03i" % i,
+        }
+        for i in range(2)
+    ]
+
+    def station_coordinates_callback(networks, stations):
+        return coordinates
+
+    client.application.station_coordinates_callback = (
+        station_coordinates_callback
+    )
+    url = _assemble_url(
+        "seismograms",
+        sourcelatitude=10,
+        sourcelongitude=10,
+        sourcedepthinmeters=client.source_depth,
+        sourcemomenttensor="1E15,1E15,1E15,1E15,1E15,1E15",
+        network="XX",
+        station="*",
+        format="miniseed",
+    )
+
+    # Record the shared responses while extracting the second receiver,
+    # i.e. after the first one has been written.
+    get_seismogram = seismograms._get_seismogram
+    in_flight = []
+
+    def recording_get_seismogram(*args, **kwargs):
+        in_flight.append(len(client.application.in_flight_responses))
+        return get_seismogram(*args, **kwargs)
+
+    monkeypatch.setattr(seismograms, "MAX_PENDING_EXTRACTIONS", 1)
+    monkeypatch.setattr(
+        seismograms, "_get_seismogram", recording_get_seismogram
+    )
+
+    reference = fetch_sync(client, url)
+    assert reference.code == 200
+    assert in_flight == [1, 0]
+
+    client.application.response_cache = cache.ResponseCache(
+        max_size_in_bytes=10 * 1024 ** 2, directory=str(tmpdir)
+    )
+    in_flight = []
+    try:
+        request = fetch_sync(client, url)
+    finally:
+        client.application.response_cache = None
+    assert request.body == reference.body
+    assert in_flight == [1, 1]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the layout tuning script.
+
+:copyright:
+    Lion Krischer (lion.krischer@gmail.com), 2020
+:license:
+    GNU Lesser General Public License, Version 3 [non-commercial/academic use]
+    (http://www.gnu.org/copyleft/lgpl.html)
+"""
+import inspect
+import os
+
+import h5py
+import pytest
+
+
+netCDF4 = pytest.importorskip("netCDF4")
+click = pytest.importorskip("click")
+
+from instaseis.scripts.tune_layout import (  # NOQA
+    get_layouts,
+    repack_options,
+    tune_layout,
+)
+
+
+# Most generic way to get the data folder path.
+DATA = os.path.join(
+    os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))),
+    "data",
+)
+
+BWD_DB = os.path.join(DATA, "100s_db_bwd_displ_only")
+
+
+def test_get_layouts():
+    layouts = get_layouts(
+        methods=["merge", "transpose"],
+        compression_levels=[2],
+        elements_per_chunk=[1, 8],
+        points_per_chunk=[None, 64],
+    )
+    assert [repack_options(_i) for _i in layouts] == [
+        "--method merge --contiguous",
+        "--method merge --compression_level 2",
+        "--method merge --compression_level 2 --elements_per_chunk 8",
+        "--method transpose --contiguous",
+        "--method transpose --compression_level 2",
+        "--method transpose --compression_level 2 --points_per_chunk 64",
+    ]
+    assert len(get_layouts(contiguous=False)) == 10
+
+
+def test_tune_layout(tmpdir):
+    layouts = get_layouts(
+        methods=["merge"], compression_levels=[1], elements_per_chunk=[1, 4]
+    )
+    results = tune_layout(
+        input_folder=BWD_DB,
+        work_folder=tmpdir.strpath,
+        layouts=layouts,
+        count=10,
+        seed=1,
+        subset={"max_depth": 100.0, "max_colatitude": 40.0},
+        quiet=True,
+    )
+
+    assert len(results) == len(layouts)
+    assert sorted(_i["options"] for _i in results) == sorted(
+        repack_options(_i) for _i in layouts
+    )
+    throughput = [_i["throughput"] for _i in results]
+    assert throughput == sorted(throughput, reverse=True)
+    for r in results:
+        assert 0 < r["latency_p50"] <= r["latency_p90"]
+        assert r["size_in_mb"] > 0
+
+    # The samples have actually been written with the given layout.
+    r = [_i for _i in results if _i["layout"].get("elements_per_chunk") == 4]
+    with h5py.File(os.path.join(r[0]["path"], "merged_output.nc4"), "r") as f:
+        assert f["MergedSnapshots"].chunks[0] == 4
+        assert f.attrs["kernel wavefield colatmax"][0] == 40.0
+
+
+def test_tune_layout_without_subset(tmpdir):
+    """
+    The other layouts are full copies and cannot be compared to subsetted
+    merged layouts.
+    """
+    layouts = get_layouts(
+        methods=["merge", "transpose"],
+        compression_levels=[1],
+        elements_per_chunk=[4],
+        contiguous=False,
+    )
+    with pytest.raises(ValueError) as err:
+        tune_layout(
+            input_folder=BWD_DB,
+            work_folder=tmpdir.strpath,
+            layouts=layouts,
+            subset={"max_depth": 100.0, "max_colatitude": None},
+            quiet=True,
+        )
+    assert err.value.args[0] == (
+        "Only merged layouts can be restricted to a spatial subset."
+    )
+
+    results = tune_layout(
+        input_folder=BWD_DB,
+        work_folder=tmpdir.strpath,
+        layouts=layouts,
+        count=5,
+        seed=1,
+        subset={"max_depth": None},
+        quiet=True,
+    )
+    assert sorted(_i["options"] for _i in results) == sorted(
+        repack_options(_i) for _i in layouts
+    )
+    r = [_i for _i in results if _i["layout"]["method"] == "merge"]
+    with h5py.File(os.path.join(r[0]["path"], "merged_output.nc4"), "r") as f:
+        assert f.attrs["kernel wavefield colatmax"][0] == 180.0